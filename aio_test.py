@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import random
+import socket
+import threading
+import time
+import unittest
+from coapthon import defines
+from coapthon.messages.message import Message
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from coapthon.server.aio import CoAP, EventLoop
+from plugtest_resources import TestResource, ObservableResource
+
+__author__ = 'Giacomo Tanganelli'
+
+
+class CoAPServerAio(CoAP):
+    def __init__(self, host, port, starting_mid=None):
+        CoAP.__init__(self, (host, port), starting_mid=starting_mid)
+        self.add_resource('test/', TestResource())
+        self.add_resource('obs/', ObservableResource(coap_server=self))
+
+
+class AioTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server_address = ("127.0.0.1", 5683)
+        self.current_mid = random.randint(1, 1000)
+        self.server_mid = random.randint(1000, 2000)
+        self.server = CoAPServerAio("127.0.0.1", 5683, starting_mid=self.server_mid)
+        self.server_thread = threading.Thread(target=self.server.listen, args=(10,))
+        self.server_thread.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(5)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.close()
+        self.server_thread.join(timeout=25)
+        self.server = None
+
+    def _request(self, path, mid_type="CON", observe=None, token="tk"):
+        req = Request()
+        req.code = defines.Codes.GET.number
+        req.uri_path = path
+        req.type = defines.Types[mid_type]
+        req.mid = self.current_mid
+        req.token = token
+        if observe is not None:
+            req.observe = observe
+        self.current_mid += 1
+        return Serializer.serialize(req)
+
+    def _receive(self):
+        datagram, source = self.sock.recvfrom(4096)
+        return Serializer.deserialize(datagram, source)
+
+    def test_event_loop(self):
+        loop = EventLoop()
+        calls = []
+        loop.call_later(0.2, calls.append, "late")
+        loop.call_later(0.1, calls.append, "early")
+        cancelled = loop.call_later(0.05, calls.append, "cancelled")
+        cancelled.cancel()
+        anticipated = loop.call_later(60, calls.append, "anticipated")
+        loop.call_soon(calls.append, "soon")
+        thread = threading.Thread(target=loop.run)
+        thread.start()
+        anticipated.set()
+        time.sleep(0.3)
+        loop.call_later(0, loop.stop)
+        thread.join(timeout=5)
+        loop.close()
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(sorted(calls[:2]), ["anticipated", "soon"])
+        self.assertEqual(calls[2:], ["early", "late"])
+
+    def test_get(self):
+        datagram = self._request("/test")
+        self.sock.sendto(datagram, self.server_address)
+        response = self._receive()
+        self.assertEqual(response.type, defines.Types["ACK"])
+        self.assertEqual(response.mid, self.current_mid - 1)
+        self.assertEqual(response.code, defines.Codes.CONTENT.number)
+        self.assertEqual(response.payload, "Test Resource")
+
+        # duplicate
+        self.sock.sendto(datagram, self.server_address)
+        duplicate = self._receive()
+        self.assertEqual(duplicate.mid, response.mid)
+        self.assertEqual(duplicate.payload, "Test Resource")
+
+    def test_notification_retransmission(self):
+        self.sock.sendto(self._request("/obs", observe=0), self.server_address)
+        response = self._receive()
+        self.assertEqual(response.observe, 1)
+
+        resource = self.server.root["/obs"]
+        resource.payload = "Notification"
+        # notifications can be sent by threads other than the loop
+        threading.Thread(target=self.server.notify, args=(resource,)).start()
+        notification = self._receive()
+        self.assertEqual(notification.type, defines.Types["CON"])
+        self.assertEqual(notification.mid, self.server_mid)
+        self.assertEqual(notification.payload, "Notification")
+
+        retransmission = self._receive()
+        self.assertEqual(retransmission.mid, self.server_mid)
+
+        ack = Message()
+        ack.type = defines.Types["ACK"]
+        ack.mid = self.server_mid
+        ack.code = defines.Codes.EMPTY.number
+        self.sock.sendto(Serializer.serialize(ack), self.server_address)
+        # no more retransmissions; the periodic update of the resource may send other notifications
+        deadline = time.time() + defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR * 4
+        while time.time() < deadline:
+            self.sock.settimeout(deadline - time.time())
+            try:
+                notification = self._receive()
+            except socket.timeout:
+                break
+            self.assertNotEqual(notification.mid, self.server_mid)
+
+    def test_close(self):
+        start = time.time()
+        self.server.close()
+        self.server_thread.join(timeout=5)
+        self.assertFalse(self.server_thread.isAlive())
+        self.assertLess(time.time() - start, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import getopt
+import logging
+import multiprocessing
+import sys
+import time
+
+from coapthon.server.cluster import Cluster
+from plugtest_resources import TestResource
+from server_benchmark import load, percentile, requests
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tcluster_benchmark.py [-s] [-m] [-c] [-n] [-w] [-p]"
+    print "Options:"
+    print "\t-s, --server=\t\tthreaded or aio (default threaded)"
+    print "\t-m, --max-workers=\tLargest number of workers, doubled from 1 (default number of CPUs)"
+    print "\t-c, --clients=\t\tNumber of load generator processes (default 2 per CPU)"
+    print "\t-n, --number=\t\tNumber of requests per client (default 5000)"
+    print "\t-w, --window=\t\tNumber of outstanding requests per client (default 64)"
+    print "\t-p, --port=\t\tServer port (default 5690)"
+
+
+def setup(server):
+    """
+    Add the resource of the benchmark to the server of a worker.
+    """
+    server.add_resource("test/", TestResource())
+
+
+def client(port, number, window, results):  # pragma: no cover
+    """
+    Load generator process: every client has its own socket, hence its own 4-tuple and worker.
+    """
+    elapsed, latencies, lost = load(port, requests(number), window)
+    results.put((elapsed, latencies, lost))
+
+
+def run(kind, workers, clients, port, number, window):  # pragma: no cover
+    """
+    Start a cluster and load it with several client processes.
+
+    :return: the throughput, the median and 99th percentile latencies and the number of lost requests
+    """
+    if kind == "aio":
+        from coapthon.server.aio import CoAP
+    else:
+        from coapthon.server.coap import CoAP
+    cluster = Cluster(("127.0.0.1", port), setup, workers=workers, server_class=CoAP)
+    cluster.start()
+    time.sleep(0.5)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client, args=(port, number, window, results)) for i in range(clients)]
+    start = time.time()
+    for process in processes:
+        process.start()
+    latencies = []
+    lost = 0
+    for process in processes:
+        elapsed, client_latencies, client_lost = results.get()
+        latencies.extend(client_latencies)
+        lost += client_lost
+    elapsed = time.time() - start
+    for process in processes:
+        process.join()
+    cluster.stop()
+    return len(latencies) / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99), lost
+
+
+def main(argv):  # pragma: no cover
+    kind = "threaded"
+    cpus = multiprocessing.cpu_count()
+    clients = 2 * cpus
+    number = 5000
+    window = 64
+    port = 5690
+    max_workers = cpus
+    try:
+        opts, args = getopt.getopt(argv, "hs:m:c:n:w:p:", ["help", "server=", "max-workers=", "clients=", "number=",
+                                                            "window=", "port="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-s", "--server"):
+            kind = a
+        elif o in ("-m", "--max-workers"):
+            max_workers = int(a)
+        elif o in ("-c", "--clients"):
+            clients = int(a)
+        elif o in ("-n", "--number"):
+            number = int(a)
+        elif o in ("-w", "--window"):
+            window = int(a)
+        elif o in ("-p", "--port"):
+            port = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    logging.disable(logging.DEBUG)
+    workers = [1]
+    while workers[-1] * 2 <= max_workers:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != max_workers:
+        workers.append(max_workers)
+    print "%s server, %d CPUs, %d clients x %d CON GET requests, %d outstanding" % (kind, cpus, clients, number,
+                                                                                    window)
+    for count in workers:
+        throughput, p50, p99, lost = run(kind, count, clients, port, number, window)
+        print "%2d workers %10.0f req/s   p50 %7.2f ms   p99 %7.2f ms   lost %d" % (count, throughput, p50 * 1e3,
+                                                                                     p99 * 1e3, lost)
+        port += 1
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
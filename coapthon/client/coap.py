@@ -1,3 +1,5 @@
+import collections
+import errno
 import logging.config
 import os
 import random
@@ -6,6 +8,8 @@ import threading
 import time
 
 from coapthon import defines
+from coapthon.datagramio import DatagramIO
+from coapthon.eventloop import EventLoop
 from coapthon.layers.blocklayer import BlockLayer
 from coapthon.layers.messagelayer import MessageLayer
 from coapthon.layers.observelayer import ObserveLayer
@@ -31,7 +35,8 @@ class CoAP(object):
     """
     Client class to perform requests to remote servers.
     """
-    def __init__(self, server, starting_mid, callback, sock=None, cb_ignore_read_exception=None, cb_ignore_write_exception=None):
+    def __init__(self, server, starting_mid, callback, sock=None, cb_ignore_read_exception=None, cb_ignore_write_exception=None,
+                 datagram_io=None, loop=None, congestion=None):
         """
         Initialize the client.
 
@@ -41,14 +46,28 @@ class CoAP(object):
         :param sock: if a socket has been created externally, it can be used directly
         :param cb_ignore_read_exception: Callback function to handle exception raised during the socket read operation
         :param cb_ignore_write_exception: Callback function to handle exception raised during the socket write operation        
+        :param datagram_io: the I/O backend of the socket. If None, datagrams are received and sent one at a time
+        :param loop: a running EventLoop shared with other clients, which receives the datagrams and runs the
+        retransmissions. If None, the client has its own receiver thread and scheduler
+        :param congestion: a CoCoA object that adapts the retransmission timeouts to every destination. If None, the
+        timeouts are the fixed ones of RFC 7252
         """
         self._currentMID = starting_mid
         self._server = server
         self._callback = callback
         self._cb_ignore_read_exception = cb_ignore_read_exception
         self._cb_ignore_write_exception = cb_ignore_write_exception
+        if datagram_io is None:
+            datagram_io = DatagramIO(1152)
+        self._datagram_io = datagram_io
+        self._congestion = congestion
         self.stopped = threading.Event()
-        self.to_be_stopped = []
+        self._loop = loop
+        if loop is None:
+            self._scheduler = EventLoop()
+            self._scheduler.start(name="CoAP-Client-Scheduler")
+        else:
+            self._scheduler = loop
 
         self._messageLayer = MessageLayer(self._currentMID)
         self._blockLayer = BlockLayer()
@@ -69,15 +88,20 @@ class CoAP(object):
             self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         self._receiver_thread = None
+        if loop is not None:
+            self._socket.setblocking(0)
+            loop.add_reader(self._socket, self._read_datagrams)
 
     def close(self):
         """
-        Stop the client.
+        Stop the client. A client served by a shared loop must be closed after the loop has been stopped.
 
         """
         self.stopped.set()
-        for event in self.to_be_stopped:
-            event.set()
+        if self._loop is None:
+            self._scheduler.stop()
+        else:
+            self._loop.remove_reader(self._socket)
         if self._receiver_thread is not None:
             self._receiver_thread.join()
         try:
@@ -88,6 +112,25 @@ class CoAP(object):
             pass
         self._socket.close()
 
+    @property
+    def scheduler(self):
+        """
+        Return the loop that runs the retransmissions of the client.
+
+        :rtype : EventLoop
+        :return: the scheduler
+        """
+        return self._scheduler
+
+    @property
+    def congestion(self):
+        """
+        Return the congestion control of the client.
+
+        :return: the CoCoA object, or None
+        """
+        return self._congestion
+
     @property
     def current_mid(self):
         """
@@ -126,29 +169,18 @@ class CoAP(object):
             message = self._messageLayer.send_empty(None, None, message)
             self.send_datagram(message)
 
-    def end_observation(self, token):
+    def end_observation(self, token, server=None):
         """
         Remove an observation token from our records.
 
         :param token: the token for the observation
+        :param server: the observed server, by default the server of the client
         """
         dummy = Message()
         dummy.token = token
-        dummy.destination = self._server
+        dummy.destination = server if server is not None else self._server
         self._observeLayer.remove_subscriber(dummy)
 
-    @staticmethod
-    def _wait_for_retransmit_thread(transaction):
-        """
-        Only one retransmit thread at a time, wait for other to finish
-        
-        """
-        if hasattr(transaction, 'retransmit_thread'):
-            while transaction.retransmit_thread is not None:
-                logger.debug("Waiting for retransmit thread to finish ...")
-                time.sleep(0.01)
-                continue
-
     def _send_block_request(self, transaction):
         """
         A former request resulted in a block wise transfer. With this method, the block wise transfer
@@ -175,19 +207,19 @@ class CoAP(object):
         raw_message = serializer.serialize(message)
 
         try:
-            self._socket.sendto(raw_message, (host, port))
+            self._datagram_io.send(self._socket, [(raw_message, (host, port))])
         except Exception as e:
             if self._cb_ignore_write_exception is not None and callable(self._cb_ignore_write_exception):
                 if not self._cb_ignore_write_exception(e, self):
                     raise
 
-        if self._receiver_thread is None or not self._receiver_thread.isAlive():
+        if self._loop is None and (self._receiver_thread is None or not self._receiver_thread.isAlive()):
             self._receiver_thread = threading.Thread(target=self.receive_datagram)
             self._receiver_thread.start()
 
     def _start_retransmission(self, transaction, message):
         """
-        Start the retransmission task.
+        Schedule the retransmission of a message.
 
         :type transaction: Transaction
         :param transaction: the transaction that owns the message that needs retransmission
@@ -196,114 +228,145 @@ class CoAP(object):
         """
         with transaction:
             if message.type == defines.Types['CON']:
-                future_time = random.uniform(defines.ACK_TIMEOUT, (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
-                transaction.retransmit_stop = threading.Event()
-                self.to_be_stopped.append(transaction.retransmit_stop)
-                transaction.retransmit_thread = threading.Thread(target=self._retransmit,
-                                                                 name=str('%s-Retry-%d' % (threading.current_thread().name, message.mid)),
-                                                                 args=(transaction, message, future_time, 0))
-                transaction.retransmit_thread.start()
+                if self._congestion is not None:
+                    future_time, backoff = self._congestion.initial_timeout(message.destination)
+                else:
+                    future_time = random.uniform(defines.ACK_TIMEOUT,
+                                                 (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
+                    backoff = 2
+                transaction.retransmit_stop = self._scheduler.call_later(future_time, self._retransmit, transaction,
+                                                                         message, future_time, 0, backoff)
 
-    def _retransmit(self, transaction, message, future_time, retransmit_count):
+    def _retransmit(self, transaction, message, future_time, retransmit_count, backoff=2):
         """
-        Thread function to retransmit the message in the future
+        Retransmit a message, if still needed, and schedule the next attempt.
+        Runs on the scheduler, or in the receiver thread when the message is acknowledged.
 
         :param transaction: the transaction that owns the message that needs retransmission
         :param message: the message that needs the retransmission task
-        :param future_time: the amount of time to wait before a new attempt
+        :param future_time: the amount of time waited before this attempt
         :param retransmit_count: the number of retransmissions
+        :param backoff: the factor that multiplies the timeout at every attempt
         """
-        with transaction:
-            logger.debug("retransmit loop ... enter")
-            while retransmit_count <= defines.MAX_RETRANSMIT \
-                    and (not message.acknowledged and not message.rejected) \
-                    and not transaction.retransmit_stop.isSet():
-                transaction.retransmit_stop.wait(timeout=future_time)
-                if not message.acknowledged and not message.rejected and not transaction.retransmit_stop.isSet():
-                    retransmit_count += 1
-                    future_time *= 2
-                    if retransmit_count < defines.MAX_RETRANSMIT:
-                        logger.debug("retransmit loop ... retransmit Request")
-                        self.send_datagram(message)
-
-            if message.acknowledged or message.rejected:
-                message.timeouted = False
-            else:
-                logger.warning("Give up on message {message}".format(message=message.line_print))
-                message.timeouted = True
+        if not message.acknowledged and not message.rejected and not self.stopped.isSet():
+            retransmit_count += 1
+            future_time *= backoff
+            if retransmit_count < defines.MAX_RETRANSMIT:
+                logger.debug("retransmit loop ... retransmit Request")
+                self.send_datagram(message)
+            if retransmit_count <= defines.MAX_RETRANSMIT:
+                transaction.retransmit_stop = self._scheduler.call_later(future_time, self._retransmit, transaction,
+                                                                         message, future_time, retransmit_count,
+                                                                         backoff)
+                return
 
-                # Inform the user, that nothing was received
-                self._callback(message)
+        if message.acknowledged or message.rejected:
+            message.timeouted = False
+            if message.acknowledged and self._congestion is not None:
+                # measured from the first transmission, the retransmissions tell the strong and weak samples apart
+                self._congestion.sample(message.destination, time.time() - message.timestamp, retransmit_count)
+        else:
+            logger.warning("Give up on message {message}".format(message=message.line_print))
+            message.timeouted = True
 
-            try:
-                self.to_be_stopped.remove(transaction.retransmit_stop)
-            except ValueError:
-                pass
-            transaction.retransmit_stop = None
-            transaction.retransmit_thread = None
+            # Inform the user, that nothing was received
+            self._callback(message)
 
-            logger.debug("retransmit loop ... exit")
+        transaction.retransmit_stop = None
 
     def receive_datagram(self):
         """
         Receive datagram from the UDP socket and invoke the callback function.
         """
         logger.debug("Start receiver Thread")
+        datagrams = collections.deque()
         while not self.stopped.isSet():
-            self._socket.settimeout(0.1)
+            if len(datagrams) == 0:
+                self._socket.settimeout(0.1)
+                try:
+                    datagrams.extend(self._datagram_io.recv(self._socket))
+                except socket.timeout:  # pragma: no cover
+                    continue
+                except Exception as e:  # pragma: no cover
+                    if self._cb_ignore_read_exception is not None and callable(self._cb_ignore_read_exception):
+                        if self._cb_ignore_read_exception(e, self):
+                            continue
+                    return
+                if len(datagrams) == 0:  # pragma: no cover
+                    continue
+            datagram, addr = datagrams.popleft()
+            if len(datagram) == 0:  # pragma: no cover
+                logger.debug("Exiting receiver Thread due to orderly shutdown on server end")
+                return
+
+            self._handle_datagram(datagram, addr)
+
+        logger.debug("Exiting receiver Thread due to request")
+
+    def _read_datagrams(self):
+        """
+        Read the datagrams waiting on the socket, when the client is served by a shared loop.
+        """
+        for i in range(defines.EVENT_LOOP_BATCH):
             try:
-                datagram, addr = self._socket.recvfrom(1152)
-            except socket.timeout:  # pragma: no cover
-                continue
-            except Exception as e:  # pragma: no cover
+                datagrams = self._datagram_io.recv(self._socket)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
                 if self._cb_ignore_read_exception is not None and callable(self._cb_ignore_read_exception):
                     if self._cb_ignore_read_exception(e, self):
                         continue
+                logger.exception("Exception while receiving datagrams")
                 return
-            else:  # pragma: no cover
-                if len(datagram) == 0:
-                    logger.debug("Exiting receiver Thread due to orderly shutdown on server end")
-                    return
+            for datagram, addr in datagrams:
+                self._handle_datagram(datagram, addr)
 
-            serializer = Serializer()
+    def _handle_datagram(self, datagram, addr):
+        """
+        Decode a received datagram and process the message.
 
-            try:
-                host, port = addr
-            except ValueError:
-                host, port, tmp1, tmp2 = addr
+        :param datagram: the datagram
+        :param addr: the address of the sender
+        """
+        serializer = Serializer()
 
-            source = (host, port)
+        try:
+            host, port = addr
+        except ValueError:
+            host, port, tmp1, tmp2 = addr
 
-            message = serializer.deserialize(datagram, source)
+        source = (host, port)
 
-            if isinstance(message, Response):
-                logger.debug("receive_datagram - " + str(message))
-                transaction, send_ack = self._messageLayer.receive_response(message)
-                if transaction is None:  # pragma: no cover
-                    continue
-                self._wait_for_retransmit_thread(transaction)
-                if send_ack:
-                    self._send_ack(transaction)
-                self._blockLayer.receive_response(transaction)
-                if transaction.block_transfer:
-                    self._send_block_request(transaction)
-                    continue
-                elif transaction is None:  # pragma: no cover
-                    self._send_rst(transaction)
-                    return
-                self._observeLayer.receive_response(transaction)
-                if transaction.notification:  # pragma: no cover
-                    ack = Message()
-                    ack.type = defines.Types['ACK']
-                    ack = self._messageLayer.send_empty(transaction, transaction.response, ack)
-                    self.send_datagram(ack)
-                    self._callback(transaction.response)
-                else:
-                    self._callback(transaction.response)
-            elif isinstance(message, Message):
-                self._messageLayer.receive_empty(message)
+        message = serializer.deserialize(datagram, source)
+        if self._datagram_io.pooled and not isinstance(message, int):
+            message.detach()
+        self._datagram_io.release(datagram)
 
-        logger.debug("Exiting receiver Thread due to request")
+        if isinstance(message, Response):
+            logger.debug("receive_datagram - " + str(message))
+            transaction, send_ack = self._messageLayer.receive_response(message)
+            if transaction is None:  # pragma: no cover
+                return
+            if send_ack:
+                self._send_ack(transaction)
+            self._blockLayer.receive_response(transaction)
+            if transaction.block_transfer:
+                self._send_block_request(transaction)
+                return
+            elif transaction is None:  # pragma: no cover
+                self._send_rst(transaction)
+                return
+            self._observeLayer.receive_response(transaction)
+            if transaction.notification:  # pragma: no cover
+                ack = Message()
+                ack.type = defines.Types['ACK']
+                ack = self._messageLayer.send_empty(transaction, transaction.response, ack)
+                self.send_datagram(ack)
+                self._callback(transaction.response)
+            else:
+                self._callback(transaction.response)
+        elif isinstance(message, Message):
+            self._messageLayer.receive_empty(message)
 
     def _send_ack(self, transaction):
         """
@@ -0,0 +1,225 @@
+import collections
+import random
+import threading
+import time
+
+from coapthon import defines
+
+__author__ = 'Giacomo Tanganelli'
+
+# gains of the RTT estimators (RFC 6298)
+ALPHA = 0.125
+BETA = 0.25
+
+# variance multipliers of the strong and weak estimators
+K_STRONG = 4
+K_WEAK = 1
+
+
+class RttEstimator(object):
+    """
+    Smoothed RTT and RTT variation of a destination, computed as in RFC 6298.
+    """
+    __slots__ = ("k", "srtt", "rttvar", "rto")
+
+    def __init__(self, k):
+        """
+        Initialize an estimator without samples.
+
+        :param k: the multiplier of the RTT variation in the RTO
+        """
+        self.k = k
+        self.srtt = None
+        self.rttvar = None
+        self.rto = None
+
+    def update(self, rtt):
+        """
+        Add an RTT sample.
+
+        :param rtt: the RTT, in seconds
+        :rtype : float
+        :return: the new RTO of the estimator
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = self.srtt + self.k * self.rttvar
+        return self.rto
+
+
+class Endpoint(object):
+    """
+    Congestion control state of a destination: a strong estimator, fed by the exchanges answered without
+    retransmissions, a weak estimator, fed by the exchanges answered after one or two retransmissions, and the overall
+    RTO that combines them.
+    """
+    __slots__ = ("strong", "weak", "rto", "updated")
+
+    def __init__(self):
+        self.strong = RttEstimator(K_STRONG)
+        self.weak = RttEstimator(K_WEAK)
+        self.rto = float(defines.ACK_TIMEOUT)
+        self.updated = time.time()
+
+    def age(self, now):
+        """
+        Bring the overall RTO back towards the default when the destination has not been measured for a while.
+
+        :param now: the current time
+        """
+        while self.rto < 1 and now - self.updated > 16 * self.rto:
+            self.updated += 16 * self.rto
+            self.rto *= 2
+        while self.rto > 3 and now - self.updated > 4 * self.rto:
+            self.updated += 4 * self.rto
+            self.rto = 1 + self.rto / 2
+
+    def sample(self, rtt, retransmissions, now):
+        """
+        Update the overall RTO with an RTT sample.
+
+        :param rtt: the time from the first transmission of the request to the reply
+        :param retransmissions: the number of retransmissions of the request
+        :param now: the current time
+        """
+        if retransmissions == 0:
+            rto = self.strong.update(rtt)
+            self.rto = 0.5 * rto + 0.5 * self.rto
+        elif retransmissions <= 2:
+            rto = self.weak.update(rtt)
+            self.rto = 0.25 * rto + 0.75 * self.rto
+        else:
+            return
+        self.rto = min(max(self.rto, defines.COCOA_MIN_RTO), defines.COCOA_MAX_RTO)
+        self.updated = now
+
+    def to_dict(self):
+        """
+        Return the state of the destination.
+
+        :rtype : dict
+        :return: the overall RTO and the estimators
+        """
+        return {"rto": self.rto, "updated": self.updated,
+                "strong": {"srtt": self.strong.srtt, "rttvar": self.strong.rttvar, "rto": self.strong.rto},
+                "weak": {"srtt": self.weak.srtt, "rttvar": self.weak.rttvar, "rto": self.weak.rto}}
+
+
+def backoff_factor(rto):
+    """
+    Return the variable backoff factor of an exchange: the retransmissions are spread more when the RTO is small and
+    less when it is large.
+
+    :param rto: the initial RTO of the exchange
+    :rtype : float
+    :return: the factor that multiplies the timeout at every retransmission
+    """
+    if rto < 1:
+        return 3
+    if rto > 3:
+        return 1.5
+    return 2
+
+
+class CoCoA(object):
+    """
+    Adaptive retransmission timeouts per destination (CoCoA, draft-ietf-core-cocoa). The state of the destinations is
+    kept in a table of at most size entries: the least recently used destination is forgotten first, and starts again
+    from ACK_TIMEOUT.
+    A CoCoA object can be shared by several clients.
+    """
+    def __init__(self, size=None):
+        """
+        Initialize an empty table.
+
+        :param size: the maximum number of destinations
+        """
+        if size is None:
+            size = defines.COCOA_TABLE_SIZE
+        assert size > 0
+        self._size = size
+        self._endpoints = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._endpoints)
+
+    def __contains__(self, destination):
+        return destination in self._endpoints
+
+    def _endpoint(self, destination, now):
+        """
+        Return the state of a destination, creating it if needed. Must be called with the lock held.
+
+        :param destination: the address of the destination
+        :param now: the current time
+        :rtype : Endpoint
+        :return: the state
+        """
+        endpoint = self._endpoints.pop(destination, None)
+        if endpoint is None:
+            endpoint = Endpoint()
+            if len(self._endpoints) >= self._size:
+                self._endpoints.popitem(last=False)
+        else:
+            endpoint.age(now)
+        self._endpoints[destination] = endpoint
+        return endpoint
+
+    def initial_timeout(self, destination):
+        """
+        Return the timeout before the first retransmission of a request and the backoff of the next ones.
+
+        :param destination: the address of the destination
+        :rtype : tuple
+        :return: the timeout, randomized as in RFC 7252, and the backoff factor
+        """
+        with self._lock:
+            rto = self._endpoint(destination, time.time()).rto
+        return random.uniform(rto, rto * defines.ACK_RANDOM_FACTOR), backoff_factor(rto)
+
+    def sample(self, destination, rtt, retransmissions):
+        """
+        Update the RTO of a destination with the RTT of an exchange.
+
+        :param destination: the address of the destination
+        :param rtt: the time from the first transmission of the request to the reply
+        :param retransmissions: the number of retransmissions of the request before the reply
+        """
+        with self._lock:
+            self._endpoint(destination, time.time()).sample(rtt, retransmissions, time.time())
+
+    def rto(self, destination):
+        """
+        Return the current RTO of a destination, without creating its state.
+
+        :param destination: the address of the destination
+        :return: the RTO, or None if the destination has no state
+        """
+        with self._lock:
+            endpoint = self._endpoints.get(destination)
+            if endpoint is None:
+                return None
+            endpoint.age(time.time())
+            return endpoint.rto
+
+    def estimators(self):
+        """
+        Return the state of all the destinations, for inspection.
+
+        :rtype : dict
+        :return: the state of every destination, as returned by Endpoint.to_dict, by address
+        """
+        with self._lock:
+            return dict((destination, endpoint.to_dict()) for destination, endpoint in self._endpoints.iteritems())
+
+    def clear(self):
+        """
+        Forget all the destinations.
+        """
+        with self._lock:
+            self._endpoints.clear()
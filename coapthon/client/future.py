@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+CANCELLED = "CANCELLED"
+FINISHED = "FINISHED"
+
+
+class TimeoutError(Exception):
+    """
+    Raised when a request gets no response before its deadline, or when a wait times out.
+    """
+    pass
+
+
+class CancelledError(Exception):
+    """
+    Raised when the result of a cancelled request is requested.
+    """
+    pass
+
+
+class Future(object):
+    """
+    Result of an asynchronous request, with the same interface as concurrent.futures.Future.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def cancel(self):
+        """
+        Cancel the request, if it has not been sent yet.
+
+        :rtype : bool
+        :return: True, if the request has been cancelled
+        """
+        with self._condition:
+            if self._state in (RUNNING, FINISHED):
+                return False
+            if self._state != CANCELLED:
+                self._state = CANCELLED
+                self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        """
+        Check if the request has been cancelled.
+
+        :rtype : bool
+        :return: True, if the request has been cancelled
+        """
+        return self._state == CANCELLED
+
+    def running(self):
+        """
+        Check if the request has been sent and is waiting for the response.
+
+        :rtype : bool
+        :return: True, if the request is outstanding
+        """
+        return self._state == RUNNING
+
+    def done(self):
+        """
+        Check if the request is over.
+
+        :rtype : bool
+        :return: True, if the request has been cancelled or has completed
+        """
+        return self._state in (CANCELLED, FINISHED)
+
+    def result(self, timeout=None):
+        """
+        Wait for the response.
+
+        :param timeout: the maximum time to wait, None to wait until the request is over
+        :return: the response
+        :raise TimeoutError: if the request is not over in time, or has got no response before its deadline
+        :raise CancelledError: if the request has been cancelled
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the request to be over and return its exception.
+
+        :param timeout: the maximum time to wait, None to wait until the request is over
+        :return: the exception raised by the request, None if it has succeeded
+        :raise TimeoutError: if the request is not over in time
+        :raise CancelledError: if the request has been cancelled
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def _wait(self, timeout):
+        with self._condition:
+            if not self.done():
+                self._condition.wait(timeout)
+            if self._state == CANCELLED:
+                raise CancelledError()
+            if self._state != FINISHED:
+                raise TimeoutError()
+
+    def add_done_callback(self, function):
+        """
+        Call a function with the future as soon as the request is over, or at once if it is already over.
+
+        :param function: the function
+        """
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(function)
+                return
+        self._call(function)
+
+    def set_running_or_notify_cancel(self):
+        """
+        Mark the request as sent, unless it has been cancelled.
+
+        :rtype : bool
+        :return: False, if the request has been cancelled and must not be sent
+        """
+        with self._condition:
+            if self._state == CANCELLED:
+                return False
+            self._state = RUNNING
+            return True
+
+    def set_result(self, result):
+        """
+        Complete the request with a response.
+
+        :param result: the response
+        """
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        """
+        Complete the request with an error.
+
+        :param exception: the exception
+        """
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._condition:
+            if self.done():
+                return
+            self._result = result
+            self._exception = exception
+            self._state = FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        with self._condition:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for function in callbacks:
+            self._call(function)
+
+    def _call(self, function):
+        try:
+            function(self)
+        except Exception:
+            logger.exception("Exception in future callback")
+
+
+def gather(futures, timeout=None, return_exceptions=False):
+    """
+    Wait for several requests.
+
+    :param futures: the futures of the requests
+    :param timeout: the maximum time to wait for all of them, None to wait until they are over
+    :param return_exceptions: if True, the exceptions of the failed requests are returned in place of their responses
+    :rtype : list
+    :return: the responses, in the order of the futures
+    :raise TimeoutError: if the requests are not over in time
+    """
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    results = []
+    for future in futures:
+        remaining = None
+        if deadline is not None:
+            remaining = max(deadline - time.time(), 0)
+        try:
+            results.append(future.result(remaining))
+        except (TimeoutError, CancelledError) as e:
+            if not future.done() or not return_exceptions:
+                raise
+            results.append(e)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
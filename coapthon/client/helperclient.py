@@ -3,6 +3,8 @@ import threading
 from coapthon.messages.message import Message
 from coapthon import defines
 from coapthon.client.coap import CoAP
+from coapthon.client.future import Future, TimeoutError
+from coapthon.client.transport import ClientTransport, RequestWindow
 from coapthon.messages.request import Request
 from coapthon.utils import generate_random_token
 
@@ -20,8 +22,12 @@ class _RequestContext(object):
 class HelperClient(object):
     """
     Helper Client class to perform requests to remote servers in a simplified way.
+    By default the client has its own socket and threads. A client created with a ClientTransport, or with
+    transport=True for the one shared by the process, is a cheap handle over it instead, whose callbacks run on the
+    loop of the transport.
     """
-    def __init__(self, server, sock=None, cb_ignore_read_exception=None, cb_ignore_write_exception=None):
+    def __init__(self, server, sock=None, cb_ignore_read_exception=None, cb_ignore_write_exception=None,
+                 datagram_io=None, transport=None, nstart=None, congestion=None):
         """
         Initialize a client to perform request to a server.
 
@@ -29,10 +35,28 @@ class HelperClient(object):
         :param sock: if a socket has been created externally, it can be used directly
         :param cb_ignore_read_exception: Callback function to handle exception raised during the socket read operation
         :param cb_ignore_write_exception: Callback function to handle exception raised during the socket write operation 
+        :param datagram_io: the I/O backend of the socket. If None, datagrams are received and sent one at a time
+        :param transport: the ClientTransport to use, True for the default transport of the process. If None or
+        False, the client has its own socket and threads
+        :param nstart: the maximum number of outstanding asynchronous requests of a client with its own socket, the
+        others are queued. Over a shared transport, the limit of the transport applies to the server, over all its
+        clients
+        :param congestion: a CoCoA object that adapts the retransmission timeouts of a client with its own socket. A
+        shared transport has its own
         """
         self.server = server
-        self.protocol = CoAP(self.server, random.randint(1, 65535), self._wait_response, sock=sock,
-                             cb_ignore_read_exception=cb_ignore_read_exception, cb_ignore_write_exception=cb_ignore_write_exception)
+        if transport is True:
+            transport = ClientTransport.default()
+        if transport:
+            self._transport = transport
+            self.protocol = transport.protocol(self.server)
+            self._window = transport.window(self.server)
+        else:
+            self._transport = None
+            self.protocol = CoAP(self.server, random.randint(1, 65535), self._wait_response, sock=sock,
+                                 cb_ignore_read_exception=cb_ignore_read_exception, cb_ignore_write_exception=cb_ignore_write_exception,
+                                 datagram_io=datagram_io, congestion=congestion)
+            self._window = RequestWindow(nstart)
 
         self.requests_lock = threading.RLock()
         self.requests = dict()
@@ -46,16 +70,18 @@ class HelperClient(object):
         if message.code == defines.Codes.CONTINUE.number:
             return
         with self.requests_lock:
-            if message.token not in self.requests:
+            token = message.token
+            if token not in self.requests:
                 return
-            context = self.requests[message.token]
+            context = self.requests[token]
             if message.timeouted:
                 # Message is actually the original timed out request (not the response), discard content
                 message = None
             if hasattr(context, 'callback'):
                 if not hasattr(context.request, 'observe'):
                     # OBSERVE stays until cancelled, for all others we're done
-                    del self.requests[message.token]
+                    del self.requests[token]
+                    self._unregister(token)
                 context.callback(message)
             else:
                 # Signal that a response is available to blocking call
@@ -64,13 +90,19 @@ class HelperClient(object):
 
     def stop(self):
         """
-        Stop the client.
+        Stop the client. A client over a shared transport only releases its tokens and observations.
         """
-        self.protocol.close()
+        if self._transport is None:
+            self.protocol.close()
+        for future in self._window.cancel(self):
+            future.cancel()
         with self.requests_lock:
             # Unblock/signal waiters
-            for token in self.requests:
-                context = self.requests[token]
+            for token, context in self.requests.items():
+                if self._transport is not None:
+                    self._transport.unregister(token)
+                    if context.request.observe is not None:
+                        self.protocol.end_observation(token, self.server)
                 if hasattr(context, 'callback'):
                     context.callback(None)
                 else:
@@ -97,8 +129,9 @@ class HelperClient(object):
                 return
             context = self.requests[token]
             del self.requests[token]
+            self._unregister(token)
 
-        self.protocol.end_observation(token)
+        self.protocol.end_observation(token, self.server)
 
         if not explicit:
             return
@@ -246,6 +279,166 @@ class HelperClient(object):
 
         return self.send_request(request, callback, timeout)
 
+    def get_async(self, path, proxy_uri=None, timeout=None, **kwargs):
+        """
+        Perform a GET on a certain path without waiting for the response.
+
+        :param path: the path
+        :param proxy_uri: Proxy-Uri option of a request
+        :param timeout: the deadline of the request, from now
+        :rtype : Future
+        :return: the future of the response
+        """
+        return self.send_request_async(self._mk_async_request(defines.Codes.GET, path, None, proxy_uri, kwargs),
+                                       timeout)
+
+    def delete_async(self, path, proxy_uri=None, timeout=None, **kwargs):
+        """
+        Perform a DELETE on a certain path without waiting for the response.
+
+        :param path: the path
+        :param proxy_uri: Proxy-Uri option of a request
+        :param timeout: the deadline of the request, from now
+        :rtype : Future
+        :return: the future of the response
+        """
+        return self.send_request_async(self._mk_async_request(defines.Codes.DELETE, path, None, proxy_uri, kwargs),
+                                       timeout)
+
+    def post_async(self, path, payload, proxy_uri=None, timeout=None, **kwargs):
+        """
+        Perform a POST on a certain path without waiting for the response.
+
+        :param path: the path
+        :param payload: the request payload
+        :param proxy_uri: Proxy-Uri option of a request
+        :param timeout: the deadline of the request, from now
+        :rtype : Future
+        :return: the future of the response
+        """
+        return self.send_request_async(self._mk_async_request(defines.Codes.POST, path, payload, proxy_uri, kwargs),
+                                       timeout)
+
+    def put_async(self, path, payload, proxy_uri=None, timeout=None, **kwargs):
+        """
+        Perform a PUT on a certain path without waiting for the response.
+
+        :param path: the path
+        :param payload: the request payload
+        :param proxy_uri: Proxy-Uri option of a request
+        :param timeout: the deadline of the request, from now
+        :rtype : Future
+        :return: the future of the response
+        """
+        return self.send_request_async(self._mk_async_request(defines.Codes.PUT, path, payload, proxy_uri, kwargs),
+                                       timeout)
+
+    def discover_async(self, timeout=None, **kwargs):
+        """
+        Perform a Discover request on the server without waiting for the response.
+
+        :param timeout: the deadline of the request, from now
+        :rtype : Future
+        :return: the future of the response
+        """
+        return self.send_request_async(self._mk_async_request(defines.Codes.GET, defines.DISCOVERY_URL, None, None,
+                                                              kwargs), timeout)
+
+    def _mk_async_request(self, method, path, payload, proxy_uri, options):
+        """
+        Create a request for the asynchronous methods.
+
+        :param method: the CoAP method
+        :param path: the path of the request
+        :param payload: the request payload, or None
+        :param proxy_uri: Proxy-Uri option of a request, or None
+        :param options: the other attributes of the request
+        :return: the request
+        """
+        request = self.mk_request(method, path)
+        request.token = generate_random_token(2)
+        if payload is not None:
+            request.payload = payload
+        if proxy_uri:
+            request.proxy_uri = proxy_uri
+
+        for k, v in options.iteritems():
+            if hasattr(request, k):
+                setattr(request, k, v)
+        return request
+
+    def send_request_async(self, request, timeout=None):
+        """
+        Send a request without waiting for the response. At most nstart requests to the server are outstanding: the
+        others are queued and sent, in order, as soon as an outstanding request is over.
+
+        :param request: the request to send
+        :param timeout: the deadline of the request from now, queueing included. None to wait until the request is
+        given up after the last retransmission
+        :rtype : Future
+        :return: the future of the response. Its result raises TimeoutError if no response arrives in time
+        """
+        future = Future()
+        if timeout is not None:
+            self.protocol.scheduler.call_later(timeout, self._async_expired, request, future)
+        self._window.submit(self, request, future)
+        return future
+
+    def _send_async(self, request, future):
+        """
+        Send an asynchronous request, once its window allows it.
+
+        :param request: the request
+        :param future: the future of the request
+        """
+        with self.requests_lock:
+            while request.token in self.requests or not self._register(request.token):
+                request.token = generate_random_token(2)
+            context = _RequestContext(request)
+            context.callback = lambda message, context=context: self._async_response(context, message)
+            context.future = future
+            self.requests[request.token] = context
+        self.protocol.send_message(request)
+
+    def _async_response(self, context, message):
+        """
+        Complete an asynchronous request and send the next queued one.
+
+        :param context: the context of the request
+        :param message: the response, None if the request has been given up
+        """
+        with self.requests_lock:
+            token = context.request.token
+            if self.requests.get(token) is context:
+                del self.requests[token]
+                self._unregister(token)
+        if message is None:
+            context.future.set_exception(TimeoutError("No response from " + str(self.server)))
+        else:
+            context.future.set_result(message)
+        self._window.done()
+
+    def _async_expired(self, request, future):
+        """
+        Fail an asynchronous request that has reached its deadline. A late response is discarded.
+
+        :param request: the request
+        :param future: the future of the request
+        """
+        if future.done():
+            return
+        if self._window.remove(future):
+            future.set_exception(TimeoutError("No response before the deadline"))
+            return
+        with self.requests_lock:
+            context = self.requests.get(request.token)
+            if context is None or getattr(context, "future", None) is not future:
+                return
+            del self.requests[request.token]
+            self._unregister(request.token)
+        future.set_exception(TimeoutError("No response before the deadline"))
+        self._window.done()
+
     def send_request(self, request, callback=None, timeout=None):  # pragma: no cover
         """
         Send a request to the remote server.
@@ -260,7 +453,7 @@ class HelperClient(object):
             # Same requests from the same endpoint must have different tokens
             # Ensure there is a unique token in case the other side issues a
             # delayed response after a standalone ACK
-            while request.token in self.requests:
+            while request.token in self.requests or not self._register(request.token):
                 request.token = generate_random_token(2)
             context = _RequestContext(request, callback)
             self.requests[request.token] = context
@@ -271,9 +464,32 @@ class HelperClient(object):
 
         # Wait for response
         context.responded.wait(timeout)
-        del self.requests[request.token]
+        with self.requests_lock:
+            self.requests.pop(request.token, None)
+            self._unregister(request.token)
         return context.response
 
+    def _register(self, token):
+        """
+        Reserve a token on the shared transport.
+
+        :param token: the token
+        :rtype : bool
+        :return: True, if no other client of the transport is using the token
+        """
+        if self._transport is None:
+            return True
+        return self._transport.register(token, self._wait_response)
+
+    def _unregister(self, token):
+        """
+        Release a token on the shared transport.
+
+        :param token: the token
+        """
+        if self._transport is not None:
+            self._transport.unregister(token)
+
 
     def send_empty(self, empty):  # pragma: no cover
         """
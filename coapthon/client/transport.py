@@ -0,0 +1,255 @@
+import collections
+import logging
+import random
+import socket
+import threading
+
+from coapthon import defines
+from coapthon.client.coap import CoAP
+from coapthon.eventloop import EventLoop
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+
+class RequestWindow(object):
+    """
+    Limit on the outstanding asynchronous requests to a server (NSTART, RFC 7252 section 4.7), shared by all the
+    clients that send requests to it: the requests over the limit are queued and sent in order as soon as an
+    outstanding request is over.
+    """
+    def __init__(self, nstart=None):
+        """
+        Initialize an empty window.
+
+        :param nstart: the maximum number of outstanding requests
+        """
+        if nstart is None:
+            nstart = defines.NSTART
+        assert nstart > 0
+        self.nstart = nstart
+        self._lock = threading.Lock()
+        # (client, request, future) of the requests waiting for an outstanding one to be over
+        self._queue = collections.deque()
+        self._outstanding = 0
+
+    @property
+    def outstanding(self):
+        """
+        Return the number of outstanding requests.
+
+        :rtype : int
+        :return: the number of requests sent and not over yet
+        """
+        return self._outstanding
+
+    def submit(self, client, request, future):
+        """
+        Queue a request, and send it at once if the window allows it.
+
+        :param client: the client of the request, whose _send_async method sends it
+        :param request: the request
+        :param future: the future of the request
+        """
+        with self._lock:
+            self._queue.append((client, request, future))
+        self._send_queued()
+
+    def remove(self, future):
+        """
+        Remove a request from the queue.
+
+        :param future: the future of the request
+        :rtype : bool
+        :return: True, if the request was queued
+        """
+        with self._lock:
+            for item in self._queue:
+                if item[2] is future:
+                    self._queue.remove(item)
+                    return True
+        return False
+
+    def cancel(self, client):
+        """
+        Remove the queued requests of a client.
+
+        :param client: the client
+        :rtype : list
+        :return: the futures of the requests removed
+        """
+        with self._lock:
+            removed = [item for item in self._queue if item[0] is client]
+            for item in removed:
+                self._queue.remove(item)
+        return [future for owner, request, future in removed]
+
+    def done(self):
+        """
+        Release the place of an outstanding request that is over, and send the next queued one.
+        """
+        with self._lock:
+            self._outstanding -= 1
+        self._send_queued()
+
+    def _send_queued(self):
+        """
+        Send the queued requests, while less than nstart are outstanding.
+        """
+        while True:
+            with self._lock:
+                if self._outstanding >= self.nstart or len(self._queue) == 0:
+                    return
+                client, request, future = self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._outstanding += 1
+            client._send_async(request, future)
+
+
+class ClientTransport(object):
+    """
+    Transport shared by many clients: a small pool of sockets, each one with its own MessageLayer, served by a single
+    event loop thread that receives the datagrams, runs the retransmissions and routes the responses to the clients by
+    token. All the requests to the same server go through the same socket, and the asynchronous ones share the same
+    RequestWindow, whatever the client.
+    Callbacks run on the loop thread: they must not wait for other responses.
+    """
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, sockets=None, congestion=None, nstart=None):
+        """
+        Initialize the transport and start its loop.
+
+        :param sockets: the number of sockets per address family
+        :param congestion: a CoCoA object that adapts the retransmission timeouts to every server, shared by the
+        sockets. If None, the timeouts are the fixed ones of RFC 7252
+        :param nstart: the maximum number of outstanding asynchronous requests to a server, over all the clients
+        """
+        if sockets is None:
+            sockets = defines.CLIENT_TRANSPORT_SOCKETS
+        assert sockets > 0
+        self._sockets = sockets
+        self.congestion = congestion
+        if nstart is None:
+            nstart = defines.NSTART
+        assert nstart > 0
+        self.nstart = nstart
+        # server -> RequestWindow of the requests to the server
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._protocols = {}
+        self._handlers = {}
+        self._closed = False
+        self._loop = EventLoop()
+        self._loop.call_later(defines.PURGE_INTERVAL, self._purge)
+        self._thread = self._loop.start(name="CoAP-Client-Transport")
+
+    @classmethod
+    def default(cls):
+        """
+        Return the transport shared by the whole process, creating it on first use.
+
+        :rtype : ClientTransport
+        :return: the transport
+        """
+        with cls._default_lock:
+            if cls._default is None or cls._default._closed:
+                cls._default = cls()
+            return cls._default
+
+    def protocol(self, server):
+        """
+        Return the client protocol that sends the requests to a server.
+
+        :param server: the address of the server
+        :rtype : CoAP
+        :return: the protocol
+        """
+        family = socket.getaddrinfo(server[0], None)[0][0]
+        key = (family, hash(server) % self._sockets)
+        with self._lock:
+            protocol = self._protocols.get(key)
+            if protocol is None:
+                protocol = CoAP(server, random.randint(1, 65535), self._dispatch, loop=self._loop,
+                                congestion=self.congestion)
+                self._protocols[key] = protocol
+            return protocol
+
+    def window(self, server):
+        """
+        Return the window of the asynchronous requests to a server.
+
+        :param server: the address of the server
+        :rtype : RequestWindow
+        :return: the window
+        """
+        with self._lock:
+            window = self._windows.get(server)
+            if window is None:
+                window = RequestWindow(self.nstart)
+                self._windows[server] = window
+            return window
+
+    def register(self, token, callback):
+        """
+        Route the responses with a token to a callback.
+
+        :param token: the token
+        :param callback: the function called with the responses, or with the request if it times out
+        :rtype : bool
+        :return: True, if the token is not used by another request
+        """
+        with self._lock:
+            if token in self._handlers:
+                return False
+            self._handlers[token] = callback
+            return True
+
+    def unregister(self, token):
+        """
+        Stop routing the responses with a token.
+
+        :param token: the token
+        """
+        with self._lock:
+            self._handlers.pop(token, None)
+
+    def _dispatch(self, message):
+        """
+        Pass a response, or a timed out request, to the client waiting for it.
+
+        :param message: the message
+        """
+        callback = self._handlers.get(message.token)
+        if callback is None:
+            logger.debug("No client waiting for token " + repr(message.token))
+            return
+        callback(message)
+
+    def _purge(self):
+        """
+        Delete the old transactions of the protocols, except the ones of the requests still waited for, like the
+        observe registrations.
+        """
+        with self._lock:
+            protocols = self._protocols.values()
+        for protocol in protocols:
+            protocol._messageLayer.purge(lambda transaction: transaction.request.token in self._handlers)
+        self._loop.call_later(defines.PURGE_INTERVAL, self._purge)
+
+    def close(self):
+        """
+        Stop the loop and close the sockets.
+        """
+        self._closed = True
+        self._loop.stop()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._lock:
+            protocols = self._protocols.values()
+            self._protocols = {}
+        for protocol in protocols:
+            protocol.close()
@@ -0,0 +1,438 @@
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+
+from coapthon import defines
+
+__author__ = 'Giacomo Tanganelli'
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_SIZE = 128
+
+
+class DatagramIO(object):
+    """
+    I/O backend of the endpoints: receives and sends datagrams one system call at a time.
+    """
+    # True if the received datagrams are views of buffers that are reused once released
+    pooled = False
+
+    def __init__(self, buffer_size=4096, batch=None):
+        """
+        Initialize the backend.
+
+        :param buffer_size: the maximum size of a received datagram
+        :param batch: the maximum number of datagrams read with a single call
+        """
+        if batch is None:
+            batch = defines.DATAGRAM_BATCH
+        self.buffer_size = buffer_size
+        self.batch = batch
+
+    def recv(self, sock):
+        """
+        Receive the datagrams waiting on the socket. Honours the timeout of the socket: raises socket.timeout if
+        nothing is received in time or socket.error with EAGAIN if the socket is non-blocking and nothing is waiting.
+
+        :param sock: the socket
+        :rtype : list
+        :return: the received (data, address) tuples
+        """
+        return [sock.recvfrom(self.buffer_size)]
+
+    def send(self, sock, datagrams):
+        """
+        Send a batch of datagrams.
+
+        :param sock: the socket
+        :param datagrams: the (data, address) tuples to send
+        """
+        for data, address in datagrams:
+            sock.sendto(data, address)
+
+    def release(self, data):
+        """
+        Give back a received datagram once its message has been decoded.
+
+        :param data: the datagram
+        """
+        pass
+
+
+class BufferPool(object):
+    """
+    Pool of preallocated receive buffers. Buffers are allocated on demand when the pool is empty and at most size of
+    them are kept once released.
+    """
+    def __init__(self, buffer_size, size=None):
+        """
+        Initialize the pool.
+
+        :param buffer_size: the size of a buffer
+        :param size: the maximum number of free buffers kept in the pool
+        """
+        if size is None:
+            size = defines.BUFFER_POOL_SIZE
+        self.buffer_size = buffer_size
+        self.size = size
+        self._free = collections.deque(bytearray(buffer_size) for i in range(size))
+
+    def acquire(self):
+        """
+        Take a buffer from the pool.
+
+        :rtype : bytearray
+        :return: the buffer
+        """
+        try:
+            return self._free.pop()
+        except IndexError:
+            return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        """
+        Give a buffer back to the pool.
+
+        :param buffer: the buffer
+        """
+        if len(self._free) < self.size:
+            self._free.append(buffer)
+
+    @property
+    def free(self):
+        """
+        Return the number of free buffers.
+
+        :return: the number of buffers in the pool
+        """
+        return len(self._free)
+
+
+class PooledDatagramIO(DatagramIO):
+    """
+    I/O backend that receives with recvfrom_into in buffers taken from a pool, instead of allocating a new string for
+    every datagram. The received datagrams are memoryview slices of the buffers: the endpoints detach the decoded
+    messages from them and release them, so that the buffers go back to the pool.
+    """
+    pooled = True
+
+    def __init__(self, buffer_size=4096, batch=None, pool=None):
+        """
+        Initialize the backend.
+
+        :param buffer_size: the maximum size of a received datagram
+        :param batch: the maximum number of datagrams read with a single call
+        :param pool: the pool of the receive buffers. If None, a new BufferPool is used
+        """
+        super(PooledDatagramIO, self).__init__(buffer_size, batch)
+        if pool is None:
+            pool = BufferPool(buffer_size)
+        self.pool = pool
+        # buffers of the datagrams not released yet, by id of their view
+        self._buffers = {}
+
+    def recv(self, sock):
+        """
+        Receive a datagram in a buffer of the pool. Honours the timeout of the socket: raises socket.timeout if
+        nothing is received in time or socket.error with EAGAIN if the socket is non-blocking and nothing is waiting.
+
+        :param sock: the socket
+        :rtype : list
+        :return: the received (memoryview, address) tuple
+        """
+        buffer = self.pool.acquire()
+        try:
+            length, address = sock.recvfrom_into(buffer)
+        except socket.error:
+            self.pool.release(buffer)
+            raise
+        data = memoryview(buffer)[:length]
+        self._buffers[id(data)] = buffer
+        return [(data, address)]
+
+    def release(self, data):
+        """
+        Give the buffer of a received datagram back to the pool. The datagram must not be used any more.
+
+        :param data: the datagram
+        """
+        buffer = self._buffers.pop(id(data), None)
+        if buffer is not None:
+            self.pool.release(buffer)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IOVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc():
+    """
+    Load the C library, if it provides recvmmsg and sendmmsg.
+
+    :return: the library or None
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    except OSError:  # pragma: no cover
+        return None
+    if not hasattr(libc, "recvmmsg") or not hasattr(libc, "sendmmsg"):  # pragma: no cover
+        return None
+    libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    libc.recvmmsg.restype = ctypes.c_int
+    libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    libc.sendmmsg.restype = ctypes.c_int
+    return libc
+
+
+_libc = _load_libc()
+
+
+_MMSGHDR_SIZE = ctypes.sizeof(_MMsgHdr)
+_MSG_NAMELEN_OFFSET = _MsgHdr.msg_namelen.offset
+_IOVEC_SIZE = ctypes.sizeof(_IOVec)
+# msg_name and msg_namelen of a msghdr, iov_base and iov_len of an iovec
+_NAME_FORMAT = "@PI"
+_IOVEC_FORMAT = "@PQ" if ctypes.sizeof(ctypes.c_size_t) == 8 else "@PI"
+# msg_namelen and msg_len of a mmsghdr
+_LENGTHS_FORMAT = "=I%dxI" % (_MMsgHdr.msg_len.offset - _MSG_NAMELEN_OFFSET - 4)
+
+
+def _decode_address(name):
+    """
+    Decode a sockaddr in the address tuple returned by socket.recvfrom.
+
+    :param name: the sockaddr
+    :return: the address tuple
+    """
+    family = struct.unpack_from("=H", name)[0]
+    if family == socket.AF_INET:
+        port = struct.unpack_from("!H", name, 2)[0]
+        return socket.inet_ntop(socket.AF_INET, name[4:8]), port
+    port, flowinfo = struct.unpack_from("!HI", name, 2)
+    scope_id = struct.unpack_from("=I", name, 24)[0]
+    return socket.inet_ntop(socket.AF_INET6, name[8:24]), port, flowinfo, scope_id
+
+
+def _encode_address(family, address):
+    """
+    Encode an address tuple in a sockaddr.
+
+    :param family: the family of the socket
+    :param address: the address tuple
+    :return: the sockaddr, None if the host is not a numeric address of the family
+    """
+    try:
+        packed = socket.inet_pton(family, address[0])
+    except (socket.error, TypeError):
+        return None
+    if family == socket.AF_INET:
+        return struct.pack("=H", family) + struct.pack("!H", address[1]) + packed + "\0" * 8
+    flowinfo = address[2] if len(address) > 2 else 0
+    scope_id = address[3] if len(address) > 3 else 0
+    return struct.pack("=H", family) + struct.pack("!HI", address[1], flowinfo) + packed + struct.pack("=I", scope_id)
+
+
+class _MessageVector(object):
+    """
+    Preallocated mmsghdr vector: every message has its own slot in a data buffer and in a sockaddr buffer.
+    """
+    def __init__(self, count, size):
+        """
+        Allocate the vector.
+
+        :param count: the number of messages
+        :param size: the size of the data slot of a message
+        """
+        self.count = count
+        self.size = size
+        self.data = ctypes.create_string_buffer(count * size)
+        self.names = ctypes.create_string_buffer(count * SOCKADDR_SIZE)
+        self.iovecs = (_IOVec * count)()
+        self.messages = (_MMsgHdr * count)()
+        self.data_address = ctypes.addressof(self.data)
+        self.names_address = ctypes.addressof(self.names)
+        self.address = ctypes.addressof(self.messages)
+        for i in range(count):
+            self.iovecs[i].iov_base = self.data_address + i * size
+            self.iovecs[i].iov_len = size
+            header = self.messages[i].msg_hdr
+            header.msg_name = self.names_address + i * SOCKADDR_SIZE
+            header.msg_namelen = SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+
+
+class MultipleDatagramIO(DatagramIO):
+    """
+    I/O backend that receives with recvmmsg and sends with sendmmsg, up to batch datagrams per system call.
+    The datagrams are copied in preallocated vectors, whose headers are read and written with struct instead of
+    through the ctypes fields. The receive vector is reused by every call: use one instance per socket.
+    """
+    def __init__(self, buffer_size=4096, batch=None):
+        """
+        Initialize the backend.
+
+        :param buffer_size: the maximum size of a received datagram
+        :param batch: the maximum number of datagrams read or sent with a single call
+        """
+        super(MultipleDatagramIO, self).__init__(buffer_size, batch)
+        assert _libc is not None
+        self._receive_vector = _MessageVector(self.batch, buffer_size)
+        self._send_vector = _MessageVector(self.batch, buffer_size)
+        self._send_lock = threading.Lock()
+        self._addresses = {}
+        self._names = {}
+
+    @staticmethod
+    def available():
+        """
+        Check if recvmmsg and sendmmsg can be used.
+
+        :rtype : bool
+        :return: True, on Linux with a C library that provides them
+        """
+        return _libc is not None
+
+    def recv(self, sock):
+        """
+        Receive the datagrams waiting on the socket with a single recvmmsg. Honours the timeout of the socket:
+        raises socket.timeout if nothing is received in time or socket.error with EAGAIN if the socket is
+        non-blocking and nothing is waiting.
+
+        :param sock: the socket
+        :rtype : list
+        :return: the received (data, address) tuples
+        """
+        timeout = sock.gettimeout()
+        if timeout != 0.0:
+            # the file descriptor of a socket with a timeout is non-blocking: wait in select instead
+            while True:
+                try:
+                    readable = select.select([sock], [], [], timeout)[0]
+                    break
+                except select.error as e:
+                    if e.args[0] != errno.EINTR:
+                        raise
+            if len(readable) == 0:
+                raise socket.timeout("timed out")
+        vector = self._receive_vector
+        received = _libc.recvmmsg(sock.fileno(), vector.address, vector.count, MSG_DONTWAIT, None)
+        if received < 0:
+            error = ctypes.get_errno()
+            raise socket.error(error, os.strerror(error))
+        datagrams = []
+        for i in range(received):
+            offset = i * _MMSGHDR_SIZE + _MSG_NAMELEN_OFFSET
+            namelen, length = struct.unpack_from(_LENGTHS_FORMAT, vector.messages, offset)
+            # msg_namelen is both the size of the buffer and the length of the received address
+            struct.pack_into("=I", vector.messages, offset, SOCKADDR_SIZE)
+            name = vector.names[i * SOCKADDR_SIZE:i * SOCKADDR_SIZE + namelen]
+            address = self._addresses.get(name)
+            if address is None:
+                address = _decode_address(name)
+                if len(self._addresses) < defines.ADDRESS_CACHE_SIZE:
+                    self._addresses[name] = address
+            datagrams.append((vector.data[i * vector.size:i * vector.size + length], address))
+        return datagrams
+
+    def send(self, sock, datagrams):
+        """
+        Send a batch of datagrams with sendmmsg, batch datagrams per system call.
+        The datagrams sent to a host name instead of an address, or larger than the buffer size, are sent with sendto.
+
+        :param sock: the socket
+        :param datagrams: the (data, address) tuples to send
+        """
+        pending = []
+        names = []
+        for data, address in datagrams:
+            name = self._names.get(address)
+            if name is None:
+                name = _encode_address(sock.family, address)
+                if name is not None and len(self._names) < defines.ADDRESS_CACHE_SIZE:
+                    self._names[address] = name
+            if name is None or len(data) > self.buffer_size:
+                sock.sendto(data, address)
+                continue
+            pending.append((data, address))
+            names.append(name)
+        with self._send_lock:
+            for start in range(0, len(pending), self.batch):
+                self._send_batch(sock, pending[start:start + self.batch], names[start:start + self.batch])
+
+    def _send_batch(self, sock, pending, names):
+        """
+        Copy the datagrams in the send vector, each one right after the previous one, and send them.
+
+        :param sock: the socket
+        :param pending: the (data, address) tuples, the data as str or memoryview
+        :param names: the sockaddr of the addresses
+        """
+        vector = self._send_vector
+        data_offset = vector.data_address
+        names_offset = vector.names_address
+        for i in range(len(pending)):
+            length = len(pending[i][0])
+            struct.pack_into(_IOVEC_FORMAT, vector.iovecs, i * _IOVEC_SIZE, data_offset, length)
+            struct.pack_into(_NAME_FORMAT, vector.messages, i * _MMSGHDR_SIZE, names_offset, len(names[i]))
+            data_offset += length
+            names_offset += len(names[i])
+        # the serializer hands out memoryviews of its buffer, which join does not accept
+        data = "".join([datagram.tobytes() if isinstance(datagram, memoryview) else datagram
+                        for datagram, address in pending])
+        ctypes.memmove(vector.data_address, data, len(data))
+        names = "".join(names)
+        ctypes.memmove(vector.names_address, names, len(names))
+        sent = 0
+        while sent < len(pending):
+            result = _libc.sendmmsg(sock.fileno(), vector.address + sent * _MMSGHDR_SIZE, len(pending) - sent, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # the send buffer is full: let sendto wait as the timeout of the socket says
+                    sock.sendto(*pending[sent])
+                    sent += 1
+                    continue
+                raise socket.error(error, os.strerror(error))
+            sent += result
+
+
+def create_datagram_io(buffer_size=4096, batch=None):
+    """
+    Return the best I/O backend for the platform: recvmmsg and sendmmsg on Linux, one call per datagram elsewhere.
+
+    :param buffer_size: the maximum size of a received datagram
+    :param batch: the maximum number of datagrams read or sent with a single call
+    :rtype : DatagramIO
+    :return: the backend
+    """
+    if MultipleDatagramIO.available():
+        return MultipleDatagramIO(buffer_size, batch)
+    return DatagramIO(buffer_size, batch)
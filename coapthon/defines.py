@@ -14,6 +14,9 @@ ACK_RANDOM_FACTOR = 1.5
 
 MAX_RETRANSMIT = 4
 
+# outstanding requests of a client to a server
+NSTART = 1
+
 MAX_TRANSMIT_SPAN = ACK_TIMEOUT * (pow(2, (MAX_RETRANSMIT + 1)) - 1) * ACK_RANDOM_FACTOR
 
 MAX_LATENCY = 120  # 2 minutes
@@ -24,6 +27,45 @@ MAX_RTT = (2 * MAX_LATENCY) + PROCESSING_DELAY
 
 EXCHANGE_LIFETIME = MAX_TRANSMIT_SPAN + (2 * MAX_LATENCY) + PROCESSING_DELAY
 
+# how often the expired transactions are purged
+PURGE_INTERVAL = 5
+
+# maximum number of datagrams read by the event loop server before running the timers
+EVENT_LOOP_BATCH = 64
+
+# maximum number of datagrams received or sent with a single recvmmsg/sendmmsg
+DATAGRAM_BATCH = 32
+
+# free receive buffers kept by the pool of PooledDatagramIO
+BUFFER_POOL_SIZE = 16
+
+# sockets per address family of a ClientTransport, each one with its own MessageLayer
+CLIENT_TRANSPORT_SOCKETS = 4
+
+# CoCoA congestion control of the client: bounds of the RTO and number of destinations with an estimator
+COCOA_MIN_RTO = 0.1
+
+COCOA_MAX_RTO = 60
+
+COCOA_TABLE_SIZE = 1024
+
+# worker threads and admission queue of the threaded server
+WORKER_POOL_SIZE = 16
+
+WORKER_QUEUE_SIZE = 256
+
+# Max-Age of the 5.03 Service Unavailable sent when the admission queue is full
+SERVICE_UNAVAILABLE_MAX_AGE = 2
+
+# minimum interval, in seconds, between two notifications to an observer of a NotificationScheduler
+NOTIFICATION_PMIN = 1
+
+# notifications prepared before they are sent, so that the first observers do not wait for the last ones
+NOTIFICATION_BATCH = 256
+
+# delay, in seconds, before a busy observer is notified again when the executor cannot take its notification
+NOTIFICATION_RETRY = 0.05
+
 DISCOVERY_URL = "/.well-known/core"
 
 ALL_COAP_NODES = "224.0.1.187"
@@ -36,6 +78,24 @@ MAX_NON_NOTIFICATIONS = 10
 
 BLOCKWISE_SIZE = 1024
 
+# number of canonical peer addresses cached for the transaction lookup keys
+ADDRESS_CACHE_SIZE = 4096
+
+""" Serializer parameters """
+
+# legacy engine, builds a struct format string (or slices the datagram) one byte at a time
+SERIALIZER_STRUCT = 0
+
+# single-pass engine, writes into a reusable per-thread buffer and decodes through a memoryview
+SERIALIZER_BUFFER = 1
+
+SERIALIZER_ENGINE = SERIALIZER_BUFFER
+
+DESERIALIZER_ENGINE = SERIALIZER_BUFFER
+
+# initial size of the per-thread encoding buffer, grown on demand
+SERIALIZER_BUFFER_SIZE = 1152
+
 """ Resource Directory parameters"""
 
 RD_HOST = "127.0.0.1"
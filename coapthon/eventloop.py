@@ -0,0 +1,264 @@
+import collections
+import errno
+import heapq
+import itertools
+import logging
+import select
+import socket
+import threading
+import time
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle(object):
+    """
+    Handle of a callback scheduled on the event loop.
+    """
+    __slots__ = ("when", "callback", "args", "cancelled", "_loop")
+
+    def __init__(self, loop, when, callback, args):
+        """
+        Data structure for a scheduled callback.
+
+        :param loop: the event loop
+        :param when: the time at which the callback must run
+        :param callback: the callback
+        :param args: the arguments of the callback
+        """
+        self._loop = loop
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Cancel the callback, if it has not run yet.
+        """
+        self.cancelled = True
+
+    def set(self):
+        """
+        Run the callback now, in the calling thread, instead of at its scheduled time.
+        Same interface as threading.Event, so that the MessageLayer can stop a retransmission on ACK: the
+        retransmission is over when the method returns.
+        """
+        with self._loop.lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+        self._loop.run_handle(self)
+
+    def isSet(self):
+        """
+        Check if the callback has been cancelled or anticipated.
+
+        :return: True, if the scheduled callback will not run
+        """
+        return self.cancelled
+
+
+class EventLoop(object):
+    """
+    Single-threaded event loop: waits on sockets with select and runs timers kept in a heap.
+    Callbacks can be scheduled from any thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = []
+        self._counter = itertools.count()
+        self._ready = collections.deque()
+        self._readers = {}
+        self._thread = None
+        self._stopped = False
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(0)
+        self._wakeup_writer.setblocking(0)
+        self.add_reader(self._wakeup_reader, self._drain_wakeup)
+
+    @staticmethod
+    def time():
+        """
+        Return the loop time.
+
+        :return: the current time
+        """
+        return time.time()
+
+    def call_soon(self, callback, *args):
+        """
+        Run a callback at the next iteration of the loop.
+
+        :param callback: the callback
+        :param args: the arguments of the callback
+        :rtype : TimerHandle
+        :return: the handle of the callback
+        """
+        handle = TimerHandle(self, self.time(), callback, args)
+        self._ready.append(handle)
+        self.wakeup()
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run a callback after a delay.
+
+        :param delay: the delay in seconds
+        :param callback: the callback
+        :param args: the arguments of the callback
+        :rtype : TimerHandle
+        :return: the handle of the callback
+        """
+        handle = TimerHandle(self, self.time() + delay, callback, args)
+        with self._lock:
+            heapq.heappush(self._timers, (handle.when, next(self._counter), handle))
+            earliest = self._timers[0][2] is handle
+        # the loop is already waiting for an earlier timer otherwise
+        if earliest:
+            self.wakeup()
+        return handle
+
+    def add_reader(self, sock, callback):
+        """
+        Run a callback every time a socket becomes readable.
+
+        :param sock: the socket
+        :param callback: the callback, called without arguments
+        """
+        self._readers[sock.fileno()] = (sock, callback)
+        self.wakeup()
+
+    def remove_reader(self, sock):
+        """
+        Stop watching a socket.
+
+        :param sock: the socket
+        """
+        self._readers.pop(sock.fileno(), None)
+
+    def wakeup(self):
+        """
+        Interrupt the wait of the loop, so that new callbacks are taken into account.
+        """
+        if self._thread is not None and threading.current_thread() is not self._thread:
+            try:
+                self._wakeup_writer.send(b"\0")
+            except socket.error:
+                # the wakeup socket is full, the loop is going to wake up anyway
+                pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def stop(self):
+        """
+        Stop the loop after the current iteration.
+        """
+        self._stopped = True
+        self.wakeup()
+
+    def run(self):
+        """
+        Run the loop until stop is called.
+        """
+        self._thread = threading.current_thread()
+        while not self._stopped:
+            timeout = self._run_timers()
+            if self._stopped:
+                break
+            if len(self._ready) > 0:
+                timeout = 0
+            try:
+                readable = select.select(self._readers.keys(), [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                try:
+                    sock, callback = self._readers[fd]
+                except KeyError:
+                    continue
+                callback()
+            for i in range(len(self._ready)):
+                handle = self._ready.popleft()
+                self.run_handle(handle)
+        self._thread = None
+
+    def start(self, name=None):
+        """
+        Run the loop on a new daemon thread. The resources of the loop are released once it is stopped.
+
+        :param name: the name of the thread
+        :rtype : threading.Thread
+        :return: the thread running the loop
+        """
+        thread = threading.Thread(target=self._run_and_close, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _run_and_close(self):
+        try:
+            self.run()
+        finally:
+            self.close()
+
+    def _run_timers(self):
+        """
+        Run the expired timers.
+
+        :return: the time until the next timer, None if there are no timers
+        """
+        due = []
+        with self._lock:
+            now = self.time()
+            while len(self._timers) > 0 and self._timers[0][0] <= now:
+                handle = heapq.heappop(self._timers)[2]
+                if not handle.cancelled:
+                    # a timer run now cannot be anticipated any more
+                    handle.cancelled = True
+                    due.append(handle)
+        for handle in due:
+            self.run_handle(handle)
+        # the callbacks may have scheduled other timers
+        with self._lock:
+            if len(self._timers) > 0:
+                return max(self._timers[0][0] - self.time(), 0)
+        return None
+
+    @property
+    def lock(self):
+        """
+        Return the lock that protects the timers of the loop.
+
+        :return: the lock
+        """
+        return self._lock
+
+    @staticmethod
+    def run_handle(handle):
+        """
+        Run a scheduled callback, logging its exceptions.
+
+        :type handle: TimerHandle
+        :param handle: the handle of the callback
+        """
+        try:
+            handle.callback(*handle.args)
+        except Exception:
+            logger.exception("Exception in event loop callback")
+
+    def close(self):
+        """
+        Release the resources of the loop.
+        """
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
@@ -7,6 +7,7 @@ import threading
 import os
 
 from coapthon import defines
+from coapthon.datagramio import DatagramIO
 from coapthon.layers.blocklayer import BlockLayer
 from coapthon.layers.cachelayer import CacheLayer
 from coapthon.layers.forwardLayer import ForwardLayer
@@ -32,7 +33,7 @@ class CoAP(object):
     """
     Implementation of the Forward Proxy
     """
-    def __init__(self, server_address, multicast=False, starting_mid=None, cache=False, sock=None):
+    def __init__(self, server_address, multicast=False, starting_mid=None, cache=False, sock=None, datagram_io=None):
         """
         Initialize the Forward Proxy.
 
@@ -41,6 +42,7 @@ class CoAP(object):
         :param starting_mid: used for testing purposes
         :param cache: if a cache must be used
         :param sock: if a socket has been created externally, it can be used directly
+        :param datagram_io: the I/O backend of the socket. If None, datagrams are received and sent one at a time
         """
         self.stopped = threading.Event()
         self.stopped.clear()
@@ -70,6 +72,9 @@ class CoAP(object):
 
         self.server_address = server_address
         self.multicast = multicast
+        if datagram_io is None:
+            datagram_io = DatagramIO()
+        self._datagram_io = datagram_io
 
         addrinfo = socket.getaddrinfo(self.server_address[0], None)[0]
 
@@ -127,7 +132,7 @@ class CoAP(object):
         Clean old transactions
         """
         while not self.stopped.isSet():
-            self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
+            self.stopped.wait(timeout=defines.PURGE_INTERVAL)
             self._messageLayer.purge()
 
     def listen(self, timeout=10):
@@ -139,17 +144,18 @@ class CoAP(object):
         self._socket.settimeout(float(timeout))
         while not self.stopped.isSet():
             try:
-                data, client_address = self._socket.recvfrom(4096)
+                datagrams = self._datagram_io.recv(self._socket)
             except socket.timeout:
                 continue
-            try:
-                #Start a new thread not to block other requests
-                args = ((data, client_address), )
-                t = threading.Thread(target=self.receive_datagram, args=args)
-                t.daemon = True
-                t.start()
-            except RuntimeError:
-                logging.exception("Exception with Executor")
+            for data, client_address in datagrams:
+                try:
+                    #Start a new thread not to block other requests
+                    args = ((data, client_address), )
+                    t = threading.Thread(target=self.receive_datagram, args=args)
+                    t.daemon = True
+                    t.start()
+                except RuntimeError:
+                    logging.exception("Exception with Executor")
         logging.debug("closing socket")
         self._socket.close()
 
@@ -183,6 +189,9 @@ class CoAP(object):
         
         serializer = Serializer()
         message = serializer.deserialize(data, client_address)
+        if self._datagram_io.pooled and not isinstance(message, int):
+            message.detach()
+        self._datagram_io.release(data)
         if isinstance(message, int):
             logger.error("receive_datagram - BAD REQUEST")
 
@@ -276,7 +285,7 @@ class CoAP(object):
             serializer = Serializer()
             message = serializer.serialize(message)
 
-            self._socket.sendto(message, (host, port))
+            self._datagram_io.send(self._socket, [(message, (host, port))])
 
     def _start_retransmission(self, transaction, message):
         """
@@ -2,6 +2,7 @@ import logging
 from coapthon import defines
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
+from coapthon.utils import token_key
 
 logger = logging.getLogger(__name__)
 
@@ -49,7 +50,7 @@ class BlockLayer(object):
         """
         if transaction.request.block2 is not None:
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = token_key(host, port, transaction.request.token)
             num, m, size = transaction.request.block2
             if key_token in self._block2_receive:
                 self._block2_receive[key_token].num = num
@@ -65,7 +66,7 @@ class BlockLayer(object):
         elif transaction.request.block1 is not None:
             # POST or PUT
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = token_key(host, port, transaction.request.token)
             num, m, size = transaction.request.block1
             if key_token in self._block1_receive:
                 content_type = transaction.request.content_type
@@ -118,7 +119,7 @@ class BlockLayer(object):
         :return: the edited transaction
         """
         host, port = transaction.response.source
-        key_token = hash(str(host) + str(port) + str(transaction.response.token))
+        key_token = token_key(host, port, transaction.response.token)
         if key_token in self._block1_sent and transaction.response.block1 is not None:
             item = self._block1_sent[key_token]
             transaction.block_transfer = True
@@ -208,7 +209,7 @@ class BlockLayer(object):
         :return: the edited transaction
         """
         host, port = transaction.request.source
-        key_token = hash(str(host) + str(port) + str(transaction.request.token))
+        key_token = token_key(host, port, transaction.request.token)
         if (key_token in self._block2_receive and transaction.response.payload is not None) or \
                 (transaction.response.payload is not None and len(transaction.response.payload) > defines.MAX_PAYLOAD):
             if key_token in self._block2_receive:
@@ -251,7 +252,7 @@ class BlockLayer(object):
         assert isinstance(request, Request)
         if request.block1 or (request.payload is not None and len(request.payload) > defines.MAX_PAYLOAD):
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = token_key(host, port, request.token)
             if request.block1:
                 num, m, size = request.block1
             else:
@@ -265,7 +266,7 @@ class BlockLayer(object):
             request.block1 = (num, m, size)
         elif request.block2:
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = token_key(host, port, request.token)
             num, m, size = request.block2
             item = BlockItem(size, num, m, size, "", None)
             self._block2_sent[key_token] = item
@@ -1,3 +1,4 @@
+import collections
 import logging
 import random
 import time
@@ -5,6 +6,7 @@ from coapthon.messages.message import Message
 from coapthon import defines
 from coapthon.messages.request import Request
 from coapthon.transaction import Transaction
+from coapthon.utils import mid_key, token_key
 
 __author__ = 'Giacomo Tanganelli'
 
@@ -32,6 +34,8 @@ class MessageLayer(object):
         """
         self._transactions = {}
         self._transactions_token = {}
+        # (deadline, table, key, transaction) in insertion order, hence in deadline order
+        self._expiry = collections.deque()
         if starting_mid is not None:
             self._current_mid = starting_mid
         else:
@@ -48,19 +52,36 @@ class MessageLayer(object):
         self._current_mid %= 65535
         return current_mid
 
-    def purge(self):
-        for k in self._transactions.keys():
-            now = time.time()
-            transaction = self._transactions[k]
-            if transaction.timestamp + defines.EXCHANGE_LIFETIME < now:
-                logger.debug("Delete transaction")
-                del self._transactions[k]
-        for k in self._transactions_token.keys():
-            now = time.time()
-            transaction = self._transactions_token[k]
-            if transaction.timestamp + defines.EXCHANGE_LIFETIME < now:
+    def _store(self, table, key, transaction):
+        """
+        Store a transaction and schedule its removal after EXCHANGE_LIFETIME.
+
+        :param table: the transactions table, either by MID or by Token
+        :param key: the key of the transaction
+        :type transaction: Transaction
+        :param transaction: the transaction
+        """
+        table[key] = transaction
+        self._expiry.append((time.time() + defines.EXCHANGE_LIFETIME, table, key, transaction))
+
+    def purge(self, retain=None):
+        """
+        Delete the expired transactions. Only the expired entries are visited.
+
+        :param retain: function called with an expired transaction, returns True if the transaction is still in use and
+        must be kept for another EXCHANGE_LIFETIME
+        """
+        now = time.time()
+        expiry = self._expiry
+        while len(expiry) > 0 and expiry[0][0] <= now:
+            deadline, table, key, transaction = expiry.popleft()
+            # the key may have been reused by a newer transaction
+            if table.get(key) is transaction:
+                if retain is not None and retain(transaction):
+                    expiry.append((now + defines.EXCHANGE_LIFETIME, table, key, transaction))
+                    continue
                 logger.debug("Delete transaction")
-                del self._transactions_token[k]
+                table.pop(key, None)
 
     def receive_request(self, request):
         """
@@ -71,15 +92,15 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the edited transaction
         """
-        logger.debug("receive_request - " + str(request))
+        logger.debug("receive_request - %s", request)
         try:
             host, port = request.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, request.mid)
-        key_token = str_append_hash(host, port, request.token)
+        key_mid = mid_key(host, port, request.mid)
+        key_token = token_key(host, port, request.token)
 
-        if key_mid in self._transactions.keys():
+        if key_mid in self._transactions:
             # Duplicated
             self._transactions[key_mid].request.duplicated = True
             transaction = self._transactions[key_mid]
@@ -87,8 +108,8 @@ class MessageLayer(object):
             request.timestamp = time.time()
             transaction = Transaction(request=request, timestamp=request.timestamp)
             with transaction:
-                self._transactions[key_mid] = transaction
-                self._transactions_token[key_token] = transaction
+                self._store(self._transactions, key_mid, transaction)
+                self._store(self._transactions_token, key_token, transaction)
         return transaction
 
     def receive_response(self, response):
@@ -105,18 +126,18 @@ class MessageLayer(object):
             host, port = response.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, response.mid)
-        key_mid_multicast = str_append_hash(defines.ALL_COAP_NODES, port, response.mid)
-        key_token = str_append_hash(host, port, response.token)
-        key_token_multicast = str_append_hash(defines.ALL_COAP_NODES, port, response.token)
-        if key_mid in self._transactions.keys():
+        key_mid = mid_key(host, port, response.mid)
+        key_mid_multicast = mid_key(defines.ALL_COAP_NODES, port, response.mid)
+        key_token = token_key(host, port, response.token)
+        key_token_multicast = token_key(defines.ALL_COAP_NODES, port, response.token)
+        if key_mid in self._transactions:
             transaction = self._transactions[key_mid]
             if response.token != transaction.request.token:
                 logger.warning("Tokens does not match -  response message " + str(host) + ":" + str(port))
                 return None, False
         elif key_token in self._transactions_token:
             transaction = self._transactions_token[key_token]
-        elif key_mid_multicast in self._transactions.keys():
+        elif key_mid_multicast in self._transactions:
             transaction = self._transactions[key_mid_multicast]
         elif key_token_multicast in self._transactions_token:
             transaction = self._transactions_token[key_token_multicast]
@@ -146,20 +167,20 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the transaction to which the message belongs to
         """
-        logger.debug("receive_empty - " + str(message))
+        logger.debug("receive_empty - %s", message)
         try:
             host, port = message.source
         except AttributeError:
             return
-        key_mid = str_append_hash(host, port, message.mid)
-        key_mid_multicast = str_append_hash(defines.ALL_COAP_NODES, port, message.mid)
-        key_token = str_append_hash(host, port, message.token)
-        key_token_multicast = str_append_hash(defines.ALL_COAP_NODES, port, message.token)
-        if key_mid in self._transactions.keys():
+        key_mid = mid_key(host, port, message.mid)
+        key_mid_multicast = mid_key(defines.ALL_COAP_NODES, port, message.mid)
+        key_token = token_key(host, port, message.token)
+        key_token_multicast = token_key(defines.ALL_COAP_NODES, port, message.token)
+        if key_mid in self._transactions:
             transaction = self._transactions[key_mid]
         elif key_token in self._transactions_token:
             transaction = self._transactions_token[key_token]
-        elif key_mid_multicast in self._transactions.keys():
+        elif key_mid_multicast in self._transactions:
             transaction = self._transactions[key_mid_multicast]
         elif key_token_multicast in self._transactions_token:
             transaction = self._transactions_token[key_token_multicast]
@@ -213,11 +234,11 @@ class MessageLayer(object):
         if transaction.request.mid is None:
             transaction.request.mid = self.fetch_mid()
 
-        key_mid = str_append_hash(host, port, request.mid)
-        self._transactions[key_mid] = transaction
+        key_mid = mid_key(host, port, request.mid)
+        self._store(self._transactions, key_mid, transaction)
 
-        key_token = str_append_hash(host, port, request.token)
-        self._transactions_token[key_token] = transaction
+        key_token = token_key(host, port, request.token)
+        self._store(self._transactions_token, key_token, transaction)
 
         return self._transactions[key_mid]
 
@@ -230,7 +251,7 @@ class MessageLayer(object):
         :rtype : Transaction
         :return: the edited transaction
         """
-        logger.debug("send_response - " + str(transaction.response))
+        logger.debug("send_response - %s", transaction.response)
         if transaction.response.type is None:
             if transaction.request.type == defines.Types["CON"] and not transaction.request.acknowledged:
                 transaction.response.type = defines.Types["ACK"]
@@ -249,8 +270,8 @@ class MessageLayer(object):
                 host, port = transaction.response.destination
             except AttributeError:
                 return
-            key_mid = str_append_hash(host, port, transaction.response.mid)
-            self._transactions[key_mid] = transaction
+            key_mid = mid_key(host, port, transaction.response.mid)
+            self._store(self._transactions, key_mid, transaction)
 
         transaction.request.acknowledged = True
         return transaction
@@ -271,8 +292,8 @@ class MessageLayer(object):
                 host, port = message.destination
             except AttributeError:
                 return
-            key_mid = str_append_hash(host, port, message.mid)
-            key_token = str_append_hash(host, port, message.token)
+            key_mid = mid_key(host, port, message.mid)
+            key_token = token_key(host, port, message.token)
             if key_mid in self._transactions:
                 transaction = self._transactions[key_mid]
                 related = transaction.response
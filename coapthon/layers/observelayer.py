@@ -1,11 +1,28 @@
 import logging
 import time
 from coapthon import defines
+from coapthon.utils import token_key
 
 __author__ = 'Giacomo Tanganelli'
 
 logger = logging.getLogger(__name__)
 
+# conditional attributes of an observe request, as query parameters
+ATTRIBUTES = ("pmin", "pmax", "gt", "lt", "st")
+
+
+def resource_value(resource):
+    """
+    Return the value of a resource that the gt, lt and st attributes are compared with.
+
+    :param resource: the resource
+    :return: the payload of the resource as a number, None if it is not a number
+    """
+    try:
+        return float(resource.payload)
+    except (TypeError, ValueError, KeyError, IndexError):
+        return None
+
 
 class ObserveItem(object):
     def __init__(self, timestamp, non_counter, allowed, transaction):
@@ -21,6 +38,69 @@ class ObserveItem(object):
         self.non_counter = non_counter
         self.allowed = allowed
         self.transaction = transaction
+        # the path under which the relation is indexed
+        self.path = None
+        # conditional attributes: minimum and maximum interval between notifications, thresholds and step
+        self.pmin = None
+        self.pmax = None
+        self.gt = None
+        self.lt = None
+        self.st = None
+        # value of the resource in the last notification, if the relation has thresholds or a step
+        self.value = None
+
+    @property
+    def conditional(self):
+        """
+        Check if the relation only wants the changes that cross a threshold or exceed a step.
+
+        :rtype : bool
+        :return: True, if gt, lt or st is set
+        """
+        return self.gt is not None or self.lt is not None or self.st is not None
+
+    def parse_attributes(self, query):
+        """
+        Read the conditional attributes from the query of the observe request. Invalid attributes are ignored.
+
+        :param query: the Uri-Query of the request
+        """
+        for parameter in query.split("&"):
+            name, separator, value = parameter.partition("=")
+            if name not in ATTRIBUTES:
+                continue
+            try:
+                value = float(value)
+            except ValueError:
+                logger.warning("Invalid conditional attribute " + parameter)
+                continue
+            if (name in ("pmin", "pmax") and value < 0) or (name == "st" and value <= 0):
+                logger.warning("Invalid conditional attribute " + parameter)
+                continue
+            setattr(self, name, value)
+        if self.pmax is not None and self.pmin is not None and self.pmax <= self.pmin:
+            logger.warning("Ignoring pmax not greater than pmin")
+            self.pmax = None
+
+    def condition(self, value):
+        """
+        Check if a new value of the resource must be notified: it crosses gt or lt, or it differs by at least st from
+        the last value notified. Without thresholds and step, and for values that are not numbers, every change
+        does.
+
+        :param value: the new value, as returned by resource_value
+        :rtype : bool
+        :return: True, if the value must be notified
+        """
+        if not self.conditional or value is None or self.value is None:
+            return True
+        if self.gt is not None and (value > self.gt) != (self.value > self.gt):
+            return True
+        if self.lt is not None and (value < self.lt) != (self.value < self.lt):
+            return True
+        if self.st is not None and abs(value - self.value) >= self.st:
+            return True
+        return False
 
 
 class ObserveLayer(object):
@@ -29,6 +109,92 @@ class ObserveLayer(object):
     """
     def __init__(self):
         self._relations = {}
+        # path of the resource -> keys of the relations of its observers
+        self._observers = {}
+        # RelationLog that stores the relations, None if they are only kept in memory
+        self.log = None
+
+    def _index(self, key_token, path):
+        """
+        Index a relation under the path of the observed resource, so that notify only visits its observers.
+
+        :param key_token: the key of the relation
+        :param path: the path of the resource
+        """
+        item = self._relations[key_token]
+        if item.path == path:
+            return
+        self._unindex(item, key_token)
+        item.path = path
+        self._observers.setdefault(path, set()).add(key_token)
+
+    def _unindex(self, item, key_token):
+        """
+        Remove a relation from the index.
+
+        :param item: the relation
+        :param key_token: the key of the relation
+        """
+        if item.path is None:
+            return
+        keys = self._observers.get(item.path)
+        if keys is not None:
+            keys.discard(key_token)
+            if len(keys) == 0:
+                del self._observers[item.path]
+        item.path = None
+
+    def _remove(self, key_token):
+        """
+        Remove a relation and its index entry.
+
+        :param key_token: the key of the relation
+        :rtype : ObserveItem
+        :return: the removed relation
+        :raise KeyError: if there is no such relation
+        """
+        item = self._relations.pop(key_token)
+        self._unindex(item, key_token)
+        if self.log is not None:
+            self.log.removed(key_token)
+        return item
+
+    def observers(self, path):
+        """
+        Return the number of observers of a resource.
+
+        :param path: the path of the resource
+        :rtype : int
+        :return: the number of observers
+        """
+        return len(self._observers.get(path, ()))
+
+    def relations(self, path):
+        """
+        Return the relations of the observers of a resource.
+
+        :param path: the path of the resource
+        :rtype : list
+        :return: the keys and the relations, as (key, ObserveItem) pairs
+        """
+        ret = []
+        for key in list(self._observers.get(path, ())):
+            relation = self._relations.get(key)
+            if relation is not None:
+                ret.append((key, relation))
+        return ret
+
+    def relation(self, request):
+        """
+        Return the relation of an observe request.
+
+        :param request: the request
+        :rtype : tuple
+        :return: the key and the relation, None if the request has no relation
+        """
+        host, port = request.source
+        key_token = token_key(host, port, request.token)
+        return key_token, self._relations.get(key_token)
 
     def send_request(self, request):
         """
@@ -40,7 +206,7 @@ class ObserveLayer(object):
         if request.observe == 0:
             # Observe request
             host, port = request.destination
-            key_token = hash(str(host) + str(port) + str(request.token))
+            key_token = token_key(host, port, request.token)
 
             self._relations[key_token] = ObserveItem(time.time(), None, True, None)
         if request.observe == 1:
@@ -59,7 +225,7 @@ class ObserveLayer(object):
         :return: the modified transaction
         """
         host, port = transaction.response.source
-        key_token = hash(str(host) + str(port) + str(transaction.response.token))
+        key_token = token_key(host, port, transaction.response.token)
         if key_token in self._relations and transaction.response.type == defines.Types["CON"]:
             transaction.notification = True
         return transaction
@@ -73,9 +239,9 @@ class ObserveLayer(object):
         :return: the message unmodified
         """
         host, port = message.destination
-        key_token = hash(str(host) + str(port) + str(message.token))
+        key_token = token_key(host, port, message.token)
         if key_token in self._relations and message.type == defines.Types["RST"]:
-            del self._relations[key_token]
+            self._remove(key_token)
         return message
 
     def receive_request(self, transaction):
@@ -91,20 +257,23 @@ class ObserveLayer(object):
         if transaction.request.observe == 0:
             # Observe request
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = token_key(host, port, transaction.request.token)
             non_counter = 0
             if key_token in self._relations:
                 # Renew registration
                 allowed = True
+                self._remove(key_token)
             else:
                 allowed = False
-            self._relations[key_token] = ObserveItem(time.time(), non_counter, allowed, transaction)
+            relation = ObserveItem(time.time(), non_counter, allowed, transaction)
+            relation.parse_attributes(transaction.request.uri_query)
+            self._relations[key_token] = relation
         elif transaction.request.observe == 1:
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = token_key(host, port, transaction.request.token)
             logger.info("Remove Subscriber")
             try:
-                del self._relations[key_token]
+                self._remove(key_token)
             except KeyError:
                 pass
 
@@ -123,10 +292,10 @@ class ObserveLayer(object):
         """
         if empty.type == defines.Types["RST"]:
             host, port = transaction.request.source
-            key_token = hash(str(host) + str(port) + str(transaction.request.token))
+            key_token = token_key(host, port, transaction.request.token)
             logger.info("Remove Subscriber")
             try:
-                del self._relations[key_token]
+                self._remove(key_token)
             except KeyError:
                 pass
             transaction.completed = True
@@ -141,28 +310,74 @@ class ObserveLayer(object):
         :return: the transaction unmodified
         """
         host, port = transaction.request.source
-        key_token = hash(str(host) + str(port) + str(transaction.request.token))
+        key_token = token_key(host, port, transaction.request.token)
         if key_token in self._relations:
             if transaction.response.code == defines.Codes.CONTENT.number:
                 if transaction.resource is not None and transaction.resource.observable:
 
                     transaction.response.observe = transaction.resource.observe_count
-                    self._relations[key_token].allowed = True
-                    self._relations[key_token].transaction = transaction
-                    self._relations[key_token].timestamp = time.time()
+                    relation = self._relations[key_token]
+                    # a relation is indexed when it is notified, not when it is registered
+                    registered = relation.path is None
+                    relation.allowed = True
+                    relation.transaction = transaction
+                    relation.timestamp = time.time()
+                    if relation.conditional:
+                        relation.value = resource_value(transaction.resource)
+                    self._index(key_token, transaction.resource.path)
+                    if self.log is not None:
+                        self._store(key_token, relation, registered)
                 else:
-                    del self._relations[key_token]
+                    self._remove(key_token)
             elif transaction.response.code >= defines.Codes.ERROR_LOWER_BOUND:
-                del self._relations[key_token]
+                self._remove(key_token)
         return transaction
 
-    def notify(self, resource, root=None):
+    def _store(self, key_token, relation, registered):
+        """
+        Write the state of a relation that has just been registered or notified to the log.
+
+        :param key_token: the key of the relation
+        :param relation: the relation
+        :param registered: True, if the relation is new
+        """
+        transaction = relation.transaction
+        if registered:
+            self.log.added(key_token, transaction.request, relation.path, relation.value)
+        elif relation.conditional:
+            self.log.updated(key_token, relation.value)
+        self.log.sequence(relation.path, transaction.response.observe)
+
+    def restore(self, transaction, value):
+        """
+        Add a relation stored before a restart, as if the observe request in the transaction had been received and
+        answered.
+
+        :type transaction: Transaction
+        :param transaction: the transaction with the observe request, the observed resource and the last notification
+        :param value: the value of the resource in the last notification, for the gt, lt and st attributes
+        :rtype : ObserveItem
+        :return: the relation, None if the observer registered again in the meantime
+        """
+        key_token, relation = self.relation(transaction.request)
+        if relation is not None:
+            return None
+        relation = ObserveItem(time.time(), 0, True, transaction)
+        relation.parse_attributes(transaction.request.uri_query)
+        relation.value = value
+        self._relations[key_token] = relation
+        self._index(key_token, transaction.resource.path)
+        return relation
+
+    def notify(self, resource, root=None, keys=None):
         """
         Prepare notification for the resource to all interested observers.
 
         :rtype: list
         :param resource: the resource for which send a new notification
         :param root: deprecated
+        :param keys: the keys of the relations to notify, None for all the observers of the resource whose
+        conditional attributes accept the change
         :return: the list of transactions to be notified
         """
         ret = []
@@ -170,19 +385,32 @@ class ObserveLayer(object):
             resource_list = root.with_prefix_resource(resource.path)
         else:
             resource_list = [resource]
-        for key in self._relations.keys():
-            if self._relations[key].transaction.resource in resource_list:
-                if self._relations[key].non_counter > defines.MAX_NON_NOTIFICATIONS \
-                        or self._relations[key].transaction.request.type == defines.Types["CON"]:
-                    self._relations[key].transaction.response.type = defines.Types["CON"]
-                    self._relations[key].non_counter = 0
-                elif self._relations[key].transaction.request.type == defines.Types["NON"]:
-                    self._relations[key].non_counter += 1
-                    self._relations[key].transaction.response.type = defines.Types["NON"]
-                self._relations[key].transaction.resource = resource
-                del self._relations[key].transaction.response.mid
-                del self._relations[key].transaction.response.token
-                ret.append(self._relations[key].transaction)
+        value = None
+        filtered = keys is None and not resource.deleted
+        if filtered:
+            value = resource_value(resource)
+        if keys is None:
+            keys = []
+            for item in resource_list:
+                keys.extend(self._observers.get(item.path, ()))
+        for key in keys:
+            relation = self._relations.get(key)
+            if relation is None or relation.transaction.resource not in resource_list:
+                continue
+            if filtered and not relation.condition(value):
+                continue
+            if relation.non_counter > defines.MAX_NON_NOTIFICATIONS \
+                    or relation.transaction.request.type == defines.Types["CON"]:
+                relation.transaction.response.type = defines.Types["CON"]
+                relation.non_counter = 0
+            elif relation.transaction.request.type == defines.Types["NON"]:
+                relation.non_counter += 1
+                relation.transaction.response.type = defines.Types["NON"]
+            relation.transaction.resource = resource
+            self._index(key, resource.path)
+            del relation.transaction.response.mid
+            del relation.transaction.response.token
+            ret.append(relation.transaction)
         return ret
 
     def remove_subscriber(self, message):
@@ -193,10 +421,10 @@ class ObserveLayer(object):
         """
         logger.debug("Remove Subcriber")
         host, port = message.destination
-        key_token = hash(str(host) + str(port) + str(message.token))
+        key_token = token_key(host, port, message.token)
         try:
             self._relations[key_token].transaction.completed = True
-            del self._relations[key_token]
+            self._remove(key_token)
         except AttributeError:
             logger.warning("No Transaction")
         except KeyError:
@@ -328,6 +328,9 @@ class ResourceLayer(object):
 
     def _handle_separate(self, transaction, callback):
         # Handle separate
+        if transaction.separate_timer is not None:
+            # the request is acknowledged now, the timer of the parent is not needed
+            self._parent._stop_separate_timer(transaction.separate_timer)
         if not transaction.request.acknowledged:
             self._parent._send_ack(transaction)
             transaction.request.acknowledged = True
@@ -336,6 +339,9 @@ class ResourceLayer(object):
 
     def _handle_separate_advanced(self, transaction, callback):
         # Handle separate
+        if transaction.separate_timer is not None:
+            # the request is acknowledged now, the timer of the parent is not needed
+            self._parent._stop_separate_timer(transaction.separate_timer)
         if not transaction.request.acknowledged:
             self._parent._send_ack(transaction)
             transaction.request.acknowledged = True
@@ -1,6 +1,7 @@
 from coapthon.utils import parse_blockwise
 from coapthon import defines
 from coapthon.messages.option import Option
+from coapthon.messages.optionlist import OptionList
 
 __author__ = 'Giacomo Tanganelli'
 
@@ -9,6 +10,10 @@ class Message(object):
     """
     Class to handle the Messages.
     """
+    __slots__ = ("_type", "_mid", "_token", "_options", "_payload", "_destination", "_source", "_code",
+                 "_acknowledged", "_rejected", "_timeouted", "_cancelled", "_duplicated", "_timestamp", "_version",
+                 "_pending", "payload_type")
+
     def __init__(self):
         """
         Data structure that represent a CoAP message
@@ -16,7 +21,7 @@ class Message(object):
         self._type = None
         self._mid = None
         self._token = None
-        self._options = []
+        self._options = OptionList()
         self._payload = None
         self._destination = None
         self._source = None
@@ -28,6 +33,8 @@ class Message(object):
         self._duplicated = None
         self._timestamp = None
         self._version = 1
+        self._pending = None
+        self.payload_type = None
 
     @property
     def version(self):
@@ -138,11 +145,13 @@ class Message(object):
     @property
     def options(self):
         """
-        Return the options of the CoAP message.
+        Return the options of the CoAP message, sorted by number.
 
-        :rtype: list
+        :rtype: OptionList
         :return: the options
         """
+        if self._pending is not None:
+            self.load()
         return self._options
 
     @options.setter
@@ -156,7 +165,9 @@ class Message(object):
         if value is None:
             value = []
         assert isinstance(value, list)
-        self._options = value
+        if self._pending is not None:
+            self.load()
+        self._options = OptionList(value)
 
     @property
     def payload(self):
@@ -165,6 +176,11 @@ class Message(object):
 
         :return: the payload
         """
+        if self._pending is not None:
+            self.load()
+        if type(self._payload) is memoryview:
+            # zero-copy payload from the decoder, materialized on first access
+            self._payload = self._payload.tobytes()
         return self._payload
 
     @payload.setter
@@ -174,6 +190,8 @@ class Message(object):
 
         :param value: the payload
         """
+        if self._pending is not None:
+            self.load()
         if isinstance(value, tuple):
             content_type, payload = value
             self.content_type = content_type
@@ -361,6 +379,37 @@ class Message(object):
         """
         self._timestamp = value
 
+    def load(self):
+        """
+        Decode the options and the payload left pending by a lazy de-serialization.
+
+        :raise AttributeError: if the options or the payload are malformed
+        """
+        if self._pending is not None:
+            decoder, view, pos = self._pending
+            self._pending = None
+            try:
+                decoder(self, view, pos)
+            except Exception:
+                # keep the message pending, so that every access reports the error
+                self._options = OptionList()
+                self._payload = None
+                self._pending = (decoder, view, pos)
+                raise
+
+    def detach(self):
+        """
+        Copy the option values and the payload still referring to the datagram, so that its buffer can be reused.
+        """
+        if self._pending is not None:
+            decoder, view, pos = self._pending
+            self._pending = (decoder, memoryview(view.tobytes()), pos)
+            return
+        for option in self._options:
+            option.detach()
+        if type(self._payload) is memoryview:
+            self._payload = self._payload.tobytes()
+
     def _already_in(self, option):
         """
         Check if an option is already in the message.
@@ -369,10 +418,7 @@ class Message(object):
         :param option: the option to be checked
         :return: True if already present, False otherwise
         """
-        for opt in self._options:
-            if option.number == opt.number:
-                return True
-        return False
+        return self.options.has(option.number)
 
     def add_option(self, option):
         """
@@ -389,9 +435,9 @@ class Message(object):
             if ret:
                 raise TypeError("Option : %s is not repeatable", option.name)
             else:
-                self._options.append(option)
+                self.options.append(option)
         else:
-            self._options.append(option)
+            self.options.append(option)
 
     def del_option(self, option):
         """
@@ -401,7 +447,7 @@ class Message(object):
         :param option: the option
         """
         assert isinstance(option, Option)
-        while option in list(self._options):
+        while option in self.options:
             self._options.remove(option)
 
     def del_option_by_name(self, name):
@@ -411,7 +457,7 @@ class Message(object):
         :type name: String
         :param name: option name
         """
-        for o in list(self._options):
+        for o in list(self.options):
             assert isinstance(o, Option)
             if o.name == name:
                 self._options.remove(o)
@@ -423,10 +469,7 @@ class Message(object):
         :type number: Integer
         :param number: option naumber
         """
-        for o in list(self._options):
-            assert isinstance(o, Option)
-            if o.number == number:
-                self._options.remove(o)
+        self.options.remove_number(number)
 
     @property
     def etag(self):
@@ -436,11 +479,7 @@ class Message(object):
         :rtype: list
         :return: the ETag values or [] if not specified by the request
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.ETAG.number:
-                value.append(option.value)
-        return value
+        return [option.value for option in self.options.get_all(defines.OptionRegistry.ETAG.number)]
 
     @etag.setter
     def etag(self, etag):
@@ -472,11 +511,10 @@ class Message(object):
 
         :return: the Content-Type value or 0 if not specified by the response
         """
-        value = 0
-        for option in self.options:
-            if option.number == defines.OptionRegistry.CONTENT_TYPE.number:
-                value = int(option.value)
-        return value
+        option = self.options.get(defines.OptionRegistry.CONTENT_TYPE.number)
+        if option is None:
+            return 0
+        return int(option.value)
 
     @content_type.setter
     def content_type(self, content_type):
@@ -506,14 +544,12 @@ class Message(object):
 
         :return: 0, if the request is an observing request
         """
-        for option in self.options:
-            if option.number == defines.OptionRegistry.OBSERVE.number:
-                # if option.value is None:
-                #    return 0
-                if option.value is None:
-                    return 0
-                return option.value
-        return None
+        option = self.options.get(defines.OptionRegistry.OBSERVE.number)
+        if option is None:
+            return None
+        if option.value is None:
+            return 0
+        return option.value
 
     @observe.setter
     def observe(self, ob):
@@ -542,11 +578,10 @@ class Message(object):
 
         :return: the Block1 value
         """
-        value = None
-        for option in self.options:
-            if option.number == defines.OptionRegistry.BLOCK1.number:
-                value = parse_blockwise(option.value)
-        return value
+        option = self.options.get(defines.OptionRegistry.BLOCK1.number)
+        if option is None:
+            return None
+        return parse_blockwise(option.value)
 
     @block1.setter
     def block1(self, value):
@@ -594,11 +629,10 @@ class Message(object):
 
         :return: the Block2 value
         """
-        value = None
-        for option in self.options:
-            if option.number == defines.OptionRegistry.BLOCK2.number:
-                value = parse_blockwise(option.value)
-        return value
+        option = self.options.get(defines.OptionRegistry.BLOCK2.number)
+        if option is None:
+            return None
+        return parse_blockwise(option.value)
 
     @block2.setter
     def block2(self, value):
@@ -654,7 +688,7 @@ class Message(object):
         msg = "From {source}, To {destination}, {type}-{mid}, {code}-{token}, ["\
             .format(source=self._source, destination=self._destination, type=inv_types[self._type], mid=self._mid,
                     code=defines.Codes.LIST[self._code].name, token=self._token)
-        for opt in self._options:
+        for opt in self.options:
             msg += "{name}: {value}, ".format(name=opt.name, value=opt.value)
         msg += "]"
         if self.payload is not None:
@@ -686,8 +720,8 @@ class Message(object):
 
         msg += "Code: " + str(defines.Codes.LIST[self._code].name) + "\n"
         msg += "Token: " + str(self._token) + "\n"
-        for opt in self._options:
+        for opt in self.options:
             msg += str(opt)
         msg += "Payload: " + "\n"
-        msg += str(self._payload) + "\n"
+        msg += str(self.payload) + "\n"
         return msg
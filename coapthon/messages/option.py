@@ -1,3 +1,4 @@
+import copy
 from coapthon import defines
 from coapthon.utils import byte_len
 
@@ -8,6 +9,8 @@ class Option(object):
     """
     Class to handle the CoAP Options.
     """
+    __slots__ = ("_number", "_value")
+
     def __init__(self):
         """
         Data structure to store options.
@@ -43,6 +46,9 @@ class Option(object):
         """
         if type(self._value) is None:
             self._value = bytearray()
+        if type(self._value) is memoryview:
+            # zero-copy value from the decoder, materialized on first access
+            self._value = bytearray(self._value)
         opt_type = defines.OptionRegistry.LIST[self._number].value_type
         if opt_type == defines.INTEGER:
             if byte_len(self._value) > 0:
@@ -124,4 +130,26 @@ class Option(object):
         :rtype : Boolean
         :return: True, if option are equal
         """
-        return self.__dict__ == other.__dict__
+        return self._number == other._number and self._value == other._value
+
+    def detach(self):
+        """
+        Copy the value, if it still refers to the datagram it has been decoded from.
+        """
+        if type(self._value) is memoryview:
+            self._value = bytearray(self._value)
+
+    def __deepcopy__(self, memo):
+        """
+        Return a deep copy of the option. Zero-copy values from the decoder are materialized in the copy.
+
+        :rtype : Option
+        :return: the copied option
+        """
+        option = Option()
+        option._number = self._number
+        if type(self._value) is memoryview:
+            option._value = bytearray(self._value)
+        else:
+            option._value = copy.deepcopy(self._value, memo)
+        return option
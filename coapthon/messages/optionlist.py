@@ -0,0 +1,252 @@
+__author__ = 'Giacomo Tanganelli'
+
+# options a list holds before its lookups go through an index: the shorter lists are scanned, since they are sorted
+INDEX_THRESHOLD = 8
+
+
+class OptionList(list):
+    """
+    List of options kept ordered by option number and indexed per option number.
+    Options with the same number keep their insertion order, so the list is always ready to be serialized.
+    The index maps a number to its option, or to the list of its options when the option is repeated. It is built on
+    the first lookup in a list of more than INDEX_THRESHOLD options: the usual messages have a few options, are
+    scanned, and do not pay for a dictionary while they are kept alive.
+    """
+    __slots__ = ("_index",)
+
+    def __init__(self, options=()):
+        """
+        Data structure to store the options of a message.
+
+        :param options: the initial options
+        """
+        super(OptionList, self).__init__()
+        self._index = None
+        self.extend(options)
+
+    def _reindex(self):
+        """
+        Restore the order after a generic list operation, and drop the index.
+        """
+        options = sorted(list.__iter__(self), key=lambda o: o.number)
+        list.__setslice__(self, 0, list.__len__(self), options)
+        self._index = None
+
+    def _lookup(self):
+        """
+        Return the index, building it if the list is long enough to need one.
+
+        :rtype : dict
+        :return: the index, None if the list is to be scanned
+        """
+        index = self._index
+        if index is None and list.__len__(self) > INDEX_THRESHOLD:
+            index = self._index = {}
+            for option in list.__iter__(self):
+                self._add_to_index(option)
+        return index
+
+    def _scan(self, number):
+        """
+        Find the options with a given number in the sorted list.
+
+        :param number: the option number
+        :rtype : tuple
+        :return: the position of the first option and the number of options
+        """
+        # the scans read the slot of the option number directly, the property costs more than the comparison
+        start = 0
+        count = 0
+        for option in list.__iter__(self):
+            if option._number < number:
+                start += 1
+            elif option._number == number:
+                count += 1
+            else:
+                break
+        return start, count
+
+    def _add_to_index(self, option):
+        """
+        Add an option to the index, if it has been built.
+
+        :type option: Option
+        :param option: the option
+        """
+        index = self._index
+        if index is None:
+            return
+        number = option.number
+        entry = index.get(number)
+        if entry is None:
+            index[number] = option
+        elif type(entry) is list:
+            entry.append(option)
+        else:
+            index[number] = [entry, option]
+
+    def get(self, number, default=None):
+        """
+        Return the first option with a given number.
+
+        :param number: the option number
+        :param default: the value returned if the option is not present
+        :rtype: Option
+        :return: the option
+        """
+        index = self._lookup()
+        if index is None:
+            for option in list.__iter__(self):
+                if option._number >= number:
+                    return option if option._number == number else default
+            return default
+        entry = index.get(number)
+        if entry is None:
+            return default
+        if type(entry) is list:
+            return entry[0]
+        return entry
+
+    def get_all(self, number):
+        """
+        Return all the options with a given number, in insertion order.
+
+        :param number: the option number
+        :rtype: list
+        :return: the options
+        """
+        index = self._lookup()
+        if index is None:
+            start, count = self._scan(number)
+            return list.__getslice__(self, start, start + count)
+        entry = index.get(number)
+        if entry is None:
+            return []
+        if type(entry) is list:
+            return list(entry)
+        return [entry]
+
+    def has(self, number):
+        """
+        Check if an option with a given number is present.
+
+        :param number: the option number
+        :return: True, if the option is present
+        """
+        index = self._lookup()
+        if index is None:
+            for option in list.__iter__(self):
+                if option._number >= number:
+                    return option._number == number
+            return False
+        return number in index
+
+    def remove_number(self, number):
+        """
+        Remove all the options with a given number.
+
+        :param number: the option number
+        """
+        start, count = self._scan(number)
+        if count > 0:
+            list.__delslice__(self, start, start + count)
+            if self._index is not None:
+                del self._index[number]
+
+    def append(self, option):
+        """
+        Add an option after the other options with the same number.
+
+        :type option: Option
+        :param option: the option
+        """
+        number = option.number
+        pos = list.__len__(self)
+        # options are usually added in ascending order, scan from the end
+        while pos > 0 and self[pos - 1].number > number:
+            pos -= 1
+        list.insert(self, pos, option)
+        self._add_to_index(option)
+
+    def insert(self, index, option):
+        """
+        Add an option. The position is given by the option number, the index is ignored.
+
+        :param index: ignored
+        :type option: Option
+        :param option: the option
+        """
+        self.append(option)
+
+    def extend(self, options):
+        """
+        Add several options.
+
+        :param options: the options
+        """
+        for option in options:
+            self.append(option)
+
+    def __iadd__(self, options):
+        self.extend(options)
+        return self
+
+    def remove(self, option):
+        """
+        Remove the first occurrence of an option.
+
+        :type option: Option
+        :param option: the option
+        :raise ValueError: if the option is not present
+        """
+        pos = self.index(option)
+        number = self[pos].number
+        list.__delitem__(self, pos)
+        index = self._index
+        if index is None:
+            return
+        entry = index[number]
+        if type(entry) is list:
+            entry.remove(option)
+            if len(entry) == 1:
+                index[number] = entry[0]
+        else:
+            del index[number]
+
+    def pop(self, index=-1):
+        option = list.pop(self, index)
+        self._reindex()
+        return option
+
+    def sort(self, *args, **kwargs):
+        """
+        The options are always sorted by number.
+        """
+        pass
+
+    def reverse(self):
+        raise TypeError("OptionList is always sorted by option number")
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._reindex()
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._reindex()
+
+    def __setslice__(self, i, j, sequence):
+        list.__setslice__(self, i, j, sequence)
+        self._reindex()
+
+    def __delslice__(self, i, j):
+        list.__delslice__(self, i, j)
+        self._reindex()
+
+    def __imul__(self, n):
+        list.__imul__(self, n)
+        self._reindex()
+        return self
+
+    def __reduce__(self):
+        return OptionList, (list(self),)
@@ -9,6 +9,8 @@ class Request(Message):
     """
     Class to handle the Requests.
     """
+    __slots__ = ()
+
     def __init__(self):
         """
         Initialize a Request message.
@@ -24,13 +26,7 @@ class Request(Message):
         :rtype : String
         :return: the Uri-Path
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.URI_PATH.number:
-                value.append(str(option.value) + '/')
-        value = "".join(value)
-        value = value[:-1]
-        return value
+        return "/".join([str(option.value) for option in self.options.get_all(defines.OptionRegistry.URI_PATH.number)])
 
     @uri_path.setter
     def uri_path(self, path):
@@ -68,11 +64,7 @@ class Request(Message):
         :rtype : String
         :return: the Uri-Query string
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.URI_QUERY.number:
-                value.append(str(option.value))
-        return "&".join(value)
+        return "&".join([str(option.value) for option in self.options.get_all(defines.OptionRegistry.URI_QUERY.number)])
 
     @uri_query.setter
     def uri_query(self, value):
@@ -104,10 +96,10 @@ class Request(Message):
         :return: the Accept value or None if not specified by the request
         :rtype : String
         """
-        for option in self.options:
-            if option.number == defines.OptionRegistry.ACCEPT.number:
-                return option.value
-        return None
+        option = self.options.get(defines.OptionRegistry.ACCEPT.number)
+        if option is None:
+            return None
+        return option.value
 
     @accept.setter
     def accept(self, value):
@@ -137,11 +129,7 @@ class Request(Message):
         :return: the If-Match values or [] if not specified by the request
         :rtype : list
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.IF_MATCH.number:
-                value.append(option.value)
-        return value
+        return [option.value for option in self.options.get_all(defines.OptionRegistry.IF_MATCH.number)]
 
     @if_match.setter
     def if_match(self, values):
@@ -173,10 +161,7 @@ class Request(Message):
         :return: True, if if-none-match is present
         :rtype : bool
         """
-        for option in self.options:
-            if option.number == defines.OptionRegistry.IF_NONE_MATCH.number:
-                return True
-        return False
+        return self.options.has(defines.OptionRegistry.IF_NONE_MATCH.number)
 
     def add_if_none_match(self):
         """
@@ -202,10 +187,10 @@ class Request(Message):
         :return: the Proxy-Uri values or None if not specified by the request
         :rtype : String
         """
-        for option in self.options:
-            if option.number == defines.OptionRegistry.PROXY_URI.number:
-                return option.value
-        return None
+        option = self.options.get(defines.OptionRegistry.PROXY_URI.number)
+        if option is None:
+            return None
+        return option.value
 
     @proxy_uri.setter
     def proxy_uri(self, value):
@@ -234,10 +219,10 @@ class Request(Message):
         :return: the Proxy-Schema values or None if not specified by the request
         :rtype : String
         """
-        for option in self.options:
-            if option.number == defines.OptionRegistry.PROXY_SCHEME.number:
-                return option.value
-        return None
+        option = self.options.get(defines.OptionRegistry.PROXY_SCHEME.number)
+        if option is None:
+            return None
+        return option.value
 
     @proxy_schema.setter
     def proxy_schema(self, value):
@@ -9,6 +9,8 @@ class Response(Message):
     """
     Class to handle the Responses.
     """
+    __slots__ = ()
+
     @property
     def location_path(self):
         """
@@ -17,11 +19,8 @@ class Response(Message):
         :rtype : String
         :return: the Location-Path option
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.LOCATION_PATH.number:
-                value.append(str(option.value))
-        return "/".join(value)
+        options = self.options.get_all(defines.OptionRegistry.LOCATION_PATH.number)
+        return "/".join([str(option.value) for option in options])
 
     @location_path.setter
     def location_path(self, path):
@@ -59,11 +58,7 @@ class Response(Message):
         :rtype : String
         :return: the Location-Query option
         """
-        value = []
-        for option in self.options:
-            if option.number == defines.OptionRegistry.LOCATION_QUERY.number:
-                value.append(option.value)
-        return value
+        return [option.value for option in self.options.get_all(defines.OptionRegistry.LOCATION_QUERY.number)]
 
     @location_query.setter
     def location_query(self, value):
@@ -96,11 +91,10 @@ class Response(Message):
         :rtype : int
         :return: the MaxAge option
         """
-        value = defines.OptionRegistry.MAX_AGE.default
-        for option in self.options:
-            if option.number == defines.OptionRegistry.MAX_AGE.number:
-                value = int(option.value)
-        return value
+        option = self.options.get(defines.OptionRegistry.MAX_AGE.number)
+        if option is None:
+            return defines.OptionRegistry.MAX_AGE.default
+        return int(option.value)
 
     @max_age.setter
     def max_age(self, value):
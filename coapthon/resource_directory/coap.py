@@ -131,7 +131,7 @@ class CoAP(object):
 
         """
         while not self.stopped.isSet():
-            self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
+            self.stopped.wait(timeout=defines.PURGE_INTERVAL)
             self._messageLayer.purge()
 
     def listen(self, timeout=10):
@@ -9,6 +9,7 @@ import os
 import re
 
 from coapthon import defines
+from coapthon.datagramio import DatagramIO
 from coapthon.client.helperclient import HelperClient
 from coapthon.layers.blocklayer import BlockLayer
 from coapthon.layers.cachelayer import CacheLayer
@@ -37,7 +38,8 @@ class CoAP(object):
     """
     Implementation of the Reverse Proxy
     """
-    def __init__(self, server_address, xml_file, multicast=False, starting_mid=None, cache=False, sock=None):
+    def __init__(self, server_address, xml_file, multicast=False, starting_mid=None, cache=False, sock=None,
+                 datagram_io=None):
         """
         Initialize the Reverse Proxy.
 
@@ -47,6 +49,7 @@ class CoAP(object):
         :param starting_mid: used for testing purposes
         :param cache: if a cache must be used
         :param sock: if a socket has been created externally, it can be used directly
+        :param datagram_io: the I/O backend of the socket. If None, datagrams are received and sent one at a time
         """
         self.stopped = threading.Event()
         self.stopped.clear()
@@ -75,6 +78,9 @@ class CoAP(object):
 
         self.server_address = server_address
         self.multicast = multicast
+        if datagram_io is None:
+            datagram_io = DatagramIO()
+        self._datagram_io = datagram_io
         self.file_xml = xml_file
         self._mapping = {}
 
@@ -224,7 +230,7 @@ class CoAP(object):
         Clean old transactions
         """
         while not self.stopped.isSet():
-            self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
+            self.stopped.wait(timeout=defines.PURGE_INTERVAL)
             self._messageLayer.purge()
 
     def listen(self, timeout=10):
@@ -236,14 +242,15 @@ class CoAP(object):
         self._socket.settimeout(float(timeout))
         while not self.stopped.isSet():
             try:
-                data, client_address = self._socket.recvfrom(4096)
+                datagrams = self._datagram_io.recv(self._socket)
             except socket.timeout:
                 continue
-            try:
+            for data, client_address in datagrams:
+                try:
 
-                self.receive_datagram((data, client_address))
-            except RuntimeError:
-                logger.exception("Exception with Executor")
+                    self.receive_datagram((data, client_address))
+                except RuntimeError:
+                    logger.exception("Exception with Executor")
         self._socket.close()
 
     def close(self):
@@ -267,6 +274,9 @@ class CoAP(object):
 
         serializer = Serializer()
         message = serializer.deserialize(data, client_address)
+        if self._datagram_io.pooled and not isinstance(message, int):
+            message.detach()
+        self._datagram_io.release(data)
         if isinstance(message, int):
             logger.error("receive_datagram - BAD REQUEST")
 
@@ -360,7 +370,7 @@ class CoAP(object):
             serializer = Serializer()
             message = serializer.serialize(message)
 
-            self._socket.sendto(message, (host, port))
+            self._datagram_io.send(self._socket, [(message, (host, port))])
 
     def add_resource(self, path, resource):
         """"
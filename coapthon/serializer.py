@@ -1,9 +1,11 @@
 import logging
 import struct
 import ctypes
+import threading
 from coapthon.messages.request import Request
 from coapthon.messages.response import Response
 from coapthon.messages.option import Option
+from coapthon.messages.optionlist import OptionList
 from coapthon import defines
 from coapthon.messages.message import Message
 
@@ -11,16 +13,48 @@ __author__ = 'Giacomo Tanganelli'
 
 logger = logging.getLogger(__name__)
 
+_header = struct.Struct("!BBH")
+_short = struct.Struct("!H")
+_integer = struct.Struct("!I")
+
+# per-thread output buffer reused by the buffer engine
+_arena = threading.local()
+
+# option header byte for every delta and length that fit in a nibble
+_option_headers = tuple(tuple((delta << defines.OPTION_DELTA_BITS) | length for length in range(13))
+                        for delta in range(13))
+
+# value type of every registered option
+_value_types = dict((number, item.value_type) for number, item in defines.OptionRegistry.LIST.iteritems())
+
 
 class Serializer(object):
     """
     Serializer class to serialize and deserialize CoAP message to/from udp streams.
     """
     @staticmethod
-    def deserialize(datagram, source):
+    def deserialize(datagram, source, engine=None, lazy=False):
         """
         De-serialize a stream of byte to a message.
 
+        :param datagram: the incoming udp message
+        :param source: the source address and port (ip, port)
+        :param engine: the deserializer engine to use, defaults to defines.DESERIALIZER_ENGINE
+        :param lazy: if True and the buffer engine is used, only the header and the token are decoded up front
+        :return: the message
+        :rtype: Message
+        """
+        if engine is None:
+            engine = defines.DESERIALIZER_ENGINE
+        if engine == defines.SERIALIZER_STRUCT:
+            return Serializer.deserialize_struct(datagram, source)
+        return Serializer.deserialize_buffer(datagram, source, lazy)
+
+    @staticmethod
+    def deserialize_struct(datagram, source):
+        """
+        De-serialize a stream of byte to a message slicing and unpacking the datagram byte by byte.
+
         :param datagram: the incoming udp message
         :param source: the source address and port (ip, port)
         :return: the message
@@ -126,10 +160,172 @@ class Serializer(object):
             return defines.Codes.BAD_REQUEST.number
 
     @staticmethod
-    def serialize(message):
+    def deserialize_buffer(datagram, source, lazy=False):
+        """
+        De-serialize a stream of byte to a message walking the datagram through a memoryview with integer offsets.
+        String and opaque option values and the payload are kept as zero-copy views of the datagram and
+        materialized on first access.
+
+        :param datagram: the incoming udp message
+        :param source: the source address and port (ip, port)
+        :param lazy: if True, only the header and the token are decoded, options and payload are decoded on
+        first access (see Serializer.load)
+        :return: the message
+        :rtype: Message
+        """
+        try:
+            view = memoryview(datagram)
+            length_packet = len(view)
+            first, code, mid = _header.unpack_from(view, 0)
+            version = (first & 0xC0) >> 6
+            message_type = (first & 0x30) >> 4
+            token_length = (first & 0x0F)
+            if Serializer.is_response(code):
+                message = Response()
+                message.code = code
+            elif Serializer.is_request(code):
+                message = Request()
+                message.code = code
+            else:
+                message = Message()
+            message.source = source
+            message.destination = None
+            message.version = version
+            message.type = message_type
+            message.mid = mid
+            pos = 4
+            if token_length > 0:
+                if pos + token_length > length_packet:
+                    raise AttributeError("Packet length %s, token length %s" % (length_packet, token_length))
+                message.token = view[pos:pos + token_length].tobytes()
+            else:
+                message.token = None
+            pos += token_length
+
+            if lazy:
+                if pos < length_packet:
+                    message._pending = (Serializer.read_options, view, pos)
+            else:
+                Serializer.read_options(message, view, pos)
+            return message
+        except (AttributeError, IndexError, struct.error):
+            return defines.Codes.BAD_REQUEST.number
+
+    @staticmethod
+    def read_options(message, view, pos):
+        """
+        Decode options and payload of a datagram into a message.
+
+        :type message: Message
+        :param message: the message, with header and token already decoded
+        :param view: a memoryview of the datagram
+        :param pos: the offset of the first option
+        :raise AttributeError: if the options or the payload are malformed
+        """
+        length_packet = len(view)
+        current_option = 0
+        while pos < length_packet:
+            next_byte = ord(view[pos])
+            pos += 1
+            if next_byte == defines.PAYLOAD_MARKER:
+                if length_packet <= pos:
+                    raise AttributeError("Packet length %s, pos %s" % (length_packet, pos))
+                message.payload = view[pos:]
+                break
+
+            num = next_byte >> 4
+            if num == 13:
+                num = ord(view[pos]) + 13
+                pos += 1
+            elif num == 14:
+                num = _short.unpack_from(view, pos)[0] + 269
+                pos += 2
+            elif num == 15:
+                raise AttributeError("Unsupported option number nibble " + str(num))
+            option_length = next_byte & 0x0F
+            if option_length == 13:
+                option_length = ord(view[pos]) + 13
+                pos += 1
+            elif option_length == 14:
+                option_length = _short.unpack_from(view, pos)[0] + 269
+                pos += 2
+            elif option_length == 15:
+                raise AttributeError("Unsupported option length nibble " + str(option_length))
+            current_option += num
+            if pos + option_length > length_packet:
+                raise AttributeError("Packet length %s, option length %s" % (length_packet, option_length))
+
+            try:
+                value_type = _value_types[current_option]
+            except KeyError:
+                (opt_critical, _, _) = defines.OptionRegistry.get_option_flags(current_option)
+                if opt_critical:
+                    raise AttributeError("Critical option %s unknown" % current_option)
+            else:
+                if value_type == defines.INTEGER:
+                    if option_length == 0:
+                        value = 0
+                    elif option_length == 1:
+                        value = ord(view[pos])
+                    elif option_length == 2:
+                        value = _short.unpack_from(view, pos)[0]
+                    elif option_length == 4:
+                        value = _integer.unpack_from(view, pos)[0]
+                    else:
+                        value = 0
+                        for b in view[pos:pos + option_length].tobytes():
+                            value = (value << 8) | ord(b)
+                elif option_length == 0:
+                    value = bytearray()
+                else:
+                    value = view[pos:pos + option_length]
+
+                option = Option()
+                option.number = current_option
+                option.value = value
+
+                message.add_option(option)
+                if option.number == defines.OptionRegistry.CONTENT_TYPE.number:
+                    message.payload_type = option.value
+            pos += option_length
+
+    @staticmethod
+    def load(message):
+        """
+        Decode options and payload of a message de-serialized with lazy=True.
+
+        :type message: Message
+        :param message: the message
+        :return: the message, or BAD_REQUEST if options or payload are malformed
+        """
+        try:
+            message.load()
+        except (AttributeError, IndexError, struct.error):
+            return defines.Codes.BAD_REQUEST.number
+        return message
+
+    @staticmethod
+    def serialize(message, engine=None):
         """
         Serialize a message to a udp packet
 
+        :type message: Message
+        :param message: the message to be serialized
+        :param engine: the serializer engine to use, defaults to defines.SERIALIZER_ENGINE
+        :rtype: stream of byte
+        :return: the message serialized
+        """
+        if engine is None:
+            engine = defines.SERIALIZER_ENGINE
+        if engine == defines.SERIALIZER_STRUCT:
+            return Serializer.serialize_struct(message)
+        return Serializer.serialize_buffer(message)
+
+    @staticmethod
+    def serialize_struct(message):
+        """
+        Serialize a message to a udp packet building a struct format with one entry per byte.
+
         :type message: Message
         :param message: the message to be serialized
         :rtype: stream of byte
@@ -234,6 +430,266 @@ class Serializer(object):
 
         return datagram
 
+    @staticmethod
+    def serialize_buffer(message):
+        """
+        Serialize a message to a udp packet in a single pass. Header, token, options and payload are written
+        directly into a reusable per-thread buffer, copying values with slice assignments.
+
+        :type message: Message
+        :param message: the message to be serialized
+        :rtype: str
+        :return: the message serialized
+        """
+        try:
+            buf = _arena.buffer
+        except AttributeError:
+            buf = _arena.buffer = bytearray(defines.SERIALIZER_BUFFER_SIZE)
+        end = Serializer.encode_into(message, buf, 0)
+        if end is None:
+            return None
+        return memoryview(buf)[:end].tobytes()
+
+    @staticmethod
+    def serialize_many(messages):
+        """
+        Serialize a batch of messages back to back into a single output buffer.
+
+        :type messages: list
+        :param messages: the messages to be serialized
+        :rtype: list
+        :return: a memoryview of the buffer for each message, None for messages that cannot be serialized
+        """
+        buf = bytearray(defines.SERIALIZER_BUFFER_SIZE)
+        bounds = []
+        pos = 0
+        for message in messages:
+            end = Serializer.encode_into(message, buf, pos)
+            if end is None:
+                bounds.append(None)
+            else:
+                bounds.append((pos, end))
+                pos = end
+        # views are taken once the buffer cannot be resized anymore
+        view = memoryview(buf)
+        return [view[bound[0]:bound[1]] if bound is not None else None for bound in bounds]
+
+    @staticmethod
+    def deserialize_many(datagrams, sources, lazy=False):
+        """
+        De-serialize a batch of datagrams with the buffer engine.
+
+        :type datagrams: list
+        :param datagrams: the incoming udp messages
+        :type sources: list
+        :param sources: the source address and port (ip, port) of each datagram
+        :param lazy: if True, only the header and the token of each datagram are decoded up front
+        :rtype: list
+        :return: the message, or BAD_REQUEST, for each datagram
+        """
+        deserialize = Serializer.deserialize_buffer
+        return [deserialize(datagram, source, lazy) for datagram, source in zip(datagrams, sources)]
+
+    @staticmethod
+    def encode_into(message, buf, pos):
+        """
+        Encode a message into a bytearray starting at a given offset, growing the bytearray when needed.
+
+        :type message: Message
+        :param message: the message to be serialized
+        :type buf: bytearray
+        :param buf: the output buffer
+        :param pos: the offset of the first byte of the message
+        :return: the offset following the last byte of the message, or None if the message cannot be serialized
+        """
+        token = message.token
+        if token is None or token == "":
+            tkl = 0
+        else:
+            token = str(token)
+            tkl = len(token)
+        tmp = (defines.VERSION << 2)
+        tmp |= message.type
+        tmp <<= 4
+        tmp |= tkl
+        code = message.code
+        if code is None:
+            code = 0
+        payload = message.payload
+        if payload is not None and len(payload) > 0:
+            payload = str(payload)
+        else:
+            payload = None
+
+        if len(buf) < pos + 4 + tkl:
+            buf.extend(bytearray(max(len(buf), 4 + tkl)))
+        try:
+            _header.pack_into(buf, pos, tmp, code, message.mid)
+        except struct.error:
+            logging.exception('Failed to pack structure')
+            return None
+        pos += 4
+        if tkl > 0:
+            buf[pos:pos + tkl] = token
+            pos += tkl
+
+        pos = Serializer.encode_options_into(Serializer.as_sorted_list(message.options), 0, buf, pos)
+
+        if payload is not None:
+            length = len(payload)
+            if pos + 1 + length > len(buf):
+                buf.extend(bytearray(max(len(buf), 1 + length)))
+            buf[pos] = defines.PAYLOAD_MARKER
+            pos += 1
+            buf[pos:pos + length] = payload
+            pos += length
+
+        return pos
+
+    @staticmethod
+    def encode_options_into(options, lastoptionnumber, buf, pos):
+        """
+        Encode a sorted list of options into a bytearray starting at a given offset, growing the bytearray when
+        needed.
+
+        :type options: list
+        :param options: the options, sorted by number
+        :param lastoptionnumber: the number of the option preceding the first one, deltas are computed from it
+        :type buf: bytearray
+        :param buf: the output buffer
+        :param pos: the offset of the first byte of the options
+        :return: the offset following the last byte of the options
+        """
+        for option in options:
+            number = option.number
+            optiondelta = number - lastoptionnumber
+            optionlength = option.length
+            # worst case: header byte, 2 bytes of extended delta and 2 bytes of extended length
+            if pos + 5 + optionlength > len(buf):
+                buf.extend(bytearray(max(len(buf), 5 + optionlength)))
+
+            if optiondelta <= 12 and optionlength <= 12:
+                buf[pos] = _option_headers[optiondelta][optionlength]
+                pos += 1
+            else:
+                if optiondelta <= 12:
+                    optiondeltanibble = optiondelta
+                else:
+                    optiondeltanibble = Serializer.get_option_nibble(optiondelta)
+                if optionlength <= 12:
+                    optionlengthnibble = optionlength
+                else:
+                    optionlengthnibble = Serializer.get_option_nibble(optionlength)
+                buf[pos] = (optiondeltanibble << defines.OPTION_DELTA_BITS) | optionlengthnibble
+                pos += 1
+
+                if optiondeltanibble == 13:
+                    buf[pos] = optiondelta - 13
+                    pos += 1
+                elif optiondeltanibble == 14:
+                    _short.pack_into(buf, pos, optiondelta - 269)
+                    pos += 2
+
+                if optionlengthnibble == 13:
+                    buf[pos] = optionlength - 13
+                    pos += 1
+                elif optionlengthnibble == 14:
+                    _short.pack_into(buf, pos, optionlength - 269)
+                    pos += 2
+
+            if optionlength > 0:
+                opt_type = _value_types[number]
+                if opt_type == defines.INTEGER:
+                    value = option.value
+                    if optionlength == 1:
+                        buf[pos] = value
+                    elif optionlength == 2:
+                        _short.pack_into(buf, pos, value)
+                    elif optionlength == 4:
+                        _integer.pack_into(buf, pos, value)
+                    else:
+                        buf[pos:pos + optionlength] = bytearray(Serializer.int_to_words(value, optionlength, 8))
+                    pos += optionlength
+                else:
+                    if opt_type == defines.STRING:
+                        value = str(option.value)
+                    else:
+                        value = option.value
+                    length = len(value)
+                    buf[pos:pos + length] = value
+                    pos += length
+
+            lastoptionnumber = number
+
+        return pos
+
+    @staticmethod
+    def encode_template(message):
+        """
+        Pre-encode the options and the payload of a notification so that it can be sent to many observers.
+        Only the header, the token and the Observe option differ between observers of the same representation.
+
+        :type message: Message
+        :param message: the first notification of the representation
+        :return: the options preceding Observe, the number of the last of them, the options following Observe and
+        the payload, all already encoded
+        """
+        observe = defines.OptionRegistry.OBSERVE.number
+        options = Serializer.as_sorted_list(message.options)
+        before = [option for option in options if option.number < observe]
+        after = [option for option in options if option.number > observe]
+        buf = bytearray(defines.SERIALIZER_BUFFER_SIZE)
+        end = Serializer.encode_options_into(before, 0, buf, 0)
+        head = str(buf[:end])
+        if len(before) > 0:
+            head_last = before[-1].number
+        else:
+            head_last = 0
+        end = Serializer.encode_options_into(after, observe, buf, 0)
+        payload = message.payload
+        if payload is not None and len(payload) > 0:
+            payload = str(payload)
+            buf[end:] = chr(defines.PAYLOAD_MARKER) + payload
+            end += 1 + len(payload)
+        tail = str(buf[:end])
+        return head, head_last, tail
+
+    @staticmethod
+    def serialize_notification(message, template):
+        """
+        Serialize a notification splicing its header, token and Observe option into a pre-encoded template.
+
+        :type message: Message
+        :param message: the notification, its options and payload must be the ones of the template plus Observe
+        :param template: the template returned by encode_template
+        :rtype: str
+        :return: the message serialized
+        """
+        head, head_last, tail = template
+        token = message.token
+        if token is None or token == "":
+            token = ""
+        else:
+            token = str(token)
+        tmp = (defines.VERSION << 2)
+        tmp |= message.type
+        tmp <<= 4
+        tmp |= len(token)
+        code = message.code
+        if code is None:
+            code = 0
+        try:
+            header = _header.pack(tmp, code, message.mid)
+        except struct.error:
+            logging.exception('Failed to pack structure')
+            return None
+        observe = Option()
+        observe.number = defines.OptionRegistry.OBSERVE.number
+        observe.value = message.observe
+        buf = bytearray(5 + observe.length)
+        end = Serializer.encode_options_into([observe], head_last, buf, 0)
+        return header + token + head + str(buf[:end]) + tail
+
     @staticmethod
     def is_request(code):
         """
@@ -304,6 +760,7 @@ class Serializer(object):
             length = struct.unpack("!B", values[pos])[0] + 13
             pos += 1
         elif l_nibble == 14:
+            s = struct.Struct("!H")
             length = s.unpack_from(values[pos:])[0] + 269
             pos += 2
         else:
@@ -345,6 +802,9 @@ class Serializer(object):
 
         :return: the sorted list
         """
+        if isinstance(options, OptionList):
+            # already sorted
+            return options
         if len(options) > 0:
             options.sort(None, key=lambda o: o.number)
         return options
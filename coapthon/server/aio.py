@@ -0,0 +1,126 @@
+import errno
+import logging
+import socket
+
+from coapthon import defines
+from coapthon.eventloop import EventLoop, TimerHandle
+from coapthon.server import coap
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+
+class CoAP(coap.CoAP):
+    """
+    Implementation of the CoAP server on a single-threaded event loop.
+    Requests are processed by the same layers as the threaded server, but on the loop thread, and the separate
+    response timers, the retransmissions and the purge of old transactions are scheduled on the loop, which is also
+    the scheduler of the server.
+    Resources must not block while rendering, since they run on the loop thread.
+    """
+    def __init__(self, server_address, multicast=False, starting_mid=None, sock=None, cb_ignore_listen_exception=None,
+                 datagram_io=None, notifier=None, relation_log=None):
+        """
+        Initialize the server.
+
+        :param server_address: Server address for incoming connections
+        :param multicast: if the ip is a multicast address
+        :param starting_mid: used for testing purposes
+        :param sock: if a socket has been created externally, it can be used directly
+        :param cb_ignore_listen_exception: Callback function to handle exception raised during the socket listen operation
+        :param datagram_io: the I/O backend of the socket. If None, datagrams are received and sent one at a time
+        :param notifier: the NotificationScheduler that coalesces the notifications. If None, every change is notified
+        at once
+        :param relation_log: the RelationLog that stores the observe relations. If None, the relations are only kept in
+        memory
+        """
+        self._loop = EventLoop()
+        self._listen_exception = None
+        super(CoAP, self).__init__(server_address, multicast, starting_mid, sock, cb_ignore_listen_exception,
+                                   datagram_io=datagram_io, notifier=notifier,
+                                   relation_log=relation_log)
+
+    @property
+    def loop(self):
+        """
+        Return the event loop of the server.
+
+        :rtype : EventLoop
+        :return: the event loop
+        """
+        return self._loop
+
+    def _start_scheduler(self):
+        """
+        Run the timers of the server on the event loop.
+
+        :rtype : EventLoop
+        :return: the event loop
+        """
+        return self._loop
+
+    def purge(self):
+        """
+        Schedule the periodic purge of old transactions on the event loop.
+        """
+        self._loop.call_later(defines.PURGE_INTERVAL, self._purge)
+
+    def _purge(self):
+        if not self.stopped.isSet():
+            self._messageLayer.purge()
+            self._loop.call_later(defines.PURGE_INTERVAL, self._purge)
+
+    def listen(self, timeout=10):
+        """
+        Run the event loop until the server is stopped.
+
+        :param timeout: unused, the loop wakes up as soon as the server is stopped
+        """
+        self._socket.setblocking(0)
+        self._loop.add_reader(self._socket, self._read_datagrams)
+        self.listening.set()
+        try:
+            self._loop.run()
+        finally:
+            self.listening.clear()
+            self._loop.remove_reader(self._socket)
+            self._socket.close()
+            self._loop.close()
+            self._close_wakeup()
+        if self._listen_exception is not None:
+            raise self._listen_exception
+
+    def _read_datagrams(self):
+        """
+        Read the datagrams waiting on the socket, up to EVENT_LOOP_BATCH so that timers are not delayed.
+        """
+        received = 0
+        for i in range(defines.EVENT_LOOP_BATCH):
+            try:
+                datagrams = self._datagram_io.recv(self._socket)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if self._cb_ignore_listen_exception is not None and callable(self._cb_ignore_listen_exception):
+                    if self._cb_ignore_listen_exception(e, self):
+                        continue
+                self._listen_exception = e
+                self.close()
+                return
+            for data, client_address in datagrams:
+                if len(client_address) > 2:
+                    client_address = (client_address[0], client_address[1])
+                self.receive_datagram(data, client_address)
+                self._datagram_io.release(data)
+            received += len(datagrams)
+            if received >= defines.EVENT_LOOP_BATCH:
+                return
+
+    def _dispatch_request(self, transaction):
+        """
+        Process a new request on the loop thread.
+
+        :param transaction: the transaction created to manage the request
+        """
+        self._process_request(transaction)
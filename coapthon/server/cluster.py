@@ -0,0 +1,259 @@
+import logging
+import multiprocessing
+import socket
+import threading
+
+from coapthon.server import coap
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+
+def reuse_port_socket(server_address):
+    """
+    Create a UDP socket bound with SO_REUSEPORT, so that several processes can listen on the same port.
+
+    :param server_address: the address to bind
+    :return: the socket
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):  # pragma: no cover
+        raise NotImplementedError("SO_REUSEPORT is not available on this platform")
+    addrinfo = socket.getaddrinfo(server_address[0], None)[0]
+    sock = socket.socket(addrinfo[0], socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(server_address)
+    return sock
+
+
+class Replicator(object):
+    """
+    Local channel between the workers of a cluster: the state changes of the resources of a worker are applied to the
+    same resources of the other workers, which notify their own observers.
+    The payloads and the ETags of the resources are replicated, as well as their deletion. Resources created at run
+    time stay on the worker that created them.
+    """
+    def __init__(self, index, inboxes):
+        """
+        Initialize the replicator of a worker.
+
+        :param index: the index of the worker
+        :param inboxes: the queues of all the workers
+        """
+        self._index = index
+        self._inboxes = inboxes
+        self._server = None
+
+    def start(self, server):
+        """
+        Start applying the changes received from the other workers.
+
+        :param server: the server of the worker
+        """
+        self._server = server
+        thread = threading.Thread(target=self._receive, name="CoAP-Replicator")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """
+        Stop the receiver thread of the worker.
+        """
+        self._inboxes[self._index].put(None)
+
+    def publish(self, resource):
+        """
+        Send the state of a resource to the other workers.
+
+        :param resource: the resource that changed
+        """
+        change = (resource.path, dict(resource._payload), list(resource._etag), resource.deleted)
+        for index, inbox in enumerate(self._inboxes):
+            if index != self._index:
+                inbox.put(change)
+
+    def _receive(self):
+        """
+        Receiver thread: pass the changes to the scheduler of the server, which runs on the same thread as the requests
+        for the event loop server.
+        """
+        inbox = self._inboxes[self._index]
+        while True:
+            change = inbox.get()
+            if change is None:
+                return
+            self._server._scheduler.call_soon(self._apply, *change)
+
+    def _apply(self, path, payload, etag, deleted):
+        """
+        Apply a change received from another worker and notify the observers of the resource.
+
+        :param path: the path of the resource
+        :param payload: the payloads of the resource, by content type
+        :param etag: the ETags of the resource
+        :param deleted: if the resource has been deleted
+        """
+        try:
+            resource = self._server.root[path]
+        except KeyError:
+            logger.debug("Replicated resource not found: " + str(path))
+            return
+        if deleted:
+            self._server.remove_resource(path)
+            resource.deleted = True
+        else:
+            resource._payload = payload
+            resource._etag = etag
+        coap.CoAP.notify(self._server, resource)
+        resource.deleted = False
+
+
+def _replicated(server_class):
+    """
+    Extend a server class so that the notifications of its resources are also published to the other workers.
+
+    :param server_class: the server class
+    :return: the new class
+    """
+    class ReplicatedCoAP(server_class):
+        replicator = None
+
+        def notify(self, resource):
+            """
+            Notifies the observers of a resource, in this worker and in the other ones.
+
+            :param resource: the resource
+            """
+            self.replicator.publish(resource)
+            super(ReplicatedCoAP, self).notify(resource)
+
+    return ReplicatedCoAP
+
+
+class Cluster(object):
+    """
+    Launcher of a server sharded over several processes. Every worker binds the same port with SO_REUSEPORT and the
+    kernel spreads the clients among them by hash of the address 4-tuple, so that a client, and its observe
+    relationships and transactions, always stay on the same worker.
+    The resource tree is defined by a setup function called in every worker.
+    """
+    def __init__(self, server_address, setup, workers=None, server_class=None, replicate=False, **kwargs):
+        """
+        Initialize the cluster.
+
+        :param server_address: the address shared by the workers
+        :param setup: function called with the server of each worker, to add the resources
+        :param workers: the number of worker processes, the number of CPUs by default
+        :param server_class: the server class, coapthon.server.coap.CoAP by default
+        :param replicate: if True, the state changes of the resources are replicated between the workers
+        :param kwargs: other arguments for the server class
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if server_class is None:
+            server_class = coap.CoAP
+        assert workers > 0
+        self.server_address = server_address
+        self._setup = setup
+        self._workers = workers
+        self._server_class = server_class
+        self._kwargs = kwargs
+        self._replicate = replicate
+        self._inboxes = [multiprocessing.Queue() for i in range(workers)] if replicate else None
+        self._ready = [multiprocessing.Event() for i in range(workers)]
+        self._stop = multiprocessing.Event()
+        self._processes = []
+
+    @property
+    def workers(self):
+        """
+        Return the worker processes.
+
+        :rtype : list
+        :return: the processes
+        """
+        return list(self._processes)
+
+    def start(self, timeout=10):
+        """
+        Fork the workers and wait until all of them are listening.
+
+        :param timeout: the maximum time to wait for each worker
+        :rtype : bool
+        :return: True, if all the workers are listening
+        """
+        for index in range(self._workers):
+            process = multiprocessing.Process(target=self._serve, args=(index,), name="CoAP-Worker-%d" % index)
+            process.daemon = True
+            process.start()
+            self._processes.append(process)
+        ready = True
+        for event in self._ready:
+            ready = event.wait(timeout) and ready
+        return ready
+
+    def stop(self, timeout=10):
+        """
+        Stop the workers and wait for them to exit.
+
+        :param timeout: the maximum time to wait for each worker before terminating it
+        """
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():  # pragma: no cover
+                process.terminate()
+                process.join()
+        self._processes = []
+
+    def serve_forever(self):  # pragma: no cover
+        """
+        Start the workers and wait until they are stopped, or until the launcher is interrupted.
+        """
+        self.start()
+        try:
+            while not self._stop.is_set():
+                self._stop.wait(1)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def _serve(self, index):
+        """
+        Worker process: run a server on a socket bound with SO_REUSEPORT.
+
+        :param index: the index of the worker
+        """
+        sock = reuse_port_socket(self.server_address)
+        server_class = self._server_class
+        replicator = None
+        if self._replicate:
+            server_class = _replicated(server_class)
+            replicator = Replicator(index, self._inboxes)
+        server = server_class(self.server_address, sock=sock, **self._kwargs)
+        if replicator is not None:
+            server.replicator = replicator
+            replicator.start(server)
+        self._setup(server)
+        watcher = threading.Thread(target=self._wait_stop, args=(server, replicator))
+        watcher.daemon = True
+        watcher.start()
+        self._ready[index].set()
+        try:
+            server.listen(1)
+        except KeyboardInterrupt:
+            server.close()
+            if replicator is not None:
+                replicator.stop()
+
+    def _wait_stop(self, server, replicator):
+        """
+        Stop the server of the worker when the cluster is stopped.
+
+        :param server: the server of the worker
+        :param replicator: the replicator of the worker, or None
+        """
+        self._stop.wait()
+        server.close()
+        if replicator is not None:
+            replicator.stop()
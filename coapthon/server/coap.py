@@ -1,11 +1,16 @@
+import errno
 import logging.config
 import os
 import random
+import select
 import socket
 import struct
 import threading
+import time
 
 from coapthon import defines
+from coapthon.datagramio import DatagramIO
+from coapthon.eventloop import EventLoop
 from coapthon.layers.blocklayer import BlockLayer
 from coapthon.layers.messagelayer import MessageLayer
 from coapthon.layers.observelayer import ObserveLayer
@@ -16,6 +21,9 @@ from coapthon.messages.request import Request
 from coapthon.messages.response import Response
 from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.server.notifications import NotificationScheduler
+from coapthon.server.workerpool import WorkerPool
+from coapthon.transaction import Transaction
 from coapthon.utils import Tree
 from coapthon.utils import create_logging
 
@@ -34,7 +42,8 @@ class CoAP(object):
     """
     Implementation of the CoAP server
     """
-    def __init__(self, server_address, multicast=False, starting_mid=None, sock=None, cb_ignore_listen_exception=None):
+    def __init__(self, server_address, multicast=False, starting_mid=None, sock=None, cb_ignore_listen_exception=None,
+                 executor=None, datagram_io=None, notifier=None, relation_log=None):
         """
         Initialize the server.
 
@@ -43,16 +52,33 @@ class CoAP(object):
         :param starting_mid: used for testing purposes
         :param sock: if a socket has been created externally, it can be used directly
         :param cb_ignore_listen_exception: Callback function to handle exception raised during the socket listen operation
+        :param executor: the executor of the requests, an object with a submit(function, *args) method that returns
+        False when the task cannot be accepted. If None, a WorkerPool is used
+        :param datagram_io: the I/O backend of the socket, for example the one returned by create_datagram_io. If None,
+        datagrams are received and sent one at a time
+        :param notifier: the NotificationScheduler that coalesces the notifications. If None, every change is notified
+        at once
+        :param relation_log: the RelationLog that stores the observe relations, so that restore_relations can bring
+        them back after a restart. If None, the relations are only kept in memory
         """
         self.stopped = threading.Event()
         self.stopped.clear()
-        self.to_be_stopped = []
+        # set while the server is receiving datagrams
+        self.listening = threading.Event()
+        self._draining = False
+        # requests in processing and CON messages waiting for an ACK
+        self._in_flight = 0
+        self._in_flight_condition = threading.Condition()
+        # written by close to wake up the receive loop
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._scheduler = self._start_scheduler()
         self.purge = threading.Thread(target=self.purge)
         self.purge.start()
 
         self._messageLayer = MessageLayer(starting_mid)
         self._blockLayer = BlockLayer()
         self._observeLayer = ObserveLayer()
+        self._observeLayer.log = relation_log
         self._requestLayer = RequestLayer(self)
         self.resourceLayer = ResourceLayer(self)
 
@@ -63,9 +89,23 @@ class CoAP(object):
         self.root["/"] = root
         self._serializer = None
 
+        if executor is None:
+            self._executor = WorkerPool()
+            self._own_executor = True
+        else:
+            self._executor = executor
+            self._own_executor = False
+
         self.server_address = server_address
         self.multicast = multicast
         self._cb_ignore_listen_exception = cb_ignore_listen_exception
+        if datagram_io is None:
+            datagram_io = DatagramIO()
+        self._datagram_io = datagram_io
+        self._notifier = notifier
+        self._notifier_lock = threading.Lock()
+        if notifier is not None:
+            notifier.start(self)
 
         addrinfo = socket.getaddrinfo(self.server_address[0], None)[0]
 
@@ -125,21 +165,28 @@ class CoAP(object):
 
         """
         while not self.stopped.isSet():
-            self.stopped.wait(timeout=defines.EXCHANGE_LIFETIME)
+            self.stopped.wait(timeout=defines.PURGE_INTERVAL)
             self._messageLayer.purge()
 
     def listen(self, timeout=10):
         """
-        Listen for incoming messages. Timeout is used to check if the server must be switched off.
+        Listen for incoming messages. The loop wakes up as soon as the server is closed.
 
         :param timeout: Socket Timeout in seconds
         """
         self._socket.settimeout(float(timeout))
+        self.listening.set()
         while not self.stopped.isSet():
             try:
-                data, client_address = self._socket.recvfrom(4096)
-                if len(client_address) > 2:
-                    client_address = (client_address[0], client_address[1])
+                readable = select.select([self._socket, self._wakeup_reader], [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if self._socket not in readable:
+                continue
+            try:
+                datagrams = self._datagram_io.recv(self._socket)
             except socket.timeout:
                 continue
             except Exception as e:
@@ -147,49 +194,150 @@ class CoAP(object):
                     if self._cb_ignore_listen_exception(e, self):
                         continue
                 raise
-            try:
-                serializer = Serializer()
-                message = serializer.deserialize(data, client_address)
+            for data, client_address in datagrams:
+                if len(client_address) > 2:
+                    client_address = (client_address[0], client_address[1])
+                self.receive_datagram(data, client_address)
+                self._datagram_io.release(data)
+        self.listening.clear()
+        self._socket.close()
+        self._close_wakeup()
+
+    def receive_datagram(self, data, client_address):
+        """
+        Handle a datagram received from the udp socket.
+
+        :param data: the datagram
+        :param client_address: the address of the sender
+        """
+        try:
+            serializer = Serializer()
+            # options and payload are decoded only once the message is known not to be a duplicate
+            message = serializer.deserialize(data, client_address, lazy=True)
+            if isinstance(message, int):
+                self._send_bad_request(client_address, message)
+                return
+
+            if isinstance(message, Request):
+                transaction = self._messageLayer.receive_request(message)
+                if transaction.request.duplicated and transaction.completed:
+                    logger.debug("message duplicated, transaction completed")
+                    if transaction.response is not None:
+                        self.send_datagram(transaction.response)
+                    return
+                elif transaction.request.duplicated and not transaction.completed:
+                    logger.debug("message duplicated, transaction NOT completed")
+                    self._send_ack(transaction)
+                    return
+                message = serializer.load(message)
                 if isinstance(message, int):
-                    logger.error("receive_datagram - BAD REQUEST")
-
-                    rst = Message()
-                    rst.destination = client_address
-                    rst.type = defines.Types["RST"]
-                    rst.code = message
-                    rst.mid = self._messageLayer.fetch_mid()
-                    self.send_datagram(rst)
-                    continue
+                    transaction.response = self._send_bad_request(client_address, message)
+                    transaction.completed = True
+                    return
+                if self._datagram_io.pooled:
+                    # the request outlives the receive buffer
+                    message.detach()
+                logger.debug("receive_datagram - %s", message)
+                if self._draining:
+                    logger.info("Draining, rejecting request from %s", message.source)
+                    self._send_service_unavailable(transaction)
+                    return
+                self._exchange_started()
+                self._dispatch_request(transaction)
+            elif isinstance(message, Response):
+                logger.error("Received response from %s", message.source)
+
+            else:  # is Message
+                transaction = self._messageLayer.receive_empty(message)
+                if transaction is not None:
+                    with transaction:
+                        self._blockLayer.receive_empty(message, transaction)
+                        self._observeLayer.receive_empty(message, transaction)
+
+        except RuntimeError:
+            logger.exception("Exception with Executor")
+
+    def _dispatch_request(self, transaction):
+        """
+        Queue a new request for the executor. If the executor is saturated the request is rejected at once.
 
-                logger.debug("receive_datagram - " + str(message))
-                if isinstance(message, Request):
-                    transaction = self._messageLayer.receive_request(message)
-                    if transaction.request.duplicated and transaction.completed:
-                        logger.debug("message duplicated, transaction completed")
-                        if transaction.response is not None:
-                            self.send_datagram(transaction.response)
-                        continue
-                    elif transaction.request.duplicated and not transaction.completed:
-                        logger.debug("message duplicated, transaction NOT completed")
-                        self._send_ack(transaction)
-                        continue
-                    args = (transaction, )
-                    t = threading.Thread(target=self.receive_request, args=args)
-                    t.start()
-                # self.receive_datagram(data, client_address)
-                elif isinstance(message, Response):
-                    logger.error("Received response from %s", message.source)
-
-                else:  # is Message
-                    transaction = self._messageLayer.receive_empty(message)
-                    if transaction is not None:
-                        with transaction:
-                            self._blockLayer.receive_empty(message, transaction)
-                            self._observeLayer.receive_empty(message, transaction)
-
-            except RuntimeError:
-                logger.exception("Exception with Executor")
-        self._socket.close()
+        :param transaction: the transaction created to manage the request
+        """
+        if not self._executor.submit(self._process_request, transaction):
+            logger.warning("Executor saturated, rejecting request from %s", transaction.request.source)
+            self._send_service_unavailable(transaction)
+            self._exchange_finished()
+
+    def _process_request(self, transaction):
+        """
+        Process a request dispatched by receive_datagram and remove it from the in-flight exchanges.
+
+        :param transaction: the transaction created to manage the request
+        """
+        try:
+            self.receive_request(transaction)
+        finally:
+            self._exchange_finished()
+
+    def _exchange_started(self):
+        """
+        Count a new in-flight exchange: a request in processing or a CON message waiting for an ACK.
+        """
+        with self._in_flight_condition:
+            self._in_flight += 1
+
+    def _exchange_finished(self):
+        """
+        Remove an exchange from the in-flight ones and wake up drain when none is left.
+        """
+        with self._in_flight_condition:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._in_flight_condition.notify_all()
+
+    def _send_service_unavailable(self, transaction):
+        """
+        Answer a request with 5.03 Service Unavailable, asking the client to retry after a while.
+
+        :param transaction: the transaction of the rejected request
+        """
+        with transaction:
+            transaction.response = Response()
+            transaction.response.destination = transaction.request.source
+            transaction.response.token = transaction.request.token
+            transaction.response.code = defines.Codes.SERVICE_UNAVAILABLE.number
+            transaction.response.max_age = defines.SERVICE_UNAVAILABLE_MAX_AGE
+            self._messageLayer.send_response(transaction)
+            transaction.completed = True
+            self.send_datagram(transaction.response)
+
+    @property
+    def executor(self):
+        """
+        Return the executor of the requests, e.g. to read the metrics of a WorkerPool.
+
+        :return: the executor
+        """
+        return self._executor
+
+    def _send_bad_request(self, destination, code):
+        """
+        Reject a malformed datagram with a RST message.
+
+        :param destination: the source of the malformed datagram
+        :param code: the error code returned by the serializer
+        :rtype : Message
+        :return: the RST message sent
+        """
+        logger.error("receive_datagram - BAD REQUEST")
+
+        rst = Message()
+        rst.destination = destination
+        rst.type = defines.Types["RST"]
+        rst.code = code
+        rst.mid = self._messageLayer.fetch_mid()
+        self.send_datagram(rst)
+        return rst
 
     def close(self):
         """
@@ -198,8 +346,64 @@ class CoAP(object):
         """
         logger.info("Stop server")
         self.stopped.set()
-        for event in self.to_be_stopped:
-            event.set()
+        self._wakeup()
+        self._scheduler.stop()
+        if self._own_executor:
+            self._executor.shutdown()
+
+    def drain(self, timeout=None):
+        """
+        Stop the server gracefully: new requests are rejected with 5.03 Service Unavailable, while the requests in
+        processing are completed and their CON responses retransmitted until acknowledged or given up. The server
+        is closed afterwards. Must not be called by a resource, nor on the event loop of the aio server.
+
+        :param timeout: the maximum time to wait for the in-flight exchanges, None to wait for all of them
+        :rtype : bool
+        :return: True, if all the in-flight exchanges have been completed
+        """
+        logger.info("Drain server")
+        self._draining = True
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._in_flight_condition:
+            while self._in_flight > 0:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                self._in_flight_condition.wait(remaining)
+            drained = self._in_flight == 0
+        self.close()
+        return drained
+
+    @property
+    def draining(self):
+        """
+        Check if the server is rejecting new requests because it is being drained.
+
+        :rtype : bool
+        :return: True, if drain has been called
+        """
+        return self._draining
+
+    def _wakeup(self):
+        """
+        Wake up the receive loop, so that it notices at once that the server has been stopped.
+        """
+        try:
+            self._wakeup_writer.send(b"\0")
+        except socket.error:
+            # the receive loop is over or already woken up
+            pass
+
+    def _close_wakeup(self):
+        """
+        Release the sockets used to wake up the receive loop.
+        """
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
 
     def receive_request(self, transaction):
         """
@@ -233,6 +437,9 @@ class CoAP(object):
 
             self._observeLayer.send_response(transaction)
 
+            if transaction.request.observe == 0:
+                self._observe_registered(transaction)
+
             self._blockLayer.send_response(transaction)
 
             self._stop_separate_timer(transaction.separate_timer)
@@ -253,13 +460,45 @@ class CoAP(object):
         """
         if not self.stopped.isSet():
             host, port = message.destination
-            logger.debug("send_datagram - " + str(message))
+            logger.debug("send_datagram - %s", message)
             serializer = Serializer()
             message = serializer.serialize(message)
             if self.multicast:
-                self._unicast_socket.sendto(message, (host, port))
+                self._datagram_io.send(self._unicast_socket, [(message, (host, port))])
             else:
-                self._socket.sendto(message, (host, port))
+                self._datagram_io.send(self._socket, [(message, (host, port))])
+
+    def send_datagrams(self, messages, datagrams=None):
+        """
+        Send a batch of messages through the udp socket, serializing them into a single buffer.
+
+        :type messages: list
+        :param messages: the messages to send
+        :type datagrams: list
+        :param datagrams: the messages already serialized, None for the ones that still need to be serialized
+        """
+        if not self.stopped.isSet() and len(messages) > 0:
+            serializer = Serializer()
+            if datagrams is None:
+                datagrams = serializer.serialize_many(messages)
+            else:
+                pending = [i for i, datagram in enumerate(datagrams) if datagram is None]
+                if len(pending) > 0:
+                    encoded = serializer.serialize_many([messages[i] for i in pending])
+                    for i, datagram in zip(pending, encoded):
+                        datagrams[i] = datagram
+            if self.multicast:
+                sock = self._unicast_socket
+            else:
+                sock = self._socket
+            batch = []
+            debug = logger.isEnabledFor(logging.DEBUG)
+            for message, datagram in zip(messages, datagrams):
+                if debug:
+                    logger.debug("send_datagram - " + str(message))
+                if datagram is not None:
+                    batch.append((datagram, message.destination))
+            self._datagram_io.send(sock, batch)
 
     def add_resource(self, path, resource):
         """
@@ -312,9 +551,20 @@ class CoAP(object):
             del(self.root[actual_path])
         return res
 
+    def _start_scheduler(self):
+        """
+        Start the scheduler that runs the retransmissions of the server on a single thread.
+
+        :rtype : EventLoop
+        :return: the scheduler
+        """
+        scheduler = EventLoop()
+        scheduler.start(name="CoAP-Scheduler")
+        return scheduler
+
     def _start_retransmission(self, transaction, message):
         """
-        Start the retransmission task.
+        Schedule the retransmission of a message.
 
         :type transaction: Transaction
         :param transaction: the transaction that owns the message that needs retransmission
@@ -324,64 +574,64 @@ class CoAP(object):
         with transaction:
             if message.type == defines.Types['CON']:
                 future_time = random.uniform(defines.ACK_TIMEOUT, (defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR))
-                transaction.retransmit_thread = threading.Thread(target=self._retransmit,
-                                                                 args=(transaction, message, future_time, 0))
-                transaction.retransmit_stop = threading.Event()
-                self.to_be_stopped.append(transaction.retransmit_stop)
-                transaction.retransmit_thread.start()
+                self._exchange_started()
+                transaction.retransmit_stop = self._scheduler.call_later(future_time, self._retransmit, transaction,
+                                                                         message, future_time, 0)
 
     def _retransmit(self, transaction, message, future_time, retransmit_count):
         """
-        Thread function to retransmit the message in the future
+        Retransmit a message, if still needed, and schedule the next attempt.
+        Runs on the scheduler, so it must not wait for the lock of the transaction, which is held while the
+        resource renders the response.
 
         :param transaction: the transaction that owns the message that needs retransmission
         :param message: the message that needs the retransmission task
-        :param future_time: the amount of time to wait before a new attempt
+        :param future_time: the amount of time waited before this attempt
         :param retransmit_count: the number of retransmissions
         """
-        with transaction:
-            while retransmit_count < defines.MAX_RETRANSMIT and (not message.acknowledged and not message.rejected) \
-                    and not self.stopped.isSet():
-                if transaction.retransmit_stop is not None:
-                    transaction.retransmit_stop.wait(timeout=future_time)
-                if not message.acknowledged and not message.rejected and not self.stopped.isSet():
-                    retransmit_count += 1
-                    future_time *= 2
-                    self.send_datagram(message)
-
-            if message.acknowledged or message.rejected:
-                message.timeouted = False
-            else:
-                logger.warning("Give up on message {message}".format(message=message.line_print))
-                message.timeouted = True
-                if message.observe is not None:
-                    self._observeLayer.remove_subscriber(message)
+        # the mid is removed when a newer notification replaces the message
+        if retransmit_count < defines.MAX_RETRANSMIT and (not message.acknowledged and not message.rejected) \
+                and message.mid is not None and not self.stopped.isSet():
+            retransmit_count += 1
+            future_time *= 2
+            self.send_datagram(message)
+            if retransmit_count < defines.MAX_RETRANSMIT:
+                transaction.retransmit_stop = self._scheduler.call_later(future_time, self._retransmit, transaction,
+                                                                         message, future_time, retransmit_count)
+                return
 
-            try:
-                self.to_be_stopped.remove(transaction.retransmit_stop)
-            except ValueError:
-                pass
-            transaction.retransmit_stop = None
-            transaction.retransmit_thread = None
+        if message.acknowledged or message.rejected or message.mid is None:
+            message.timeouted = False
+        else:
+            logger.warning("Give up on message {message}".format(message=message.line_print))
+            message.timeouted = True
+            if message.observe is not None:
+                self._observeLayer.remove_subscriber(message)
+
+        transaction.retransmit_stop = None
+        if self._notifier is not None and message.observe is not None and message.mid is not None:
+            # the newer states of the resource were waiting for this notification
+            key, relation = self._observeLayer.relation(transaction.request)
+            self._notifier.delivered(transaction.resource, key, relation)
+        self._exchange_finished()
 
     def _start_separate_timer(self, transaction):
         """
-        Start a thread to handle separate mode.
+        Schedule the ACK for a request that is taking too long to be processed.
 
         :type transaction: Transaction
         :param transaction: the transaction that is in processing
-        :rtype : the Timer object
+        :rtype : TimerHandle
+        :return: the handle of the timer
         """
-        t = threading.Timer(defines.ACK_TIMEOUT, self._send_ack, (transaction,))
-        t.start()
-        return t
+        return self._scheduler.call_later(defines.ACK_TIMEOUT, self._send_ack, transaction)
 
     @staticmethod
     def _stop_separate_timer(timer):
         """
-        Stop the separate Thread if an answer has been already provided to the client.
+        Cancel the separate timer if an answer has been already provided to the client.
 
-        :param timer: The Timer object
+        :param timer: The TimerHandle object
         """
         timer.cancel()
 
@@ -399,23 +649,259 @@ class CoAP(object):
             ack = self._messageLayer.send_empty(transaction, transaction.request, ack)
             self.send_datagram(ack)
 
+    def _observe_registered(self, transaction):
+        """
+        Start the timers of a new observe relation. A relation with pmin or pmax attributes needs a notification
+        scheduler: if the server has none, one that only paces such relations is started, so that the observers
+        without attributes are still notified at once.
+
+        :param transaction: the transaction of the observe request
+        """
+        key, relation = self._observeLayer.relation(transaction.request)
+        if relation is None:
+            return
+        if self._notifier is None and (relation.pmin is not None or relation.pmax is not None):
+            with self._notifier_lock:
+                if self._notifier is None:
+                    notifier = NotificationScheduler(pmin=0, attributes_only=True)
+                    notifier.start(self)
+                    self._notifier = notifier
+        if self._notifier is not None:
+            self._notifier.registered(transaction.resource, relation)
+
+    def restore_relations(self):
+        """
+        Restore the observe relations stored in the relation log by a previous run of the server, so that their
+        observers keep being notified without registering again. The resources get the Observe sequence number that
+        follows the last one notified, so that the clients do not discard the new notifications as old ones.
+        Must be called after the resources have been added and before the server starts listening. The relations of
+        the resources that no longer exist are dropped.
+
+        :rtype : int
+        :return: the number of relations restored
+        """
+        log = self._observeLayer.log
+        if log is None:
+            return 0
+        restored = 0
+        for key, record in log.relations():
+            try:
+                resource = self.root[record.path]
+            except KeyError:
+                resource = None
+            if resource is None or not resource.observable:
+                logger.info("Dropping the observe relation of the missing resource " + record.path)
+                log.removed(key)
+                continue
+            request = Request()
+            request.source = (record.host, record.port)
+            request.type = record.type
+            request.code = defines.Codes.GET.number
+            request.token = record.token
+            request.observe = 0
+            request.uri_path = record.path
+            if record.query:
+                request.uri_query = record.query
+            if record.accept is not None:
+                request.accept = record.accept
+            response = Response()
+            response.destination = request.source
+            response.token = request.token
+            response.type = record.type
+            response.code = defines.Codes.CONTENT.number
+            transaction = Transaction(request=request, response=response, resource=resource, timestamp=time.time())
+            if self._observeLayer.restore(transaction, record.value) is not None:
+                restored += 1
+                self._observe_registered(transaction)
+        for path, number in log.sequences().iteritems():
+            try:
+                resource = self.root[path]
+            except KeyError:
+                continue
+            if resource is not None:
+                resource.observe_count = number + 1
+        return restored
+
     def notify(self, resource):
         """
-        Notifies the observers of a certain resource.
+        Notifies the observers of a certain resource, at once or through the notification scheduler.
+
+        :param resource: the resource
+        """
+        if self._notifier is not None:
+            self._notifier.changed(resource)
+        else:
+            self._notify(resource)
+
+    def _notify(self, resource, keys=None):
+        """
+        Send a notification to the observers of a resource.
+        The representation is rendered and encoded once for every group of observers that asked for the same
+        content format, query and ETags: the other observers of the group get the same options and payload and
+        only their header, token and Observe option are encoded.
+        The notifications are sent in batches of NOTIFICATION_BATCH while the next ones are prepared. An observer
+        whose transaction is locked, for example by one of its requests in processing, is notified apart on the
+        executor, so that it does not hold up the others. The fan-out never waits for the lock of a transaction, since
+        it also runs on the scheduler, which must not be held up by an observer.
 
         :param resource: the resource
+        :param keys: the keys of the observe relations to notify, None for all the observers
         """
-        observers = self._observeLayer.notify(resource)
+        observers = self._observeLayer.notify(resource, keys=keys)
         logger.debug("Notify")
+        notifications = []
+        datagrams = []
+        templates = {}
+        busy = []
         for transaction in observers:
-            with transaction:
-                transaction.response = None
-                transaction = self._requestLayer.receive_request(transaction)
-                transaction = self._observeLayer.send_response(transaction)
-                transaction = self._blockLayer.send_response(transaction)
-                transaction = self._messageLayer.send_response(transaction)
-                if transaction.response is not None:
-                    if transaction.response.type == defines.Types["CON"]:
-                        self._start_retransmission(transaction, transaction.response)
-
-                    self.send_datagram(transaction.response)
+            if not transaction.acquire(False):
+                busy.append(transaction)
+                continue
+            try:
+                self._prepare_notification(transaction, templates, notifications, datagrams)
+            finally:
+                transaction.release()
+            if len(notifications) >= defines.NOTIFICATION_BATCH:
+                self.send_datagrams(notifications, datagrams)
+                notifications = []
+                datagrams = []
+        self.send_datagrams(notifications, datagrams)
+        for transaction in busy:
+            self._defer_notification(transaction)
+
+    def _defer_notification(self, transaction):
+        """
+        Notify a busy observer on the executor. If the executor is full, try again later on the scheduler.
+
+        :param transaction: the transaction of the observer
+        """
+        if self.stopped.isSet():
+            return
+        if not self._executor.submit(self._notify_busy, transaction):
+            self._scheduler.call_later(defines.NOTIFICATION_RETRY, self._retry_notification, transaction)
+
+    def _retry_notification(self, transaction):
+        """
+        Notify an observer that could not be notified on the executor, if its transaction is free by now, or defer it
+        again.
+
+        :param transaction: the transaction of the observer
+        """
+        if not transaction.acquire(False):
+            self._defer_notification(transaction)
+            return
+        notifications = []
+        datagrams = []
+        try:
+            self._prepare_notification(transaction, {}, notifications, datagrams)
+        finally:
+            transaction.release()
+        self.send_datagrams(notifications, datagrams)
+
+    def _notify_busy(self, transaction):
+        """
+        Notify an observer whose transaction was locked during the fan-out, once the lock is free.
+        The representation is rendered again instead of reusing the one of the fan-out: the resource may have changed
+        in the meantime, and the Observe number is the one of the current state.
+
+        :param transaction: the transaction of the observer
+        """
+        notifications = []
+        datagrams = []
+        with transaction:
+            self._prepare_notification(transaction, {}, notifications, datagrams)
+        self.send_datagrams(notifications, datagrams)
+
+    def _prepare_notification(self, transaction, templates, notifications, datagrams):
+        """
+        Build the notification of an observer, from the template of its group if there is one. Must be called with the
+        transaction locked.
+
+        :param transaction: the transaction of the observer
+        :param templates: the notifications already built, by request key
+        :param notifications: the list the notification is appended to
+        :param datagrams: the list the encoded notification is appended to, None if it still needs to be serialized
+        """
+        request = transaction.request
+        etags = tuple(str(etag) for etag in request.etag)
+        key = (request.uri_path, request.accept, request.uri_query, etags)
+        template = templates.get(key)
+        if template is None:
+            transaction.response = None
+            transaction = self._requestLayer.receive_request(transaction)
+        else:
+            transaction.resource = template.resource
+            transaction.response = template.splice(transaction.request)
+        transaction = self._observeLayer.send_response(transaction)
+        transaction = self._blockLayer.send_response(transaction)
+        transaction = self._messageLayer.send_response(transaction)
+        if transaction.response is not None:
+            if transaction.response.type == defines.Types["CON"]:
+                self._start_retransmission(transaction, transaction.response)
+
+            datagram = None
+            if template is None:
+                if NotificationTemplate.cacheable(transaction.response):
+                    templates[key] = NotificationTemplate(transaction.resource, transaction.response)
+            elif NotificationTemplate.cacheable(transaction.response):
+                datagram = template.serialize(transaction.response)
+            notifications.append(transaction.response)
+            datagrams.append(datagram)
+
+
+class NotificationTemplate(object):
+    def __init__(self, resource, response):
+        """
+        Data structure for a notification shared by several observers.
+
+        :param resource: the resource that rendered the notification
+        :type response: Response
+        :param response: the first notification sent
+        """
+        self.resource = resource
+        self.code = response.code
+        self.options = [option for option in response.options
+                        if option.number != defines.OptionRegistry.OBSERVE.number]
+        self.payload = response.payload
+        self.encoded = Serializer.encode_template(response)
+
+    @staticmethod
+    def cacheable(response):
+        """
+        Check if a notification can be shared with other observers.
+
+        :type response: Response
+        :param response: the notification
+        :return: True, if the notification is a single block 2.05 response with the Observe option
+        """
+        return response.code == defines.Codes.CONTENT.number and response.observe is not None \
+            and response.block2 is None
+
+    def splice(self, request):
+        """
+        Create the notification for another observer.
+
+        :type request: Request
+        :param request: the observe request of the observer
+        :rtype : Response
+        :return: the notification without type, MID and Observe option
+        """
+        response = Response()
+        response.destination = request.source
+        response.token = request.token
+        response.code = self.code
+        for option in self.options:
+            response.add_option(option)
+        response.payload = self.payload
+        return response
+
+    def serialize(self, response):
+        """
+        Serialize a notification created by splice.
+
+        :type response: Response
+        :param response: the notification
+        :rtype: str
+        :return: the notification serialized
+        """
+        return Serializer.serialize_notification(response, self.encoded)
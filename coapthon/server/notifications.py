@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+
+from coapthon import defines
+from coapthon.layers.observelayer import resource_value
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+# tolerance on the deadlines of the timers
+SLACK = 0.001
+
+
+class NotificationScheduler(object):
+    """
+    Coalesces the notifications of a server, as the pmin and pmax conditional attributes of CoRE: an observer gets at
+    most one notification every pmin seconds and, if pmax is set, at least one every pmax seconds.
+    The changes of a resource within pmin from the last notification of an observer are merged: when the interval is
+    over, the observer gets a single notification with the state of the resource at that time, so that the
+    intermediate states are dropped. The observers that are due at the same time share the rendering.
+    A CON observer is not notified again until its last notification has been acknowledged, or given up: the newer
+    states wait, so that at most one CON notification per observer is in flight and the latest state is always
+    delivered reliably.
+    The pmin and pmax attributes of an observe request override the ones of the scheduler for that observer, and
+    its gt, lt and st attributes filter the changes: a change that does not cross a threshold, or is smaller than the
+    step, is not notified.
+    A scheduler created with attributes_only only paces the observers that asked for pmin or pmax: the others are
+    notified at once, as without a scheduler.
+    Deletions are notified at once. The timers run on the scheduler of the server.
+    """
+    def __init__(self, pmin=None, pmax=None, attributes_only=False):
+        """
+        Initialize the scheduler.
+
+        :param pmin: the minimum interval between two notifications to an observer, in seconds
+        :param pmax: the maximum interval between two notifications to an observer, None for no limit
+        :param attributes_only: if True, only the observers with the pmin or pmax attribute are paced
+        """
+        if pmin is None:
+            pmin = defines.NOTIFICATION_PMIN
+        assert pmin >= 0 and (pmax is None or pmax > pmin)
+        self.pmin = pmin
+        self.pmax = pmax
+        self.attributes_only = attributes_only
+        self._server = None
+        self._lock = threading.RLock()
+        # path -> latest version of the resource
+        self._resources = {}
+        # path -> keys of the relations with a notification to send
+        self._pending = {}
+        # path -> (deadline, handle) of the timer of the resource
+        self._timers = {}
+
+    def start(self, server):
+        """
+        Attach the scheduler to a server.
+
+        :param server: the server
+        """
+        self._server = server
+
+    def pending(self, path):
+        """
+        Return the number of observers of a resource waiting for a notification.
+
+        :param path: the path of the resource
+        :rtype : int
+        :return: the number of observers
+        """
+        with self._lock:
+            return len(self._pending.get(path, ()))
+
+    def _pmin(self, relation):
+        """
+        Return the minimum interval between two notifications to an observer.
+
+        :param relation: the relation of the observer
+        :return: the interval, in seconds
+        """
+        return relation.pmin if relation.pmin is not None else self.pmin
+
+    def _pmax(self, relation):
+        """
+        Return the maximum interval between two notifications to an observer.
+
+        :param relation: the relation of the observer
+        :return: the interval, in seconds, None for no limit
+        """
+        return relation.pmax if relation.pmax is not None else self.pmax
+
+    def _paced(self, relation):
+        """
+        Check if the notifications to an observer go through the scheduler.
+
+        :param relation: the relation of the observer
+        :rtype : bool
+        :return: False, if the observer is notified at once
+        """
+        return not self.attributes_only or relation.pmin is not None or relation.pmax is not None
+
+    @staticmethod
+    def _in_flight(relation):
+        """
+        Check if the last notification of a relation is a CON message waiting for its ACK.
+
+        :param relation: the relation
+        :rtype : bool
+        :return: True, if the notification has not been acknowledged yet
+        """
+        response = relation.transaction.response
+        return response is not None and response.type == defines.Types["CON"] and response.mid is not None and \
+            not response.acknowledged and not response.rejected and not response.timeouted
+
+    def changed(self, resource):
+        """
+        Notify the observers of a resource that changed, at once if their last notification is older than pmin,
+        later otherwise.
+
+        :param resource: the resource
+        """
+        if resource.deleted:
+            self._server._notify(resource)
+            return
+        now = time.time()
+        value = resource_value(resource)
+        due = []
+        with self._lock:
+            pending = self._pending.setdefault(resource.path, set())
+            for key, relation in self._server._observeLayer.relations(resource.path):
+                if key in pending or not relation.condition(value):
+                    continue
+                if not self._paced(relation):
+                    due.append(key)
+                elif now - relation.timestamp >= self._pmin(relation) - SLACK and not self._in_flight(relation):
+                    due.append(key)
+                else:
+                    pending.add(key)
+            self._resources[resource.path] = resource
+        if len(due) > 0:
+            self._server._notify(resource, due)
+        self._schedule(resource.path)
+
+    def registered(self, resource, relation):
+        """
+        Start the pmax timer of a new observer.
+
+        :param resource: the observed resource
+        :param relation: the relation of the observer
+        """
+        if resource is None or relation is None or self._pmax(relation) is None:
+            return
+        with self._lock:
+            self._resources[resource.path] = resource
+        self._schedule(resource.path, relation.timestamp + self._pmax(relation))
+
+    def delivered(self, resource, key, relation):
+        """
+        Resume an observer that waited for the ACK of a CON notification.
+
+        :param resource: the resource
+        :param key: the key of the relation of the observer
+        :param relation: the relation of the observer
+        """
+        if resource is None or relation is None or resource.path not in self._resources:
+            return
+        with self._lock:
+            waiting = key in self._pending.get(resource.path, ())
+        if waiting:
+            self._schedule(resource.path, max(relation.timestamp + self._pmin(relation), time.time()))
+        elif self._pmax(relation) is not None:
+            self._schedule(resource.path, relation.timestamp + self._pmax(relation))
+
+    def _schedule(self, path, deadline=None):
+        """
+        Set the timer of a resource to the first time an observer is due, or forget the resource if none will be.
+
+        :param path: the path of the resource
+        :param deadline: the time an observer is due, if only that observer changed. The other observers are not
+        visited if the timer is already set before it
+        """
+        now = time.time()
+        with self._lock:
+            timer = self._timers.get(path)
+            if deadline is not None and timer is not None and timer[0] <= deadline + SLACK:
+                return
+            pending = self._pending.get(path, set())
+            deadline = None
+            keys = set()
+            for key, relation in self._server._observeLayer.relations(path):
+                keys.add(key)
+                if not self._paced(relation) or self._in_flight(relation):
+                    # resumed by delivered
+                    continue
+                pmax = self._pmax(relation)
+                if key in pending:
+                    when = relation.timestamp + self._pmin(relation)
+                elif pmax is not None:
+                    when = relation.timestamp + pmax
+                else:
+                    continue
+                if deadline is None or when < deadline:
+                    deadline = when
+            pending &= keys
+            if len(pending) == 0:
+                self._pending.pop(path, None)
+            timer = self._timers.get(path)
+            if deadline is None:
+                if timer is None:
+                    self._resources.pop(path, None)
+                return
+            if timer is not None:
+                if timer[0] <= deadline + SLACK:
+                    return
+                timer[1].cancel()
+            handle = self._server._scheduler.call_later(max(deadline - now, 0), self._fire, path)
+            self._timers[path] = (deadline, handle)
+
+    def _fire(self, path):
+        """
+        Notify the observers of a resource that are due.
+
+        :param path: the path of the resource
+        """
+        now = time.time()
+        due = []
+        with self._lock:
+            self._timers.pop(path, None)
+            resource = self._resources.get(path)
+            value = resource_value(resource) if resource is not None else None
+            pending = self._pending.get(path, set())
+            for key, relation in self._server._observeLayer.relations(path):
+                if not self._paced(relation) or self._in_flight(relation):
+                    continue
+                pmax = self._pmax(relation)
+                if pmax is not None and now - relation.timestamp >= pmax - SLACK:
+                    pending.discard(key)
+                    due.append(key)
+                elif key in pending and now - relation.timestamp >= self._pmin(relation) - SLACK:
+                    # the value may have gone back within the thresholds while waiting
+                    pending.discard(key)
+                    if relation.condition(value):
+                        due.append(key)
+        if resource is not None and len(due) > 0:
+            try:
+                self._server._notify(resource, due)
+            except Exception:
+                logger.exception("Exception while notifying " + str(path))
+        self._schedule(path)
@@ -0,0 +1,344 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+
+from coapthon.utils import token_key
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+MAGIC = "COAPOBS1"
+
+# kind, length and CRC32 of the body of a record
+HEADER = struct.Struct("!BHI")
+
+# kinds of record
+RELATION = 1
+REMOVED = 2
+VALUE = 3
+SEQUENCE = 4
+
+NAN = float("nan")
+
+# records appended before the log is compacted, at least
+COMPACT_THRESHOLD = 4096
+
+
+def _pack_string(value):
+    value = str(value)
+    return struct.pack("!H", len(value)) + value
+
+
+def _unpack_string(data, offset):
+    length = struct.unpack_from("!H", data, offset)[0]
+    offset += 2
+    return data[offset:offset + length], offset + length
+
+
+def _pack_float(value):
+    return struct.pack("!d", NAN if value is None else value)
+
+
+def _unpack_float(data, offset):
+    value = struct.unpack_from("!d", data, offset)[0]
+    if value != value:
+        value = None
+    return value, offset + 8
+
+
+class RelationRecord(object):
+    """
+    Stored state of an observe relation: what is needed to notify the observer again without a new registration.
+    """
+    __slots__ = ("host", "port", "token", "type", "accept", "path", "query", "value")
+
+    def __init__(self, host, port, token, type, accept, path, query, value):
+        """
+        Data structure for a stored relation.
+
+        :param host: the host of the observer
+        :param port: the port of the observer
+        :param token: the token of the observe request
+        :param type: the type of the observe request, CON or NON
+        :param accept: the Accept option of the observe request, None if missing
+        :param path: the path of the observed resource
+        :param query: the Uri-Query of the observe request, with the conditional attributes
+        :param value: the value of the resource in the last notification, for the gt, lt and st attributes
+        """
+        self.host = host
+        self.port = port
+        self.token = token
+        self.type = type
+        self.accept = accept
+        self.path = path
+        self.query = query
+        self.value = value
+
+    @property
+    def key(self):
+        """
+        Return what identifies the relation in the log.
+
+        :rtype : tuple
+        :return: the key of the relation in the ObserveLayer
+        """
+        return token_key(self.host, self.port, self.token)
+
+    def pack(self):
+        """
+        Encode the relation as the body of a record.
+
+        :rtype : str
+        :return: the body
+        """
+        accept = -1 if self.accept is None else self.accept
+        return _pack_string(self.host) + struct.pack("!H", self.port) + _pack_string(self.token) + \
+            struct.pack("!Bh", self.type, accept) + _pack_string(self.path) + _pack_string(self.query) + \
+            _pack_float(self.value)
+
+    @staticmethod
+    def unpack(data):
+        """
+        Decode the body of a relation record.
+
+        :param data: the body
+        :rtype : RelationRecord
+        :return: the relation
+        """
+        host, offset = _unpack_string(data, 0)
+        port = struct.unpack_from("!H", data, offset)[0]
+        token, offset = _unpack_string(data, offset + 2)
+        type, accept = struct.unpack_from("!Bh", data, offset)
+        path, offset = _unpack_string(data, offset + 3)
+        query, offset = _unpack_string(data, offset)
+        value, offset = _unpack_float(data, offset)
+        return RelationRecord(host, port, token, type, None if accept < 0 else accept, path, query, value)
+
+
+def _pack_key(key):
+    address, port, token = key
+    return _pack_string(address) + struct.pack("!H", port) + _pack_string(token)
+
+
+def _unpack_key(data):
+    address, offset = _unpack_string(data, 0)
+    port = struct.unpack_from("!H", data, offset)[0]
+    token, offset = _unpack_string(data, offset + 2)
+    return (address, port, token), offset
+
+
+class RelationLog(object):
+    """
+    Append-only log of the observe relations of a server, so that a restarted server notifies its observers again
+    without waiting for them to register.
+    Every new relation, removal, change of the value of a conditional relation and new Observe sequence number of
+    a resource is appended as a small binary record, flushed at once: a crash loses nothing the process wrote,
+    a torn last record is discarded when the log is opened. The log is rewritten with only the live relations when it
+    is opened and when the records appended exceed twice the relations, so that its size stays bounded.
+    The log must be used by one server at a time.
+    """
+    def __init__(self, filename):
+        """
+        Open a log, reading the relations it holds, or create it.
+
+        :param filename: the path of the file
+        :raise ValueError: if the file exists and is not an observe relation log
+        """
+        self._filename = filename
+        self._lock = threading.Lock()
+        # key of the relation -> RelationRecord of the live relations
+        self._relations = {}
+        # path -> last Observe sequence number of the resource
+        self._sequences = {}
+        self._appended = 0
+        self._file = None
+        if os.path.isfile(filename):
+            self._read()
+        self.compact()
+
+    def __len__(self):
+        return len(self._relations)
+
+    def _read(self):
+        """
+        Replay the records of the file. Reading stops at the first incomplete or corrupted record.
+
+        :raise ValueError: if the file is neither empty nor an observe relation log
+        """
+        with open(self._filename, "rb") as f:
+            data = f.read()
+        if not data:
+            return
+        if data[:len(MAGIC)] != MAGIC:
+            # compacting would replace the file with an empty log
+            raise ValueError("Not an observe relation log: " + self._filename)
+        offset = len(MAGIC)
+        while offset + HEADER.size <= len(data):
+            kind, length, crc = HEADER.unpack_from(data, offset)
+            body = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) & 0xffffffff != crc:
+                break
+            try:
+                self._replay(kind, body)
+            except struct.error:
+                break
+            offset += HEADER.size + length
+        if offset < len(data):
+            logger.warning("Discarding %d bytes at the end of the observe relation log %s", len(data) - offset,
+                           self._filename)
+
+    def _replay(self, kind, body):
+        """
+        Apply a record to the state of the log.
+
+        :param kind: the kind of the record
+        :param body: the body of the record
+        """
+        if kind == RELATION:
+            record = RelationRecord.unpack(body)
+            self._relations[record.key] = record
+        elif kind == REMOVED:
+            key, offset = _unpack_key(body)
+            self._relations.pop(key, None)
+        elif kind == VALUE:
+            key, offset = _unpack_key(body)
+            record = self._relations.get(key)
+            if record is not None:
+                record.value = _unpack_float(body, offset)[0]
+        elif kind == SEQUENCE:
+            path, offset = _unpack_string(body, 0)
+            self._sequences[path] = struct.unpack_from("!I", body, offset)[0]
+
+    def _append(self, kind, body):
+        """
+        Append a record to the file. Must be called with the lock held.
+
+        :param kind: the kind of the record
+        :param body: the body of the record
+        """
+        if self._file is None:
+            return
+        self._file.write(HEADER.pack(kind, len(body), zlib.crc32(body) & 0xffffffff) + body)
+        self._file.flush()
+        self._appended += 1
+        if self._appended > max(COMPACT_THRESHOLD, 2 * (len(self._relations) + len(self._sequences))):
+            self._compact()
+
+    def relations(self):
+        """
+        Return the stored relations.
+
+        :rtype : list
+        :return: the keys and the relations, as (key, RelationRecord) pairs
+        """
+        with self._lock:
+            return self._relations.items()
+
+    def sequences(self):
+        """
+        Return the last Observe sequence number of every resource with stored relations.
+
+        :rtype : dict
+        :return: the sequence numbers, by path
+        """
+        with self._lock:
+            return dict(self._sequences)
+
+    def added(self, key, request, path, value):
+        """
+        Store a new relation.
+
+        :param key: the key of the relation
+        :param request: the observe request
+        :param path: the path of the observed resource
+        :param value: the value of the resource in the first notification
+        """
+        host, port = request.source
+        record = RelationRecord(host, port, str(request.token or ""), request.type, request.accept, path,
+                                request.uri_query, value)
+        with self._lock:
+            self._relations[key] = record
+            self._append(RELATION, record.pack())
+
+    def removed(self, key):
+        """
+        Forget a relation.
+
+        :param key: the key of the relation
+        """
+        with self._lock:
+            if self._relations.pop(key, None) is not None:
+                self._append(REMOVED, _pack_key(key))
+
+    def updated(self, key, value):
+        """
+        Store the value of the resource last notified to a conditional relation.
+
+        :param key: the key of the relation
+        :param value: the value
+        """
+        with self._lock:
+            record = self._relations.get(key)
+            if record is None or record.value == value:
+                return
+            record.value = value
+            self._append(VALUE, _pack_key(key) + _pack_float(value))
+
+    def sequence(self, path, number):
+        """
+        Store the Observe sequence number of the last notification of a resource.
+
+        :param path: the path of the resource
+        :param number: the sequence number
+        """
+        with self._lock:
+            if self._sequences.get(path) == number:
+                return
+            self._sequences[path] = number
+            self._append(SEQUENCE, _pack_string(path) + struct.pack("!I", number))
+
+    def compact(self):
+        """
+        Rewrite the log with only the live relations.
+        """
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        """
+        Write the live relations to a new file, which atomically replaces the log. Must be called with the lock
+        held.
+        """
+        paths = set(record.path for record in self._relations.itervalues())
+        for path in self._sequences.keys():
+            if path not in paths:
+                del self._sequences[path]
+        records = [MAGIC]
+        for record in self._relations.itervalues():
+            body = record.pack()
+            records.append(HEADER.pack(RELATION, len(body), zlib.crc32(body) & 0xffffffff) + body)
+        for path, number in self._sequences.iteritems():
+            body = _pack_string(path) + struct.pack("!I", number)
+            records.append(HEADER.pack(SEQUENCE, len(body), zlib.crc32(body) & 0xffffffff) + body)
+        temporary = self._filename + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write("".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.rename(temporary, self._filename)
+        self._file = open(self._filename, "ab")
+        self._appended = 0
+
+    def close(self):
+        """
+        Close the file. The relations that change afterwards are not stored.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
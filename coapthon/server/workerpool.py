@@ -0,0 +1,150 @@
+import logging
+import Queue
+import threading
+import time
+
+from coapthon import defines
+
+__author__ = 'Giacomo Tanganelli'
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads with a bounded admission queue.
+    Any object with the same submit method can be used as executor by the server.
+    """
+    def __init__(self, workers=None, queue_size=None):
+        """
+        Initialize the pool. Workers are started on demand, up to the given number.
+
+        :param workers: the maximum number of worker threads
+        :param queue_size: the maximum number of tasks waiting for a worker
+        """
+        if workers is None:
+            workers = defines.WORKER_POOL_SIZE
+        if queue_size is None:
+            queue_size = defines.WORKER_QUEUE_SIZE
+        assert workers > 0 and queue_size > 0
+        self._workers = workers
+        self._queue = Queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.handler_time = 0.0
+        self.max_handler_time = 0.0
+
+    def submit(self, function, *args):
+        """
+        Queue a task for execution.
+
+        :param function: the function to execute
+        :param args: the arguments of the function
+        :rtype : bool
+        :return: True, if the task has been accepted, False if the queue is full
+        """
+        if self._shutdown:
+            return False
+        try:
+            self._queue.put_nowait((function, args, time.time()))
+        except Queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+            if len(self._threads) < self._workers:
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+        return True
+
+    def _work(self):
+        """
+        Worker thread: execute the tasks until the pool is shut down.
+        """
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._stop_next_worker()
+                return
+            function, args, queued = task
+            start = time.time()
+            failed = False
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Exception in worker")
+                failed = True
+            end = time.time()
+            with self._lock:
+                self.completed += 1
+                if failed:
+                    self.failed += 1
+                self.wait_time += start - queued
+                self.handler_time += end - start
+                self.max_handler_time = max(self.max_handler_time, end - start)
+            if self._shutdown and self._queue.empty():
+                self._stop_next_worker()
+                return
+
+    def _stop_next_worker(self):
+        """
+        Pass the shutdown request on to the next idle worker.
+        """
+        try:
+            self._queue.put_nowait(None)
+        except Queue.Full:
+            pass
+
+    @property
+    def queue_depth(self):
+        """
+        Return the number of tasks waiting for a worker.
+
+        :return: the queue depth
+        """
+        return self._queue.qsize()
+
+    @property
+    def metrics(self):
+        """
+        Return the counters of the pool.
+
+        :rtype : dict
+        :return: queue depth, task counters and handler latency in seconds
+        """
+        with self._lock:
+            completed = max(self.completed, 1)
+            return {"workers": len(self._threads),
+                    "queue_depth": self._queue.qsize(),
+                    "submitted": self.submitted,
+                    "rejected": self.rejected,
+                    "completed": self.completed,
+                    "failed": self.failed,
+                    "average_wait": self.wait_time / completed,
+                    "average_handler": self.handler_time / completed,
+                    "max_handler": self.max_handler_time}
+
+    def shutdown(self, wait=False):
+        """
+        Stop the workers once the queued tasks have been executed.
+
+        :param wait: if True, wait for the workers to exit
+        """
+        self._shutdown = True
+        with self._lock:
+            threads = list(self._threads)
+        # if the queue is full, the busy workers exit as soon as it is drained
+        self._stop_next_worker()
+        if wait:
+            for thread in threads:
+                thread.join()
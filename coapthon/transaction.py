@@ -7,6 +7,9 @@ class Transaction(object):
     """
     Transaction object to bind together a request, a response and a resource.
     """
+    __slots__ = ("_response", "_request", "_resource", "_timestamp", "_completed", "_block_transfer", "notification",
+                 "separate_timer", "retransmit_thread", "retransmit_stop", "_lock", "cacheHit", "cached_element")
+
     def __init__(self, request=None, response=None, resource=None, timestamp=None):
         """
         Initialize a Transaction object.
@@ -37,6 +40,22 @@ class Transaction(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._lock.release()
 
+    def acquire(self, blocking=True):
+        """
+        Lock the transaction.
+
+        :param blocking: if False, do not wait for the lock
+        :rtype : bool
+        :return: True, if the lock has been acquired
+        """
+        return self._lock.acquire(blocking)
+
+    def release(self):
+        """
+        Unlock the transaction.
+        """
+        self._lock.release()
+
     @property
     def response(self):
         """
@@ -1,5 +1,7 @@
 import random
+import socket
 import string
+from coapthon import defines
 
 __author__ = 'Giacomo Tanganelli'
 
@@ -91,16 +93,68 @@ def byte_len(int_type):
     :param int_type: the int to be converted
     :return: the number of bits needed to encode the int passed.
     """
-    length = 0
-    while int_type:
-        int_type >>= 1
-        length += 1
-    if length > 0:
-        if length % 8 != 0:
-            length = int(length / 8) + 1
+    if not int_type:
+        return 0
+    return (int_type.bit_length() + 7) // 8
+
+
+_addresses = {}
+
+
+def address_key(host):
+    """
+    Return the canonical form of a host used in the lookup keys: the packed address for IPv4 and IPv6 literals,
+    the lower case name otherwise. Results are cached, since a server sees the same peers over and over.
+
+    :param host: the host
+    :rtype: str
+    :return: the canonical form of the host
+    """
+    try:
+        return _addresses[host]
+    except KeyError:
+        pass
+    try:
+        if ":" in host:
+            key = socket.inet_pton(socket.AF_INET6, host)
         else:
-            length = int(length / 8)
-    return length
+            key = socket.inet_pton(socket.AF_INET, host)
+    except (socket.error, TypeError, ValueError):
+        key = str(host).lower()
+    if len(_addresses) >= defines.ADDRESS_CACHE_SIZE:
+        _addresses.clear()
+    _addresses[host] = key
+    return key
+
+
+def mid_key(host, port, mid):
+    """
+    Return the key used to match messages by Message ID.
+
+    :param host: the host of the peer
+    :param port: the port of the peer
+    :param mid: the Message ID
+    :rtype: tuple
+    :return: the key
+    """
+    return address_key(host), port, mid
+
+
+def token_key(host, port, token):
+    """
+    Return the key used to match messages by Token. A missing token and an empty token give the same key.
+
+    :param host: the host of the peer
+    :param port: the port of the peer
+    :param token: the Token
+    :rtype: tuple
+    :return: the key
+    """
+    if token:
+        token = str(token)
+    else:
+        token = ""
+    return address_key(host), port, token
 
 
 def parse_uri(uri):
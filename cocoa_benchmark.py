@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+import collections
+import getopt
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+from coapthon.client.cocoa import CoCoA
+from coapthon.client.helperclient import HelperClient
+from coapthon.eventloop import EventLoop
+from coapthon.server.coap import CoAP
+from plugtest_resources import TestResource
+from server_benchmark import percentile
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tcocoa_benchmark.py [-n] [-l] [-d] [-p]"
+    print "Options:"
+    print "\t-n, --number=\t\tNumber of requests per destination (default 20)"
+    print "\t-l, --loss=\t\tProbability of losing a datagram, in each direction (default 0.1)"
+    print "\t-d, --delay=\t\tOne way delay of the slow destination, in seconds (default 1.0)"
+    print "\t-p, --port=\t\tServer port, the relays use the next ones (default 5690)"
+
+
+class LossyRelay(object):
+    """
+    Local UDP relay between one client and a server, which delays and drops datagrams to emulate a link.
+    It records the MID of every datagram, to count the spurious retransmissions afterwards.
+    """
+    def __init__(self, loop, port, server, delay, jitter, loss):
+        """
+        Start relaying.
+
+        :param loop: the event loop that runs the relay
+        :param port: the port on which the client reaches the relay
+        :param server: the address of the server
+        :param delay: the mean one way delay
+        :param jitter: the relative variation of the delay
+        :param loss: the probability of dropping a datagram
+        """
+        self.address = ("127.0.0.1", port)
+        self._loop = loop
+        self._server = server
+        self._delay = delay
+        self._jitter = jitter
+        self._loss = loss
+        self._client = None
+        # MID -> drop flags of the copies of the request and of the replies, in order of arrival
+        self.requests = collections.defaultdict(list)
+        self.replies = collections.defaultdict(list)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(self.address)
+        self._socket.setblocking(0)
+        loop.add_reader(self._socket, self._read)
+
+    def _read(self):
+        try:
+            data, addr = self._socket.recvfrom(4096)
+        except socket.error:
+            return
+        mid = struct.unpack_from("!H", data, 2)[0]
+        dropped = random.random() < self._loss
+        if addr == self._server:
+            self.replies[mid].append(dropped)
+            destination = self._client
+        else:
+            self._client = addr
+            self.requests[mid].append(dropped)
+            destination = self._server
+        if not dropped:
+            delay = self._delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+            self._loop.call_later(delay, self._socket.sendto, data, destination)
+
+    def transmissions(self):
+        """
+        Return the number of requests sent by the client, retransmissions included.
+        """
+        return sum(len(copies) for copies in self.requests.values())
+
+    def spurious(self):
+        """
+        Return the number of retransmissions sent while the reply to an earlier copy was on its way to the client.
+        The server answers every copy that reaches it, in order.
+        """
+        spurious = 0
+        for mid, copies in self.requests.iteritems():
+            replies = iter(self.replies[mid])
+            answered = False
+            for index, dropped in enumerate(copies):
+                if index > 0 and answered:
+                    spurious += 1
+                if not dropped:
+                    answered = answered or not next(replies, True)
+        return spurious
+
+    def close(self):
+        self._loop.remove_reader(self._socket)
+        self._socket.close()
+
+
+def exchange(client, number, latencies, failed):  # pragma: no cover
+    """
+    Send CON GET requests one after the other, as a constrained client would.
+    """
+    for i in range(number):
+        start = time.time()
+        response = client.get("test")
+        if response is None:
+            failed.append(i)
+        else:
+            latencies.append(time.time() - start)
+
+
+def run(links, number, congestion, port):  # pragma: no cover
+    """
+    Load every link concurrently with its own client.
+
+    :return: the results by link name and the congestion control
+    """
+    server = CoAP(("127.0.0.1", port))
+    server.add_resource("test/", TestResource())
+    listener = threading.Thread(target=server.listen, args=(1,))
+    listener.start()
+    loop = EventLoop()
+    loop.start(name="Relay")
+    results = {}
+    workers = []
+    relays = []
+    for index, (name, delay, jitter, loss) in enumerate(links):
+        relay = LossyRelay(loop, port + 1 + index, ("127.0.0.1", port), delay, jitter, loss)
+        client = HelperClient(relay.address, transport=False, congestion=congestion)
+        latencies = []
+        failed = []
+        worker = threading.Thread(target=exchange, args=(client, number, latencies, failed))
+        worker.start()
+        workers.append(worker)
+        relays.append((name, relay, client, latencies, failed))
+    for worker in workers:
+        worker.join()
+    for name, relay, client, latencies, failed in relays:
+        client.stop()
+        results[name] = (latencies, len(failed), relay.transmissions(), relay.spurious())
+        relay.close()
+    loop.stop()
+    server.close()
+    listener.join()
+    return results
+
+
+def main(argv):  # pragma: no cover
+    number = 20
+    loss = 0.1
+    delay = 1.0
+    port = 5690
+    try:
+        opts, args = getopt.getopt(argv, "hn:l:d:p:", ["help", "number=", "loss=", "delay=", "port="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-n", "--number"):
+            number = int(a)
+        elif o in ("-l", "--loss"):
+            loss = float(a)
+        elif o in ("-d", "--delay"):
+            delay = float(a)
+        elif o in ("-p", "--port"):
+            port = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    logging.disable(logging.WARNING)
+    links = [("lan", 0.001, 0.5, loss), ("slow", delay, 0.3, loss)]
+    print "%d sequential CON GET requests per destination, %.0f%% loss per direction" % (number, loss * 100)
+    print "lan: 1 ms one way, slow: %.0f ms one way +-30%%" % (delay * 1e3)
+    for label, congestion in (("fixed", None), ("cocoa", CoCoA())):
+        results = run(links, number, congestion, port)
+        for name, delay, jitter, loss in links:
+            latencies, failed, transmissions, spurious = results[name]
+            print "%-6s %-5s mean %8.1f ms   p99 %8.1f ms   transmissions %4d   spurious %3d   failed %d" % (
+                label, name, sum(latencies) / max(len(latencies), 1) * 1e3, percentile(latencies, 0.99) * 1e3,
+                transmissions, spurious, failed)
+        if congestion is not None:
+            for destination, state in sorted(congestion.estimators().items()):
+                print "       RTO of %s:%d %.3f s" % (destination[0], destination[1], state["rto"])
+        port += len(links) + 1
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
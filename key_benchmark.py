@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import getopt
+import sys
+import timeit
+
+from coapthon import defines
+from coapthon.layers.messagelayer import str_append_hash
+from coapthon.utils import mid_key, token_key
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tkey_benchmark.py [-n]"
+    print "Options:"
+    print "\t-n, --number=\t\tNumber of packets (default 100000)"
+
+
+def str_keys(host, port, mid, token):
+    """
+    Keys built by MessageLayer.receive_response before the tuple keys.
+    """
+    return (str_append_hash(host, port, mid), str_append_hash(defines.ALL_COAP_NODES, port, mid),
+            str_append_hash(host, port, token), str_append_hash(defines.ALL_COAP_NODES, port, token))
+
+
+def tuple_keys(host, port, mid, token):
+    """
+    Keys built by MessageLayer.receive_response.
+    """
+    return (mid_key(host, port, mid), mid_key(defines.ALL_COAP_NODES, port, mid),
+            token_key(host, port, token), token_key(defines.ALL_COAP_NODES, port, token))
+
+
+def main(argv):  # pragma: no cover
+    number = 100000
+    try:
+        opts, args = getopt.getopt(argv, "hn:", ["help", "number="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-n", "--number"):
+            number = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    for host in ["192.168.1.10", "fe80::1:2ff:fe03:405"]:
+        packets = [(host, 5683, i % 65535, "tk%04d" % (i % 1000)) for i in range(1000)]
+
+        def run(function):
+            for packet in packets:
+                function(*packet)
+
+        repeat = max(number / len(packets), 1)
+        print "%s, %d packets, 4 keys per packet" % (host, repeat * len(packets))
+        for name, function in [("str_append_hash", str_keys), ("mid_key/token_key", tuple_keys)]:
+            seconds = min(timeit.repeat(lambda: run(function), number=repeat, repeat=3))
+            print "%-40s %10.2f us/packet" % (name, seconds * 1e6 / (repeat * len(packets)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
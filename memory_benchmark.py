@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import gc
+import getopt
+import resource
+import sys
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+from coapthon.transaction import Transaction
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tmemory_benchmark.py [-n]"
+    print "Options:"
+    print "\t-n, --number=\t\tNumber of live transactions (default 50000)"
+
+
+def rss():
+    """
+    Return the peak resident set size of the process in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def transactions(number):
+    """
+    Build live transactions as kept by the MessageLayer for EXCHANGE_LIFETIME: a decoded request and the response
+    sent back.
+    """
+    req = Request()
+    req.type = defines.Types["CON"]
+    req.mid = 1
+    req.code = defines.Codes.GET.number
+    req.token = "tk01"
+    req.uri_path = "/sensors/temperature"
+    req.accept = defines.Content_types["application/json"]
+    datagram = Serializer.serialize(req)
+    source = ("127.0.0.1", 5683)
+
+    ret = []
+    for i in range(number):
+        request = Serializer.deserialize(datagram, source)
+        response = Response()
+        response.type = defines.Types["ACK"]
+        response.mid = request.mid
+        response.code = defines.Codes.CONTENT.number
+        response.token = request.token
+        response.destination = source
+        response.content_type = defines.Content_types["application/json"]
+        response.max_age = 60
+        response.payload = '{"t": 21.5}'
+        transaction = Transaction(request=request, response=response, timestamp=i)
+        ret.append(transaction)
+    return ret
+
+
+def main(argv):  # pragma: no cover
+    number = 50000
+    try:
+        opts, args = getopt.getopt(argv, "hn:", ["help", "number="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-n", "--number"):
+            number = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    gc.collect()
+    before = rss()
+    live = transactions(number)
+    gc.collect()
+    after = rss()
+    print "%d live transactions: %.0f bytes/transaction" % (len(live), float(after - before) / len(live))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
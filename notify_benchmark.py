@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+import getopt
+import logging
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+from coapthon import defines
+from coapthon.messages.request import Request
+from coapthon.resources.resource import Resource
+from coapthon.serializer import Serializer
+from coapthon.server.coap import CoAP
+from server_benchmark import percentile
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tnotify_benchmark.py [-o] [-s] [-b] [-d] [-n] [-p]"
+    print "Options:"
+    print "\t-o, --observers=\tNumber of observers (default 10000)"
+    print "\t-s, --sockets=\t\tNumber of client sockets, the observers are spread among them (default 100)"
+    print "\t-b, --busy=\t\tNumber of observers whose transaction is locked during the notification (default 10)"
+    print "\t-d, --hold=\t\tHow long the busy transactions stay locked, in seconds (default 0.5)"
+    print "\t-n, --number=\t\tNumber of notifications (default 5)"
+    print "\t-p, --port=\t\tServer port (default 5690)"
+
+
+class SensorResource(Resource):
+    def __init__(self, name="Sensor", coap_server=None):
+        super(SensorResource, self).__init__(name, coap_server, visible=True, observable=True, allow_children=False)
+        self.payload = "0"
+
+    def render_GET(self, request):
+        return self
+
+
+def token(datagram):
+    """
+    Return the token of a datagram without decoding the rest of the message.
+    """
+    length = struct.unpack_from("!B", datagram)[0] & 0x0F
+    return datagram[4:4 + length]
+
+
+def register(port, sockets, observers):  # pragma: no cover
+    """
+    Register the observers, a window of NON observe requests per socket at a time.
+
+    :return: the tokens of the observers of every socket
+    """
+    tokens = [[] for sock in sockets]
+    for i in range(observers):
+        tokens[i % len(sockets)].append(struct.pack("!I", i))
+    mid = 0
+    for sock, pending in zip(sockets, tokens):
+        pending = set(pending)
+        while len(pending) > 0:
+            # a lost request is sent again with a new MID, so that it is not taken for a duplicate
+            for value in pending:
+                mid = (mid + 1) % 65535
+                request = Request()
+                request.type = defines.Types["NON"]
+                request.code = defines.Codes.GET.number
+                request.mid = mid
+                request.token = value
+                request.observe = 0
+                request.uri_path = "/sensor"
+                sock.sendto(Serializer.serialize(request), ("127.0.0.1", port))
+            try:
+                while len(pending) > 0:
+                    pending.discard(token(sock.recv(4096)))
+            except socket.timeout:
+                pass
+    return tokens
+
+
+def receive(sockets, expected, arrivals, done):  # pragma: no cover
+    """
+    Record the arrival time of one notification per observer.
+    """
+    while len(arrivals) < expected:
+        readable, writable, errors = select.select(sockets, [], [], 10)
+        if len(readable) == 0:
+            break
+        now = time.time()
+        for sock in readable:
+            try:
+                while True:
+                    arrivals.setdefault((sock.fileno(), token(sock.recv(4096))), now)
+            except socket.error:
+                pass
+    done.set()
+
+
+def hold(transactions, duration, locked):  # pragma: no cover
+    """
+    Keep the locks of some transactions, as a long request of those observers would.
+    """
+    for transaction in transactions:
+        transaction._lock.acquire()
+    locked.set()
+    time.sleep(duration)
+    for transaction in transactions:
+        transaction._lock.release()
+
+
+def main(argv):  # pragma: no cover
+    observers = 10000
+    sockets = 100
+    busy = 10
+    duration = 0.5
+    number = 5
+    port = 5690
+    try:
+        opts, args = getopt.getopt(argv, "ho:s:b:d:n:p:", ["help", "observers=", "sockets=", "busy=", "hold=",
+                                                           "number=", "port="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-o", "--observers"):
+            observers = int(a)
+        elif o in ("-s", "--sockets"):
+            sockets = int(a)
+        elif o in ("-b", "--busy"):
+            busy = int(a)
+        elif o in ("-d", "--hold"):
+            duration = float(a)
+        elif o in ("-n", "--number"):
+            number = int(a)
+        elif o in ("-p", "--port"):
+            port = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    logging.disable(logging.WARNING)
+    server = CoAP(("127.0.0.1", port))
+    sensor = SensorResource(coap_server=server)
+    server.add_resource("sensor/", sensor)
+    listener = threading.Thread(target=server.listen, args=(1,))
+    listener.start()
+    clients = []
+    for i in range(sockets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.settimeout(1)
+        clients.append(sock)
+    try:
+        register(port, clients, observers)
+        for sock in clients:
+            sock.setblocking(0)
+        print "%d observers on %d sockets, %d busy for %.0f ms" % (observers, sockets, busy, duration * 1e3)
+        for i in range(number):
+            sensor.payload = str(i + 1)
+            holder = None
+            if busy > 0:
+                locked = threading.Event()
+                relations = random.sample(server._observeLayer._relations.values(), busy)
+                holder = threading.Thread(target=hold, args=([relation.transaction for relation in relations],
+                                                             duration, locked))
+                holder.start()
+                locked.wait()
+            arrivals = {}
+            done = threading.Event()
+            receiver = threading.Thread(target=receive, args=(clients, observers, arrivals, done))
+            receiver.start()
+            start = time.time()
+            server.notify(sensor)
+            returned = time.time() - start
+            done.wait()
+            receiver.join()
+            if holder is not None:
+                holder.join()
+            latencies = sorted(arrival - start for arrival in arrivals.values())
+            print "notify returned %7.1f ms   p50 %7.1f ms   p90 %7.1f ms   p99 %7.1f ms   max %7.1f ms   " \
+                  "delivered %d" % (returned * 1e3, percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.9) * 1e3,
+                                    percentile(latencies, 0.99) * 1e3, percentile(latencies, 1) * 1e3, len(latencies))
+    finally:
+        for sock in clients:
+            sock.close()
+        server.close()
+        listener.join()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import getopt
+import sys
+import timeit
+
+from coapthon import defines
+from coapthon.layers.observelayer import ObserveLayer
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.resources.resource import Resource
+from coapthon.transaction import Transaction
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tobserve_benchmark.py [-o] [-r] [-n]"
+    print "Options:"
+    print "\t-o, --observers=\tNumber of observers (default 50000)"
+    print "\t-r, --resources=\tNumber of observed resources (default 5000)"
+    print "\t-n, --number=\t\tNumber of notify calls (default 100)"
+
+
+def register(layer, resource, source, token):
+    """
+    Register an observer as the server does: receive_request, then send_response of a 2.05 Content.
+    """
+    request = Request()
+    request.type = defines.Types["CON"]
+    request.code = defines.Codes.GET.number
+    request.source = source
+    request.token = token
+    request.observe = 0
+    transaction = Transaction(request=request)
+    layer.receive_request(transaction)
+    transaction.resource = resource
+    transaction.response = Response()
+    transaction.response.code = defines.Codes.CONTENT.number
+    transaction.response.mid = 1
+    transaction.response.token = token
+    layer.send_response(transaction)
+
+
+def scan_notify(layer, resource):
+    """
+    ObserveLayer.notify before the per-resource index: every relation is visited.
+    """
+    ret = []
+    for key in layer._relations.keys():
+        if layer._relations[key].transaction.resource in [resource]:
+            ret.append(layer._relations[key].transaction)
+    return ret
+
+
+def main(argv):  # pragma: no cover
+    observers = 50000
+    resources = 5000
+    number = 100
+    try:
+        opts, args = getopt.getopt(argv, "ho:r:n:", ["help", "observers=", "resources=", "number="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-o", "--observers"):
+            observers = int(a)
+        elif o in ("-r", "--resources"):
+            resources = int(a)
+        elif o in ("-n", "--number"):
+            number = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    layer = ObserveLayer()
+    sensors = []
+    for i in range(resources):
+        resource = Resource("sensor%d" % i)
+        resource.path = "sensor%d" % i
+        sensors.append(resource)
+    for i in range(observers):
+        register(layer, sensors[i % resources], ("10.0.%d.%d" % (i / 250 % 250, i % 250), 5683), "%08x" % i)
+
+    print "%d observers over %d resources, %d notifications" % (observers, resources, number)
+    for name, function in [("full scan", scan_notify), ("per-resource index", lambda l, r: l.notify(r))]:
+        updates = [sensors[i % resources] for i in range(number)]
+
+        def run():
+            for resource in updates:
+                function(layer, resource)
+
+        seconds = min(timeit.repeat(run, number=1, repeat=3))
+        print "%-40s %10.2f us/notify" % (name, seconds * 1e6 / number)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+import getopt
+import logging
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from coapthon.server.coap import CoAP
+from coapthon.server.persistence import RelationLog
+from notify_benchmark import SensorResource, receive, register
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\trestart_benchmark.py [-o] [-s] [-p]"
+    print "Options:"
+    print "\t-o, --observers=\tNumber of observers (default 10000)"
+    print "\t-s, --sockets=\t\tNumber of client sockets, the observers are spread among them (default 100)"
+    print "\t-p, --port=\t\tServer port (default 5690)"
+
+
+def start(port, filename):  # pragma: no cover
+    """
+    Start a server with the sensor resource and a relation log.
+    """
+    server = CoAP(("127.0.0.1", port), relation_log=RelationLog(filename))
+    sensor = SensorResource(coap_server=server)
+    server.add_resource("sensor/", sensor)
+    return server, sensor
+
+
+def stop(server, listener):  # pragma: no cover
+    server.close()
+    listener.join()
+    server._observeLayer.log.close()
+
+
+def main(argv):  # pragma: no cover
+    observers = 10000
+    sockets = 100
+    port = 5690
+    try:
+        opts, args = getopt.getopt(argv, "ho:s:p:", ["help", "observers=", "sockets=", "port="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-o", "--observers"):
+            observers = int(a)
+        elif o in ("-s", "--sockets"):
+            sockets = int(a)
+        elif o in ("-p", "--port"):
+            port = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    logging.disable(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "relations.log")
+    clients = []
+    for i in range(sockets):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.settimeout(1)
+        clients.append(sock)
+    try:
+        print "%d observers on %d sockets" % (observers, sockets)
+        server, sensor = start(port, filename)
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        start_time = time.time()
+        register(port, clients, observers)
+        registration = time.time() - start_time
+        stop(server, listener)
+        print "registration of every observer %10.1f ms   log %d bytes" % (registration * 1e3,
+                                                                             os.path.getsize(filename))
+
+        start_time = time.time()
+        server, sensor = start(port, filename)
+        opened = time.time() - start_time
+        restored = server.restore_relations()
+        restart = time.time() - start_time
+        print "warm restart                   %10.1f ms   log read %.1f ms   relations restored %d" % (
+            restart * 1e3, opened * 1e3, restored)
+
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        try:
+            for sock in clients:
+                sock.setblocking(0)
+            arrivals = {}
+            done = threading.Event()
+            receiver = threading.Thread(target=receive, args=(clients, observers, arrivals, done))
+            receiver.start()
+            sensor.payload = "1"
+            server.notify(sensor)
+            done.wait()
+            receiver.join()
+            print "notified after the restart without registering again: %d" % len(arrivals)
+        finally:
+            stop(server, listener)
+    finally:
+        for sock in clients:
+            sock.close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
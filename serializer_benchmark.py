@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import getopt
+import sys
+import timeit
+
+from coapthon import defines
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tserializer_benchmark.py [-n] [-b] [-s]"
+    print "Options:"
+    print "\t-n, --number=\t\tNumber of repetitions (default 200)"
+    print "\t-b, --batch=\t\tNumber of messages per batch (default 100)"
+    print "\t-s, --size=\t\tPayload size in bytes (default 64)"
+
+
+def notifications(batch, size):
+    """
+    Build a batch of notifications as produced by CoAP.notify: same options and payload, different token,
+    MID and Observe value.
+    """
+    messages = []
+    for i in range(batch):
+        response = Response()
+        response.type = defines.Types["NON"]
+        response.mid = i
+        response.code = defines.Codes.CONTENT.number
+        response.token = "tk%04d" % i
+        response.destination = ("127.0.0.1", 5683)
+        response.observe = i + 2
+        response.content_type = defines.Content_types["application/json"]
+        response.max_age = 60
+        response.payload = "x" * size
+        messages.append(response)
+    return messages
+
+
+def report(name, seconds, number, batch):
+    print "%-40s %10.2f us/message" % (name, seconds * 1e6 / (number * batch))
+
+
+def main(argv):  # pragma: no cover
+    number = 200
+    batch = 100
+    size = 64
+    try:
+        opts, args = getopt.getopt(argv, "hn:b:s:", ["help", "number=", "batch=", "size="])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-n", "--number"):
+            number = int(a)
+        elif o in ("-b", "--batch"):
+            batch = int(a)
+        elif o in ("-s", "--size"):
+            size = int(a)
+        else:
+            usage()
+            sys.exit(2)
+
+    messages = notifications(batch, size)
+    datagrams = [Serializer.serialize(m) for m in messages]
+    sources = [m.destination for m in messages]
+
+    def serialize_struct():
+        for m in messages:
+            Serializer.serialize_struct(m)
+
+    def serialize_buffer():
+        for m in messages:
+            Serializer.serialize_buffer(m)
+
+    def serialize_many():
+        Serializer.serialize_many(messages)
+
+    def deserialize_struct():
+        for d, s in zip(datagrams, sources):
+            Serializer.deserialize_struct(d, s)
+
+    def deserialize_buffer():
+        for d, s in zip(datagrams, sources):
+            Serializer.deserialize_buffer(d, s)
+
+    def deserialize_many():
+        Serializer.deserialize_many(datagrams, sources)
+
+    print "%d batches of %d messages, %d bytes payload" % (number, batch, size)
+    for name, function in [("serialize_struct (loop)", serialize_struct),
+                           ("serialize_buffer (loop)", serialize_buffer),
+                           ("serialize_many", serialize_many),
+                           ("deserialize_struct (loop)", deserialize_struct),
+                           ("deserialize_buffer (loop)", deserialize_buffer),
+                           ("deserialize_many", deserialize_many)]:
+        report(name, min(timeit.repeat(function, number=number, repeat=3)), number, batch)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import copy
+import unittest
+from coapthon import defines
+from coapthon.layers.messagelayer import MessageLayer
+from coapthon.messages.message import Message
+from coapthon.messages.option import Option
+from coapthon.messages.request import Request
+from coapthon.messages.response import Response
+from coapthon.serializer import Serializer
+
+__author__ = 'Giacomo Tanganelli'
+
+
+class SerializerTests(unittest.TestCase):
+
+    def _messages(self):
+        messages = []
+
+        empty = Message()
+        empty.type = defines.Types["ACK"]
+        empty.mid = 1
+        messages.append(empty)
+
+        rst = Message()
+        rst.type = defines.Types["RST"]
+        rst.mid = 65535
+        rst.code = defines.Codes.EMPTY.number
+        rst.token = "abcdefgh"
+        messages.append(rst)
+
+        req = Request()
+        req.type = defines.Types["CON"]
+        req.mid = 12345
+        req.code = defines.Codes.GET.number
+        req.token = "tk"
+        req.uri_path = "/seg1/seg2/seg3?first=1&second=2"
+        req.observe = 0
+        req.accept = defines.Content_types["application/json"]
+        req.block2 = (3, 0, 1024)
+        messages.append(req)
+
+        req = Request()
+        req.type = defines.Types["NON"]
+        req.mid = 2
+        req.code = defines.Codes.PUT.number
+        req.uri_path = "storage/" + "x" * 20
+        req.etag = [bytearray([0xc5]), bytearray([0x01, 0x02, 0x03, 0x04])]
+        req.if_match = ["abc"]
+        req.add_if_none_match()
+        req.block1 = (70000, 1, 64)
+        req.payload = "p" * 300
+        messages.append(req)
+
+        req = Request()
+        req.type = defines.Types["CON"]
+        req.mid = 3
+        req.code = defines.Codes.POST.number
+        req.proxy_uri = "coap://127.0.0.1:5683/" + "long" * 50
+        size1 = Option()
+        size1.number = defines.OptionRegistry.SIZE1.number
+        size1.value = 1 << 20
+        req.add_option(size1)
+        routing = Option()
+        routing.number = defines.OptionRegistry.RM_MESSAGE_SWITCHING.number
+        routing.value = bytearray("route")
+        req.add_option(routing)
+        messages.append(req)
+
+        res = Response()
+        res.type = defines.Types["ACK"]
+        res.mid = 4
+        res.code = defines.Codes.CONTENT.number
+        res.token = "token"
+        res.observe = 1 << 16
+        res.content_type = defines.Content_types["application/link-format"]
+        res.max_age = 1 << 30
+        res.location_path = "a/b/c"
+        res.location_query = "q=1&r=2"
+        res.payload = "".join(chr(i % 256) for i in range(2000))
+        messages.append(res)
+        return messages
+
+    def test_buffer_engine_equivalence(self):
+        req = Request()
+        req.type = defines.Types["CON"]
+        req.mid = 5
+        req.code = defines.Codes.GET.number
+        req.uri_query = "q=" + "v" * 400
+        for message in self._messages() + [req]:
+            expected = Serializer.serialize_struct(message).raw
+            self.assertEqual(Serializer.serialize_buffer(message), expected)
+            # the buffer is reused: a second run must produce the same bytes
+            self.assertEqual(Serializer.serialize_buffer(message), expected)
+
+    def test_buffer_engine_roundtrip(self):
+        for message in self._messages():
+            datagram = Serializer.serialize(message, defines.SERIALIZER_BUFFER)
+            received = Serializer.deserialize(datagram, ("127.0.0.1", 5683))
+            self.assertEqual(Serializer.serialize(received, defines.SERIALIZER_BUFFER), datagram)
+
+    def test_buffer_engine_invalid(self):
+        message = Message()
+        message.type = defines.Types["CON"]
+        self.assertIsNone(Serializer.serialize_buffer(message))
+
+    def test_buffer_decoder_equivalence(self):
+        for message in self._messages():
+            datagram = Serializer.serialize(message)
+            expected = Serializer.deserialize_struct(datagram, ("127.0.0.1", 5683))
+            received = Serializer.deserialize_buffer(datagram, ("127.0.0.1", 5683))
+            self.assertEqual(type(received), type(expected))
+            self.assertEqual(received.type, expected.type)
+            self.assertEqual(received.mid, expected.mid)
+            self.assertEqual(received.code, expected.code)
+            self.assertEqual(received.token, expected.token)
+            self.assertEqual([(o.number, o.value) for o in received.options],
+                             [(o.number, o.value) for o in expected.options])
+            self.assertEqual(received.payload, expected.payload)
+
+    def test_buffer_decoder_lazy(self):
+        message = self._messages()[-1]
+        datagram = Serializer.serialize(message)
+        received = Serializer.deserialize_buffer(datagram, ("127.0.0.1", 5683))
+        self.assertIsInstance(received._payload, memoryview)
+        location = [o for o in received.options if o.number == defines.OptionRegistry.LOCATION_PATH.number]
+        self.assertIsInstance(location[0]._value, memoryview)
+        copied = copy.deepcopy(received.options)
+        self.assertEqual(copied, message.options)
+        self.assertEqual(location[0].value, bytearray("a"))
+        self.assertIsInstance(location[0]._value, bytearray)
+        self.assertEqual(received.payload, message.payload)
+        self.assertIsInstance(received._payload, str)
+
+    def test_buffer_decoder_malformed(self):
+        datagram = Serializer.serialize(self._messages()[2])
+        # truncated header, truncated token, truncated Uri-Path value, payload marker without payload
+        for malformed in [datagram[:3], datagram[:5], datagram[:8], datagram + chr(defines.PAYLOAD_MARKER)]:
+            self.assertEqual(Serializer.deserialize_buffer(malformed, ("127.0.0.1", 5683)),
+                             defines.Codes.BAD_REQUEST.number)
+
+    def test_lazy_decoder(self):
+        message = self._messages()[2]
+        datagram = Serializer.serialize(message)
+        received = Serializer.deserialize(datagram, ("127.0.0.1", 5683), lazy=True)
+        self.assertIsInstance(received, Request)
+        self.assertEqual(received.mid, message.mid)
+        self.assertEqual(received.token, message.token)
+        self.assertEqual(received._options, [])
+        self.assertIsNotNone(received._pending)
+        self.assertEqual(received.uri_path, "seg1/seg2/seg3")
+        self.assertIsNone(received._pending)
+        self.assertEqual(Serializer.serialize(received), datagram)
+
+    def test_lazy_decoder_duplicate(self):
+        datagram = Serializer.serialize(self._messages()[2])
+        layer = MessageLayer(1)
+        first = Serializer.deserialize(datagram, ("127.0.0.1", 5683), lazy=True)
+        self.assertIs(Serializer.load(first), first)
+        layer.receive_request(first)
+        duplicate = Serializer.deserialize(datagram, ("127.0.0.1", 5683), lazy=True)
+        transaction = layer.receive_request(duplicate)
+        self.assertIs(transaction.request, first)
+        self.assertTrue(first.duplicated)
+        self.assertIsNotNone(duplicate._pending)
+
+    def test_lazy_decoder_malformed(self):
+        datagram = Serializer.serialize(self._messages()[2])[:8]
+        received = Serializer.deserialize(datagram, ("127.0.0.1", 5683), lazy=True)
+        self.assertIsInstance(received, Request)
+        self.assertEqual(Serializer.load(received), defines.Codes.BAD_REQUEST.number)
+        self.assertEqual(Serializer.load(received), defines.Codes.BAD_REQUEST.number)
+
+    def test_batch(self):
+        messages = self._messages()
+        invalid = Message()
+        invalid.type = defines.Types["CON"]
+        datagrams = Serializer.serialize_many(messages + [invalid])
+        self.assertEqual(len(datagrams), len(messages) + 1)
+        self.assertIsNone(datagrams[-1])
+        for message, datagram in zip(messages, datagrams):
+            self.assertEqual(datagram.tobytes(), Serializer.serialize_struct(message).raw)
+
+        sources = [("127.0.0.1", 5683 + i) for i in range(len(messages))]
+        received = Serializer.deserialize_many(datagrams[:-1], sources)
+        for message, source, datagram in zip(received, sources, datagrams):
+            self.assertEqual(message.source, source)
+            self.assertEqual(Serializer.serialize(message), datagram.tobytes())
+
+    def test_notification_template(self):
+        first = self._messages()[-1]
+        template = Serializer.encode_template(first)
+        self.assertEqual(Serializer.serialize_notification(first, template), Serializer.serialize(first))
+        for token, observe in [("", 0), ("t", 12), ("abcdefgh", 1 << 20)]:
+            response = Response()
+            response.type = defines.Types["CON"]
+            response.mid = 100
+            response.code = first.code
+            response.token = token
+            response.observe = observe
+            for option in first.options:
+                if option.number != defines.OptionRegistry.OBSERVE.number:
+                    response.add_option(option)
+            response.payload = first.payload
+            self.assertEqual(Serializer.serialize_notification(response, template), Serializer.serialize(response))
+
+        response = Response()
+        response.type = defines.Types["NON"]
+        response.mid = 7
+        response.code = defines.Codes.CONTENT.number
+        response.observe = 3
+        template = Serializer.encode_template(response)
+        self.assertEqual(Serializer.serialize_notification(response, template), Serializer.serialize(response))
+
+
+if __name__ == '__main__':
+    unittest.main()
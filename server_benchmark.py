@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import getopt
+import logging
+import multiprocessing
+import socket
+import struct
+import sys
+import time
+
+from coapthon import defines
+from coapthon.datagramio import create_datagram_io
+from coapthon.messages.request import Request
+from coapthon.serializer import Serializer
+from plugtest_resources import TestResource
+
+__author__ = 'Giacomo Tanganelli'
+
+
+def usage():  # pragma: no cover
+    print "Command:\tserver_benchmark.py [-s] [-n] [-w] [-p] [-b]"
+    print "Options:"
+    print "\t-s, --server=\t\tthreaded, aio or both (default both)"
+    print "\t-n, --number=\t\tNumber of requests (default 5000)"
+    print "\t-w, --window=\t\tNumber of outstanding requests (default 64)"
+    print "\t-p, --port=\t\tServer port (default 5690)"
+    print "\t-b, --batch\t\tReceive and send with recvmmsg/sendmmsg, where available"
+
+
+def serve(kind, port, ready, batch=False):  # pragma: no cover
+    """
+    Run a server with a single resource, without debug logging.
+    """
+    logging.disable(logging.DEBUG)
+    if kind == "aio":
+        from coapthon.server.aio import CoAP
+    else:
+        from coapthon.server.coap import CoAP
+    datagram_io = None
+    if batch:
+        datagram_io = create_datagram_io()
+    server = CoAP(("127.0.0.1", port), datagram_io=datagram_io)
+    server.add_resource("test/", TestResource())
+    ready.set()
+    try:
+        server.listen(1)
+    except KeyboardInterrupt:
+        server.close()
+
+
+def requests(number):
+    """
+    Serialize the CON GET requests sent by the load generator.
+    """
+    datagrams = []
+    for i in range(number):
+        request = Request()
+        request.type = defines.Types["CON"]
+        request.mid = i % 65535
+        request.code = defines.Codes.GET.number
+        request.token = struct.pack("!I", i)
+        request.uri_path = "/test"
+        datagrams.append(Serializer.serialize(request))
+    return datagrams
+
+
+def load(port, datagrams, window):
+    """
+    Send the requests keeping at most window of them outstanding.
+
+    :return: the elapsed time, the latencies of the answered requests and the number of lost requests
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(5)
+    outstanding = {}
+    latencies = []
+    lost = 0
+    sent = 0
+    start = time.time()
+    while sent < len(datagrams) or len(outstanding) > 0:
+        while sent < len(datagrams) and len(outstanding) < window:
+            outstanding[sent % 65535] = time.time()
+            sock.sendto(datagrams[sent], ("127.0.0.1", port))
+            sent += 1
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            lost += len(outstanding)
+            outstanding.clear()
+            continue
+        mid = struct.unpack_from("!BBH", data)[2]
+        if mid in outstanding:
+            latencies.append(time.time() - outstanding.pop(mid))
+    elapsed = time.time() - start
+    sock.close()
+    return elapsed, latencies, lost
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main(argv):  # pragma: no cover
+    kinds = ["threaded", "aio"]
+    number = 5000
+    window = 64
+    port = 5690
+    batch = False
+    try:
+        opts, args = getopt.getopt(argv, "hs:n:w:p:b", ["help", "server=", "number=", "window=", "port=", "batch"])
+    except getopt.GetoptError as err:
+        print str(err)
+        usage()
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-s", "--server"):
+            if a != "both":
+                kinds = [a]
+        elif o in ("-n", "--number"):
+            number = int(a)
+        elif o in ("-w", "--window"):
+            window = int(a)
+        elif o in ("-p", "--port"):
+            port = int(a)
+        elif o in ("-b", "--batch"):
+            batch = True
+        else:
+            usage()
+            sys.exit(2)
+
+    datagrams = requests(number)
+    print "%d CON GET requests, %d outstanding" % (number, window)
+    for kind in kinds:
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=serve, args=(kind, port, ready, batch))
+        process.start()
+        ready.wait()
+        time.sleep(0.5)
+        elapsed, latencies, lost = load(port, datagrams, window)
+        process.terminate()
+        process.join()
+        print "%-10s %10.0f req/s   p50 %7.2f ms   p99 %7.2f ms   lost %d" % (
+            kind, len(latencies) / elapsed, percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.99) * 1e3, lost)
+        port += 1
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
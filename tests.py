@@ -1,13 +1,36 @@
 # -*- coding: utf-8 -*-
+import copy
+import os
 import random
+import shutil
 import socket
+import tempfile
 import threading
+import time
 import unittest
+from coapthon.messages.message import Message
+from coapthon.messages.option import Option
 from coapthon.messages.response import Response
 from coapthon.messages.request import Request
 from coapthon import defines
+from coapthon.client import future
+from coapthon.client.cocoa import CoCoA
+from coapthon.client.helperclient import HelperClient
+from coapthon.client.transport import ClientTransport
+from coapthon.datagramio import BufferPool, DatagramIO, MultipleDatagramIO, PooledDatagramIO
+from coapthon.layers.messagelayer import MessageLayer
+from coapthon.layers.observelayer import ObserveLayer
+from coapthon.resources.resource import Resource
 from coapthon.serializer import Serializer
+from coapthon.server.cluster import Cluster
+from coapthon.server.coap import CoAP
+from coapthon.server.notifications import NotificationScheduler
+from coapthon.server.persistence import RelationLog
+from coapthon.server.workerpool import WorkerPool
+from coapthon.transaction import Transaction
+from coapthon.utils import mid_key, token_key
 from plugtest_coapserver import CoAPServerPlugTest
+from plugtest_resources import ObservableResource, TestResource
 
 __author__ = 'Giacomo Tanganelli'
 
@@ -92,6 +115,1124 @@ class Tests(unittest.TestCase):
 
         self.assertEqual(req.etag, received_message.etag)
 
+    def test_slots(self):
+        transaction = Transaction(request=Request(), response=Response())
+        for obj in [transaction, transaction.request, transaction.response, Option()]:
+            self.assertFalse(hasattr(obj, "__dict__"))
+        with self.assertRaises(AttributeError):
+            transaction.request.unknown = None
+
+    def test_option_list(self):
+        req = Request()
+        req.observe = 0
+        req.uri_path = "/a/b/c"
+        req.accept = defines.Content_types["application/json"]
+        req.etag = [bytearray("x"), bytearray("y")]
+        self.assertEqual([option.number for option in req.options], sorted(option.number for option in req.options))
+        self.assertEqual(req.uri_path, "a/b/c")
+        self.assertEqual(req.observe, 0)
+        self.assertEqual(req.etag, [bytearray("x"), bytearray("y")])
+        self.assertEqual(req.options.get(defines.OptionRegistry.ACCEPT.number).value,
+                         defines.Content_types["application/json"])
+        with self.assertRaises(TypeError):
+            req.observe = 1
+            req.add_option(req.options.get(defines.OptionRegistry.OBSERVE.number))
+
+        del req.uri_path
+        self.assertEqual(req.uri_path, "")
+        self.assertFalse(req.options.has(defines.OptionRegistry.URI_PATH.number))
+        req.del_option(req.options.get(defines.OptionRegistry.ETAG.number))
+        self.assertEqual(req.etag, [bytearray("y")])
+        options = list(req.options)
+        del req.options[0]
+        self.assertEqual(req.options, options[1:])
+        self.assertEqual(req.etag, [])
+        self.assertEqual(req.observe, 1)
+
+        copied = copy.deepcopy(req.options)
+        self.assertEqual(copied, req.options)
+        self.assertEqual(copied.get_all(defines.OptionRegistry.ACCEPT.number), [options[-1]])
+        self.assertIsNone(req.options._index)
+
+        # a long list is indexed on the first lookup, and the index follows the changes
+        req = Request()
+        req.uri_path = "/a/b/c/d/e/f/g/h/i/j"
+        self.assertIsNone(req.options._index)
+        req.observe = 0
+        self.assertIsNotNone(req.options._index)
+        self.assertEqual(req.uri_path, "a/b/c/d/e/f/g/h/i/j")
+        req.accept = defines.Content_types["application/json"]
+        self.assertEqual(req.accept, defines.Content_types["application/json"])
+        req.del_option(req.options.get(defines.OptionRegistry.URI_PATH.number))
+        self.assertEqual(req.uri_path, "b/c/d/e/f/g/h/i/j")
+        del req.uri_path
+        self.assertFalse(req.options.has(defines.OptionRegistry.URI_PATH.number))
+        self.assertEqual(req.observe, 0)
+
+    def test_transaction_keys(self):
+        self.assertNotEqual(token_key("127.0.0.1", 5683, "1a"), token_key("127.0.0.1", 56831, "a"))
+        self.assertNotEqual(mid_key("10.0.0.1", 1, 23), mid_key("10.0.0.12", 1, 3))
+        self.assertEqual(mid_key("FE80::1", 5683, 1), mid_key("fe80:0:0::1", 5683, 1))
+        self.assertEqual(token_key("localhost", 5683, None), token_key("LocalHost", 5683, ""))
+        self.assertEqual(token_key("127.0.0.1", 5683, bytearray("tk")), token_key("127.0.0.1", 5683, "tk"))
+
+    def test_purge(self):
+        layer = MessageLayer(1)
+        lifetime = defines.EXCHANGE_LIFETIME
+        defines.EXCHANGE_LIFETIME = 0
+        try:
+            req = Request()
+            req.type = defines.Types["CON"]
+            req.mid = 1
+            req.token = "old"
+            req.source = ("127.0.0.1", 5683)
+            expired = layer.receive_request(req)
+        finally:
+            defines.EXCHANGE_LIFETIME = lifetime
+        req = Request()
+        req.type = defines.Types["CON"]
+        req.mid = 2
+        req.token = "new"
+        req.source = ("127.0.0.1", 5683)
+        live = layer.receive_request(req)
+
+        layer.purge()
+        self.assertNotIn(expired, layer._transactions.values())
+        self.assertNotIn(expired, layer._transactions_token.values())
+        self.assertEqual(layer._transactions.values(), [live])
+        self.assertEqual(layer._transactions_token.values(), [live])
+        self.assertEqual(len(layer._expiry), 2)
+
+    def test_worker_pool(self):
+        pool = WorkerPool(1, 1)
+        started = threading.Event()
+        release = threading.Event()
+        done = []
+
+        def blocking():
+            started.set()
+            release.wait(5)
+            done.append("blocking")
+
+        self.assertTrue(pool.submit(blocking))
+        started.wait(5)
+        self.assertTrue(pool.submit(done.append, "queued"))
+        self.assertEqual(pool.queue_depth, 1)
+        self.assertFalse(pool.submit(done.append, "rejected"))
+        release.set()
+        pool.shutdown(wait=True)
+        self.assertEqual(done, ["blocking", "queued"])
+        metrics = pool.metrics
+        self.assertEqual(metrics["submitted"], 2)
+        self.assertEqual(metrics["rejected"], 1)
+        self.assertEqual(metrics["completed"], 2)
+        self.assertGreater(metrics["max_handler"], 0)
+
+    def test_service_unavailable(self):
+        print "Service unavailable"
+        pool = WorkerPool(1, 1)
+        self.server._executor = pool
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        self.assertTrue(pool.submit(blocking))
+        started.wait(5)
+        self.assertTrue(pool.submit(release.wait, 5))
+
+        req = Request()
+        req.code = defines.Codes.GET.number
+        req.uri_path = "/test"
+        req.type = defines.Types["CON"]
+        req._mid = self.current_mid
+        req.destination = self.server_address
+
+        expected = Response()
+        expected.type = defines.Types["ACK"]
+        expected._mid = self.current_mid
+        expected.code = defines.Codes.SERVICE_UNAVAILABLE.number
+        expected.token = None
+        expected.payload = None
+        option = Option()
+        option.number = defines.OptionRegistry.MAX_AGE.number
+        option.value = defines.SERVICE_UNAVAILABLE_MAX_AGE
+        expected.add_option(option)
+
+        self.current_mid += 1
+        try:
+            self._test_plugtest([(req, expected)])
+            self.assertEqual(pool.metrics["rejected"], 1)
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_drain(self):
+        print "Drain"
+        self.assertTrue(self.server.listening.wait(5))
+        started = threading.Event()
+        release = threading.Event()
+
+        class BlockingResource(TestResource):
+            def render_GET(self, request):
+                started.set()
+                release.wait(5)
+                return self
+
+        self.server.add_resource("blocking/", BlockingResource())
+        serializer = Serializer()
+        in_flight = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        in_flight.settimeout(5)
+        rejected = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rejected.settimeout(5)
+        drained = []
+        drainer = threading.Thread(target=lambda: drained.append(self.server.drain(5)))
+        try:
+            for sock, path in [(in_flight, "/blocking"), (rejected, "/test")]:
+                req = Request()
+                req.code = defines.Codes.GET.number
+                req.uri_path = path
+                req.type = defines.Types["CON"]
+                req._mid = self.current_mid
+                req.destination = self.server_address
+                self.current_mid += 1
+                sock.sendto(serializer.serialize(req), self.server_address)
+                if sock is in_flight:
+                    self.assertTrue(started.wait(5))
+                    drainer.start()
+                    while not self.server.draining:
+                        time.sleep(0.01)
+
+            datagram, source = rejected.recvfrom(4096)
+            self.assertEqual(serializer.deserialize(datagram, source).code, defines.Codes.SERVICE_UNAVAILABLE.number)
+            self.assertFalse(self.server.stopped.isSet())
+            release.set()
+            datagram, source = in_flight.recvfrom(4096)
+            self.assertEqual(serializer.deserialize(datagram, source).code, defines.Codes.CONTENT.number)
+            drainer.join(5)
+            self.assertEqual(drained, [True])
+            self.assertTrue(self.server.stopped.isSet())
+            # the receive loop is woken up at once, instead of at the socket timeout
+            self.server_thread.join(1)
+            self.assertFalse(self.server_thread.is_alive())
+            self.assertFalse(self.server.listening.isSet())
+        finally:
+            release.set()
+            in_flight.close()
+            rejected.close()
+
+    def test_client_transport(self):
+        print "Client transport"
+        transport = ClientTransport(sockets=2)
+        threads = set(threading.enumerate())
+        try:
+            clients = [HelperClient(self.server_address, transport=transport) for i in range(20)]
+            self.assertEqual(set(threading.enumerate()) - threads, set())
+            self.assertIs(clients[0].protocol, clients[-1].protocol)
+            responses = []
+
+            def get(client):
+                responses.append(client.get("test", timeout=5))
+
+            getters = [threading.Thread(target=get, args=(client,)) for client in clients]
+            for getter in getters:
+                getter.start()
+            for getter in getters:
+                getter.join(10)
+            self.assertEqual(len(responses), len(clients))
+            for response in responses:
+                self.assertIsNotNone(response)
+                self.assertEqual(response.code, defines.Codes.CONTENT.number)
+                self.assertEqual(response.payload, "Test Resource")
+            # the responses have been received by the loop of the transport
+            self.assertIsNone(clients[0].protocol._receiver_thread)
+            for client in clients:
+                client.stop()
+            self.assertTrue(transport.register("token", None))
+            self.assertFalse(transport.register("token", None))
+            # the transport of the process is shared only on request
+            client = HelperClient(self.server_address)
+            self.assertIsNone(client._transport)
+            client.stop()
+            client = HelperClient(self.server_address, transport=True)
+            self.assertIs(client._transport, ClientTransport.default())
+            client.stop()
+            ClientTransport.default().close()
+            # stopping with a pending request ends only the observations
+            silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            silent.bind(("127.0.0.1", 0))
+            client = HelperClient(silent.getsockname(), transport=transport)
+            pending = client.get_async("test", timeout=5)
+            ended = []
+            client.protocol.end_observation = lambda token, server=None: ended.append(token)
+            try:
+                client.stop()
+            finally:
+                del client.protocol.end_observation
+                silent.close()
+            self.assertEqual(ended, [])
+            self.assertTrue(pending.done())
+        finally:
+            transport.close()
+
+    def test_async_client(self):
+        print "Asynchronous client"
+        transport = ClientTransport(sockets=1, nstart=2)
+        try:
+            # NSTART holds for the server, over all the clients of the transport
+            client = HelperClient(self.server_address, transport=transport)
+            other = HelperClient(self.server_address, transport=transport)
+            self.assertIs(client._window, other._window)
+            futures = [c.get_async("test", timeout=5) for i in range(5) for c in (client, other)]
+            self.assertLessEqual(client._window.outstanding, 2)
+            responses = future.gather(futures, timeout=10)
+            for response in responses:
+                self.assertEqual(response.code, defines.Codes.CONTENT.number)
+                self.assertEqual(response.payload, "Test Resource")
+            self.assertEqual(client._window.outstanding, 0)
+            self.assertEqual(len(client.requests), 0)
+
+            client.stop()
+            other.stop()
+
+            silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            silent.bind(("127.0.0.1", 0))
+            client = HelperClient(silent.getsockname(), nstart=1)
+            futures = [client.get_async("test", timeout=0.2) for i in range(3)]
+            # a queued request can be cancelled, a sent one cannot
+            self.assertTrue(futures[0].running())
+            self.assertFalse(futures[0].cancel())
+            self.assertTrue(futures[1].cancel())
+            results = future.gather(futures, timeout=5, return_exceptions=True)
+            self.assertIsInstance(results[0], future.TimeoutError)
+            self.assertIsInstance(results[1], future.CancelledError)
+            self.assertIsInstance(results[2], future.TimeoutError)
+            self.assertEqual(client._window.outstanding, 0)
+            self.assertEqual(len(client.requests), 0)
+            client.stop()
+            silent.close()
+        finally:
+            transport.close()
+
+    def test_cocoa(self):
+        print "CoCoA"
+        congestion = CoCoA(size=2)
+        lan = ("127.0.0.1", 5001)
+        timeout, backoff = congestion.initial_timeout(lan)
+        self.assertTrue(defines.ACK_TIMEOUT <= timeout <= defines.ACK_TIMEOUT * defines.ACK_RANDOM_FACTOR)
+        self.assertEqual(backoff, 2)
+
+        # strong sample: RTO = SRTT + 4 * RTTVAR, averaged with the previous RTO
+        congestion.sample(lan, 0.01, 0)
+        self.assertAlmostEqual(congestion.rto(lan), 0.5 * 0.03 + 0.5 * defines.ACK_TIMEOUT)
+        for i in range(10):
+            congestion.sample(lan, 0.01, 0)
+        self.assertLess(congestion.rto(lan), 0.2)
+        self.assertGreaterEqual(congestion.rto(lan), defines.COCOA_MIN_RTO)
+        self.assertEqual(congestion.initial_timeout(lan)[1], 3)
+        # no samples after more than two retransmissions
+        rto = congestion.rto(lan)
+        congestion.sample(lan, 30, 3)
+        self.assertEqual(congestion.rto(lan), rto)
+        # weak sample
+        congestion.sample(lan, 1, 1)
+        self.assertAlmostEqual(congestion.rto(lan), 0.25 * 1.5 + 0.75 * rto)
+        self.assertEqual(congestion.estimators()[lan]["weak"]["srtt"], 1)
+
+        # an RTO below 1 s unused for 16 RTOs doubles
+        rto = congestion.rto(lan)
+        congestion._endpoints[lan].updated -= 16 * rto + 0.01
+        self.assertAlmostEqual(congestion.rto(lan), 2 * rto)
+
+        # the least recently used destination is forgotten
+        congestion.initial_timeout(("127.0.0.1", 5002))
+        congestion.initial_timeout(("127.0.0.1", 5003))
+        self.assertEqual(len(congestion), 2)
+        self.assertNotIn(lan, congestion)
+        self.assertIsNone(congestion.rto(lan))
+
+        transport = ClientTransport(sockets=1, congestion=CoCoA())
+        try:
+            client = HelperClient(self.server_address, transport=transport)
+            for i in range(3):
+                response = client.get("test", timeout=5)
+                self.assertEqual(response.code, defines.Codes.CONTENT.number)
+            state = transport.congestion.estimators()[self.server_address]
+            self.assertIsNotNone(state["strong"]["srtt"])
+            self.assertLess(state["rto"], defines.ACK_TIMEOUT)
+            client.stop()
+        finally:
+            transport.close()
+
+    def test_observe_index(self):
+        print "Observer index"
+        layer = ObserveLayer()
+        resources = {}
+        for path in ("a", "b"):
+            resources[path] = Resource(path)
+            resources[path].path = path
+
+        def register(path, port, token="tk"):
+            request = Request()
+            request.type = defines.Types["CON"]
+            request.code = defines.Codes.GET.number
+            request.source = ("127.0.0.1", port)
+            request.token = token
+            request.observe = 0
+            transaction = Transaction(request=request)
+            layer.receive_request(transaction)
+            transaction.resource = resources[path]
+            transaction.response = Response()
+            transaction.response.code = defines.Codes.CONTENT.number
+            layer.send_response(transaction)
+            return transaction
+
+        transactions = [register("a", 5000 + i) for i in range(3)] + [register("b", 6000 + i) for i in range(2)]
+        self.assertEqual(layer.observers("a"), 3)
+        self.assertEqual(layer.observers("b"), 2)
+        self.assertEqual(set(layer.notify(resources["a"])), set(transactions[:3]))
+        self.assertEqual(set(layer.notify(resources["b"])), set(transactions[3:]))
+
+        # RST in reply to a notification
+        rst = Response()
+        rst.type = defines.Types["RST"]
+        layer.receive_empty(rst, transactions[0])
+        # explicit deregistration
+        request = Request()
+        request.source = ("127.0.0.1", 5001)
+        request.token = "tk"
+        request.observe = 1
+        layer.receive_request(Transaction(request=request))
+        self.assertEqual(layer.notify(resources["a"]), [transactions[2]])
+        # notification timed out
+        timeouted = Response()
+        timeouted.destination = ("127.0.0.1", 5002)
+        timeouted.token = "tk"
+        layer.remove_subscriber(timeouted)
+        self.assertEqual(layer.observers("a"), 0)
+        self.assertEqual(layer.notify(resources["a"]), [])
+        self.assertNotIn("a", layer._observers)
+
+        # a renewed registration on another resource moves to its index
+        register("a", 6000)
+        self.assertEqual(layer.observers("a"), 1)
+        self.assertEqual(layer.observers("b"), 1)
+        # an error response ends the relation
+        transaction = register("b", 6001)
+        transaction.response.code = defines.Codes.NOT_FOUND.number
+        layer.send_response(transaction)
+        self.assertEqual(layer.observers("b"), 0)
+        self.assertEqual(len(layer._relations), 1)
+
+    def test_retransmission_scheduler(self):
+        print "Retransmission scheduler"
+        sent = []
+        self.server.send_datagram = sent.append
+        ack_timeout = defines.ACK_TIMEOUT
+        defines.ACK_TIMEOUT = 0.05
+        threads = set(threading.enumerate())
+        try:
+            transactions = []
+            for mid in range(1000):
+                response = Response()
+                response.type = defines.Types["CON"]
+                response.mid = mid
+                response.destination = ("127.0.0.1", 5000)
+                transaction = Transaction(Request(), response)
+                self.server._start_retransmission(transaction, response)
+                transactions.append(transaction)
+            self.assertEqual(set(threading.enumerate()) - threads, set())
+
+            # ACK on all but the last message
+            for transaction in transactions[:-1]:
+                transaction.response.acknowledged = True
+                transaction.retransmit_stop.set()
+                self.assertIsNone(transaction.retransmit_stop)
+                self.assertFalse(transaction.response.timeouted)
+
+            last = transactions[-1]
+            deadline = time.time() + 5
+            while last.retransmit_stop is not None and time.time() < deadline:
+                time.sleep(0.05)
+            self.assertTrue(last.response.timeouted)
+            self.assertEqual(sent, [last.response] * defines.MAX_RETRANSMIT)
+        finally:
+            defines.ACK_TIMEOUT = ack_timeout
+
+    def test_separate_timer(self):
+        print "Separate timer"
+        sent = []
+        self.server.send_datagram = sent.append
+        ack_timeout = defines.ACK_TIMEOUT
+        defines.ACK_TIMEOUT = 0.05
+        threads = set(threading.enumerate())
+        try:
+            transactions = []
+            for mid in range(1000):
+                req = Request()
+                req.type = defines.Types["CON"]
+                req.mid = mid
+                req.source = ("127.0.0.1", 5000)
+                transaction = Transaction(req)
+                transaction.separate_timer = self.server._start_separate_timer(transaction)
+                transactions.append(transaction)
+            self.assertEqual(set(threading.enumerate()) - threads, set())
+
+            # all the handlers but the first answer in time
+            for transaction in transactions[1:]:
+                self.server._stop_separate_timer(transaction.separate_timer)
+            deadline = time.time() + 5
+            while len(sent) == 0 and time.time() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.1)
+            self.assertEqual(len(sent), 1)
+            self.assertEqual(sent[0].type, defines.Types["ACK"])
+            self.assertEqual(sent[0].mid, 0)
+            self.assertTrue(transactions[0].request.acknowledged)
+        finally:
+            defines.ACK_TIMEOUT = ack_timeout
+
+    def test_datagram_io(self):
+        backends = [DatagramIO(batch=4)]
+        if MultipleDatagramIO.available():
+            backends.append(MultipleDatagramIO(batch=4))
+        for backend in backends:
+            receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            receiver.bind(("127.0.0.1", 0))
+            receiver.settimeout(1)
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sender.bind(("127.0.0.1", 0))
+            datagrams = [("datagram %d" % i, receiver.getsockname()) for i in range(6)]
+            try:
+                backend.send(sender, datagrams)
+                received = []
+                while len(received) < len(datagrams):
+                    batch = backend.recv(receiver)
+                    self.assertLessEqual(len(batch), 4)
+                    received.extend(batch)
+                self.assertEqual([data for data, address in received], [data for data, address in datagrams])
+                self.assertEqual(received[0][1], sender.getsockname())
+                self.assertRaises(socket.timeout, backend.recv, receiver)
+
+                # the server sends the memoryviews of serialize_many as they are
+                server = CoAP(("127.0.0.1", 5703), datagram_io=backend)
+                try:
+                    messages = []
+                    for i in range(6):
+                        message = Response()
+                        message.type = defines.Types["NON"]
+                        message.code = defines.Codes.CONTENT.number
+                        message.mid = i
+                        message.token = "t%d" % i
+                        message.payload = "notification %d" % i
+                        message.destination = receiver.getsockname()
+                        messages.append(message)
+                    server.send_datagrams(messages)
+                    received = []
+                    while len(received) < len(messages):
+                        received.extend(backend.recv(receiver))
+                    self.assertEqual([Serializer.deserialize(str(data), address).payload
+                                      for data, address in received],
+                                     ["notification %d" % i for i in range(6)])
+                finally:
+                    server.close()
+                    server._socket.close()
+            finally:
+                receiver.close()
+                sender.close()
+
+    def test_datagram_io_send(self):
+        print "Single datagrams sent through the backend"
+
+        class RecordingIO(DatagramIO):
+            def __init__(self):
+                super(RecordingIO, self).__init__()
+                self.sent = []
+
+            def send(self, sock, datagrams):
+                self.sent.extend(datagrams)
+                super(RecordingIO, self).send(sock, datagrams)
+
+        server_io = RecordingIO()
+        client_io = RecordingIO()
+        server = CoAP(("127.0.0.1", 5705), datagram_io=server_io)
+        server.add_resource("test/", TestResource())
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        client = HelperClient(("127.0.0.1", 5705), datagram_io=client_io)
+        try:
+            response = client.get("test", timeout=5)
+            self.assertEqual(response.payload, "Test Resource")
+            self.assertEqual(len(client_io.sent), 1)
+            self.assertEqual(len(server_io.sent), 1)
+            self.assertEqual(Serializer.deserialize(client_io.sent[0][0], ("127.0.0.1", 0)).uri_path, "test")
+            self.assertEqual(Serializer.deserialize(server_io.sent[0][0], ("127.0.0.1", 5705)).payload,
+                             "Test Resource")
+        finally:
+            client.stop()
+            server.close()
+            listener.join()
+
+    def test_buffer_pool(self):
+        backend = PooledDatagramIO(pool=BufferPool(4096, 1))
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(1)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        messages = []
+        try:
+            for payload in ["first payload", "second"]:
+                req = Request()
+                req.code = defines.Codes.PUT.number
+                req.uri_path = "/storage/" + payload.split()[0]
+                req.type = defines.Types["CON"]
+                req.mid = len(messages)
+                req.payload = payload
+                sender.sendto(Serializer.serialize(req), receiver.getsockname())
+                data, address = backend.recv(receiver)[0]
+                self.assertEqual(type(data), memoryview)
+                self.assertEqual(backend.pool.free, 0)
+                message = Serializer.deserialize(data, address)
+                message.detach()
+                backend.release(data)
+                self.assertEqual(backend.pool.free, 1)
+                messages.append(message)
+            # the second datagram has been received in the buffer of the first one
+            self.assertEqual(messages[0].payload, "first payload")
+            self.assertEqual(messages[0].uri_path, "storage/first")
+            self.assertEqual(messages[1].payload, "second")
+            self.assertRaises(socket.timeout, backend.recv, receiver)
+            self.assertEqual(backend.pool.free, 1)
+        finally:
+            receiver.close()
+            sender.close()
+
+    def test_notification_fan_out(self):
+        print "Notification fan-out"
+        serializer = Serializer()
+        observers = []
+        for token in ["a", "bcd", "efghijkl"]:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(5)
+            req = Request()
+            req.code = defines.Codes.GET.number
+            req.uri_path = "/obs"
+            req.type = defines.Types["NON"]
+            req._mid = self.current_mid
+            req.token = token
+            req.observe = 0
+            req.destination = self.server_address
+            self.current_mid += 1
+            sock.sendto(serializer.serialize(req), self.server_address)
+            datagram, source = sock.recvfrom(4096)
+            received_message = serializer.deserialize(datagram, source)
+            self.assertEqual(received_message.token, token)
+            observers.append((sock, token))
+
+        resource = self.server.root["/obs"]
+        resource.payload = "Notification"
+        self.server.notify(resource)
+        for sock, token in observers:
+            datagram, source = sock.recvfrom(4096)
+            received_message = serializer.deserialize(datagram, source)
+            self.assertEqual(received_message.type, defines.Types["NON"])
+            self.assertEqual(received_message.code, defines.Codes.CONTENT.number)
+            self.assertEqual(received_message.token, token)
+            self.assertEqual(received_message.observe, resource.observe_count)
+            self.assertEqual(received_message.payload, "Notification")
+            sock.close()
+
+    def test_notification_isolation(self):
+        print "Notification isolation"
+        serializer = Serializer()
+        observers = []
+        for token in ["a", "b", "c"]:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(5)
+            req = Request()
+            req.code = defines.Codes.GET.number
+            req.uri_path = "/obs"
+            req.type = defines.Types["NON"]
+            req._mid = self.current_mid
+            req.token = token
+            req.observe = 0
+            req.destination = self.server_address
+            self.current_mid += 1
+            sock.sendto(serializer.serialize(req), self.server_address)
+            sock.recvfrom(4096)
+            observers.append(sock)
+
+        # a request of the first observer holds its transaction
+        busy = [relation.transaction for relation in self.server._observeLayer._relations.values()
+                if relation.transaction.request.token == "a"][0]
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with busy:
+                locked.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        locked.wait()
+        try:
+            resource = self.server.root["/obs"]
+            resource.payload = "Isolated"
+            start = time.time()
+            self.server.notify(resource)
+            self.assertLess(time.time() - start, 1)
+            for sock in observers[1:]:
+                datagram, source = sock.recvfrom(4096)
+                self.assertEqual(serializer.deserialize(datagram, source).payload, "Isolated")
+            observers[0].settimeout(0.2)
+            self.assertRaises(socket.timeout, observers[0].recvfrom, 4096)
+            # the resource changes again while the first observer is still busy
+            resource.payload = "Newer"
+            resource.observe_count += 1
+            self.server.notify(resource)
+            for sock in observers[1:]:
+                datagram, source = sock.recvfrom(4096)
+                self.assertEqual(serializer.deserialize(datagram, source).payload, "Newer")
+        finally:
+            release.set()
+            holder.join()
+        # the busy observer gets the current state, never the old one with the new Observe number
+        observers[0].settimeout(5)
+        datagram, source = observers[0].recvfrom(4096)
+        received = [serializer.deserialize(datagram, source)]
+        observers[0].settimeout(0.3)
+        try:
+            while True:
+                datagram, source = observers[0].recvfrom(4096)
+                received.append(serializer.deserialize(datagram, source))
+        except socket.timeout:
+            pass
+        for received_message in received:
+            self.assertEqual(received_message.token, "a")
+            self.assertEqual(received_message.payload, "Newer")
+            self.assertEqual(received_message.observe, resource.observe_count)
+        for sock in observers:
+            sock.close()
+
+    def test_notification_executor_full(self):
+        print "Notification of a busy observer with a full executor"
+        serializer = Serializer()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(5)
+        req = Request()
+        req.code = defines.Codes.GET.number
+        req.uri_path = "/obs"
+        req.type = defines.Types["NON"]
+        req._mid = self.current_mid
+        req.token = "a"
+        req.observe = 0
+        req.destination = self.server_address
+        self.current_mid += 1
+        sock.sendto(serializer.serialize(req), self.server_address)
+        sock.recvfrom(4096)
+        busy = self.server._observeLayer._relations.values()[0].transaction
+
+        # the executor rejects the notification of the busy observer
+        pool = WorkerPool(1, 1)
+        self.server._executor = pool
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        pool.submit(blocking)
+        started.wait(5)
+        pool.submit(release.wait, 5)
+        locked = threading.Event()
+        unlock = threading.Event()
+
+        def hold():
+            with busy:
+                locked.set()
+                unlock.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        locked.wait()
+        try:
+            resource = self.server.root["/obs"]
+            resource.payload = "Retried"
+            start = time.time()
+            self.server.notify(resource)
+            self.assertLess(time.time() - start, 1)
+            # the scheduler keeps running the other timers meanwhile
+            ran = threading.Event()
+            self.server._scheduler.call_later(0.1, ran.set)
+            self.assertTrue(ran.wait(1))
+            sock.settimeout(0.2)
+            self.assertRaises(socket.timeout, sock.recvfrom, 4096)
+        finally:
+            unlock.set()
+            holder.join()
+        try:
+            sock.settimeout(5)
+            datagram, source = sock.recvfrom(4096)
+            self.assertEqual(serializer.deserialize(datagram, source).payload, "Retried")
+        finally:
+            release.set()
+            pool.shutdown()
+            sock.close()
+
+    def test_notification_scheduler(self):
+        print "Notification scheduler"
+        serializer = Serializer()
+        server = CoAP(("127.0.0.1", 5700), notifier=NotificationScheduler(pmin=0.3, pmax=1.0))
+        resource = ObservableResource(coap_server=server)
+        server.add_resource("obs/", resource)
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        sockets = []
+        try:
+            def register(message_type):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.settimeout(3)
+                sockets.append(sock)
+                req = Request()
+                req.code = defines.Codes.GET.number
+                req.uri_path = "/obs"
+                req.type = message_type
+                req._mid = self.current_mid
+                req.token = "tk"
+                req.observe = 0
+                req.destination = ("127.0.0.1", 5700)
+                self.current_mid += 1
+                sock.sendto(serializer.serialize(req), req.destination)
+                self.assertEqual(receive(sock).code, defines.Codes.CONTENT.number)
+                return sock
+
+            def receive(sock):
+                datagram, source = sock.recvfrom(4096)
+                return serializer.deserialize(datagram, source)
+
+            # a burst of changes is merged into at most one notification every pmin, the last one is delivered
+            sock = register(defines.Types["NON"])
+            for i in range(20):
+                resource.payload = "state %d" % i
+                server.notify(resource)
+                time.sleep(0.02)
+            notifications = [receive(sock)]
+            while notifications[-1].payload != "state 19":
+                notifications.append(receive(sock))
+            self.assertLessEqual(len(notifications), 3)
+            # without changes, a notification every pmax
+            start = time.time()
+            self.assertEqual(receive(sock).payload, "state 19")
+            self.assertLess(time.time() - start, 1.5)
+
+            # a CON observer gets a newer state only after the ACK of the previous notification
+            sock = register(defines.Types["CON"])
+            time.sleep(0.3)
+            resource.payload = "first"
+            server.notify(resource)
+            notification = receive(sock)
+            while notification.payload != "first":
+                notification = receive(sock)
+            self.assertEqual(notification.type, defines.Types["CON"])
+            for payload in ["second", "third"]:
+                resource.payload = payload
+                server.notify(resource)
+            sock.settimeout(0.5)
+            self.assertRaises(socket.timeout, sock.recvfrom, 4096)
+            ack = Message()
+            ack.type = defines.Types["ACK"]
+            ack._mid = notification.mid
+            ack.destination = ("127.0.0.1", 5700)
+            sock.sendto(serializer.serialize(ack), ack.destination)
+            sock.settimeout(3)
+            self.assertEqual(receive(sock).payload, "third")
+        finally:
+            for sock in sockets:
+                sock.close()
+            server.close()
+            listener.join()
+
+    def test_conditional_observe(self):
+        print "Conditional observe attributes"
+        serializer = Serializer()
+        server = CoAP(("127.0.0.1", 5701))
+        resource = ObservableResource(coap_server=server)
+        resource.payload = "20"
+        server.add_resource("obs/", resource)
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        sockets = {}
+        try:
+            def register(name, query):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.settimeout(3)
+                sockets[name] = sock
+                req = Request()
+                req.code = defines.Codes.GET.number
+                req.uri_path = "/obs"
+                if query:
+                    req.uri_query = query
+                req.type = defines.Types["NON"]
+                req._mid = self.current_mid
+                req.token = name
+                req.observe = 0
+                req.destination = ("127.0.0.1", 5701)
+                self.current_mid += 1
+                sock.sendto(serializer.serialize(req), req.destination)
+                sock.recvfrom(4096)
+
+            def received(name):
+                sock = sockets[name]
+                sock.settimeout(0.3)
+                payloads = []
+                try:
+                    while True:
+                        datagram, source = sock.recvfrom(4096)
+                        payloads.append(serializer.deserialize(datagram, source).payload)
+                except socket.timeout:
+                    return payloads
+
+            register("all", None)
+            register("gt", "gt=25")
+            register("lt", "lt=15&pmin=x")
+            register("st", "st=5")
+            self.assertIsNone(server._notifier)
+            for value in ["24", "26", "29", "10"]:
+                resource.payload = value
+                server.notify(resource)
+            self.assertEqual(received("all"), ["24", "26", "29", "10"])
+            self.assertEqual(received("gt"), ["26", "10"])
+            self.assertEqual(received("lt"), ["10"])
+            self.assertEqual(received("st"), ["26", "10"])
+
+            # pmin starts a scheduler, which merges the changes for that observer only
+            register("pmin", "pmin=0.5")
+            self.assertIsNotNone(server._notifier)
+            for value in range(5):
+                resource.payload = str(value)
+                server.notify(resource)
+            self.assertEqual(received("all"), ["0", "1", "2", "3", "4"])
+            sockets["pmin"].settimeout(3)
+            datagram, source = sockets["pmin"].recvfrom(4096)
+            self.assertEqual(serializer.deserialize(datagram, source).payload, "4")
+            self.assertEqual(received("pmin"), [])
+        finally:
+            for sock in sockets.values():
+                sock.close()
+            server.close()
+            listener.join()
+
+    def test_conditional_observe_isolation(self):
+        print "Observers without attributes next to a pmin observer"
+        serializer = Serializer()
+        server = CoAP(("127.0.0.1", 5706))
+        resource = ObservableResource(coap_server=server)
+        resource.payload = "0"
+        server.add_resource("obs/", resource)
+        listener = threading.Thread(target=server.listen, args=(1,))
+        listener.start()
+        sockets = {}
+        try:
+            for name, query, type in [("con", None, "CON"), ("pmin", "pmin=0.5", "NON")]:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.settimeout(2)
+                sockets[name] = sock
+                req = Request()
+                req.code = defines.Codes.GET.number
+                req.uri_path = "/obs"
+                if query:
+                    req.uri_query = query
+                req.type = defines.Types[type]
+                req._mid = self.current_mid
+                req.token = name
+                req.observe = 0
+                req.destination = ("127.0.0.1", 5706)
+                self.current_mid += 1
+                sock.sendto(serializer.serialize(req), req.destination)
+                sock.recvfrom(4096)
+            self.assertIsNotNone(server._notifier)
+            for value in ["1", "2", "3"]:
+                resource.payload = value
+                server.notify(resource)
+            # the CON observer gets every change at once, even if it has not acknowledged the previous ones
+            payloads = set()
+            while len(payloads) < 3:
+                datagram, source = sockets["con"].recvfrom(4096)
+                payloads.add(serializer.deserialize(datagram, source).payload)
+            self.assertEqual(payloads, set(["1", "2", "3"]))
+            # while the pmin observer gets them merged
+            payloads = []
+            sockets["pmin"].settimeout(1)
+            try:
+                while True:
+                    datagram, source = sockets["pmin"].recvfrom(4096)
+                    payloads.append(serializer.deserialize(datagram, source).payload)
+            except socket.timeout:
+                pass
+            self.assertEqual(payloads[-1], "3")
+            self.assertLessEqual(len(payloads), 2)
+        finally:
+            for sock in sockets.values():
+                sock.close()
+            server.close()
+            listener.join()
+
+    def test_relation_log(self):
+        print "Observe relations restored after a restart"
+        serializer = Serializer()
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, "relations.log")
+        sockets = {}
+
+        def start():
+            server = CoAP(("127.0.0.1", 5702), relation_log=RelationLog(filename))
+            resource = ObservableResource(coap_server=server)
+            resource.payload = "20"
+            server.add_resource("obs/", resource)
+            return server, resource
+
+        def listen(server):
+            listener = threading.Thread(target=server.listen, args=(1,))
+            listener.start()
+            return listener
+
+        def stop(server, listener):
+            server.close()
+            listener.join()
+            server._observeLayer.log.close()
+
+        def received(name):
+            datagram, source = sockets[name].recvfrom(4096)
+            return serializer.deserialize(datagram, source)
+
+        try:
+            server, resource = start()
+            listener = listen(server)
+            try:
+                for name, query in [("all", None), ("st", "st=5"), ("gone", None)]:
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sock.settimeout(2)
+                    sockets[name] = sock
+                    req = Request()
+                    req.code = defines.Codes.GET.number
+                    req.uri_path = "/obs"
+                    if query:
+                        req.uri_query = query
+                    req.type = defines.Types["NON"]
+                    req._mid = self.current_mid
+                    req.token = name
+                    req.observe = 0
+                    req.destination = ("127.0.0.1", 5702)
+                    self.current_mid += 1
+                    sock.sendto(serializer.serialize(req), req.destination)
+                    self.assertEqual(received(name).payload, "20")
+                resource.payload = "23"
+                server.notify(resource)
+                self.assertEqual(received("all").payload, "23")
+                self.assertEqual(received("gone").payload, "23")
+                # the observer that cancels is forgotten by the log too
+                req = Request()
+                req.code = defines.Codes.GET.number
+                req.uri_path = "/obs"
+                req.type = defines.Types["NON"]
+                req._mid = self.current_mid
+                req.token = "gone"
+                req.observe = 1
+                req.destination = ("127.0.0.1", 5702)
+                self.current_mid += 1
+                sockets["gone"].sendto(serializer.serialize(req), req.destination)
+                self.assertIsNone(received("gone").observe)
+                resource.observe_count += 1
+                resource.payload = "24"
+                server.notify(resource)
+                last = received("all").observe
+                self.assertEqual(len(server._observeLayer.log), 2)
+            finally:
+                stop(server, listener)
+
+            # a torn record at the end of the log is discarded
+            with open(filename, "ab") as f:
+                f.write("\x01\x00\x40")
+            server, resource = start()
+            self.assertEqual(server.restore_relations(), 2)
+            self.assertEqual(server._observeLayer.observers("/obs"), 2)
+            listener = listen(server)
+            try:
+                resource.payload = "24.5"
+                server.notify(resource)
+                notification = received("all")
+                self.assertEqual(notification.payload, "24.5")
+                self.assertGreater(notification.observe, last)
+                # the value of the last notification to the st observer has been restored too
+                sockets["st"].settimeout(0.3)
+                self.assertRaises(socket.timeout, received, "st")
+                resource.payload = "25.5"
+                server.notify(resource)
+                self.assertEqual(received("st").payload, "25.5")
+            finally:
+                stop(server, listener)
+
+            # a file that is not a relation log is left untouched
+            other = os.path.join(directory, "other.txt")
+            with open(other, "wb") as f:
+                f.write("not a log")
+            self.assertRaises(ValueError, RelationLog, other)
+            with open(other, "rb") as f:
+                self.assertEqual(f.read(), "not a log")
+            # an empty file becomes an empty log
+            empty = os.path.join(directory, "empty.log")
+            open(empty, "wb").close()
+            log = RelationLog(empty)
+            self.assertEqual(len(log), 0)
+            log.close()
+        finally:
+            for sock in sockets.values():
+                sock.close()
+            shutil.rmtree(directory)
+
+    def test_cluster(self):
+        print "Cluster"
+        serializer = Serializer()
+        cluster = Cluster(("127.0.0.1", 5700), lambda server: server.add_resource("test/", TestResource()), workers=2,
+                          replicate=True)
+        self.assertTrue(cluster.start())
+        sockets = []
+        try:
+            for i in range(8):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.settimeout(5)
+                sockets.append(sock)
+
+            def exchange(sock, code, payload=None):
+                req = Request()
+                req.code = code
+                req.uri_path = "/test"
+                req.type = defines.Types["CON"]
+                req._mid = self.current_mid
+                req.payload = payload
+                req.destination = ("127.0.0.1", 5700)
+                self.current_mid += 1
+                sock.sendto(serializer.serialize(req), req.destination)
+                datagram, source = sock.recvfrom(4096)
+                return serializer.deserialize(datagram, source)
+
+            response = exchange(sockets[0], defines.Codes.PUT.number, "Replicated")
+            self.assertEqual(response.code, defines.Codes.CHANGED.number)
+            time.sleep(0.5)
+            for sock in sockets:
+                response = exchange(sock, defines.Codes.GET.number)
+                self.assertEqual(response.code, defines.Codes.CONTENT.number)
+                self.assertEqual(response.payload, "Replicated")
+        finally:
+            for sock in sockets:
+                sock.close()
+            cluster.stop()
+            self.assertEqual(cluster.workers, [])
+
 
 if __name__ == '__main__':
     unittest.main()